@@ -3,11 +3,15 @@ import numpy as np
 from datetime import datetime, timedelta
 from collections import Counter, defaultdict
 import logging
+from metrics import timed
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Entry columns the detectors read, so stored logs can load just these
+ANOMALY_COLUMNS = ['dateTime', 'ipAddress', 'statusCode', 'path']
+
 def detect_error_bursts(df, time_window_minutes=5, threshold_factor=2.0, min_errors=3):
     """
     Detect sudden bursts of error responses (4xx, 5xx) in time windows.
@@ -402,13 +406,16 @@ def analyze_anomalies(df):
     
     # Run all detection algorithms
     logger.info("Detecting error bursts...")
-    error_bursts = detect_error_bursts(df)
+    with timed('anomaly_error_bursts'):
+        error_bursts = detect_error_bursts(df)
     
     logger.info("Detecting high traffic IPs...")
-    high_traffic_ips = detect_high_traffic_ips(df)
+    with timed('anomaly_high_traffic_ips'):
+        high_traffic_ips = detect_high_traffic_ips(df)
     
     logger.info("Detecting unusual patterns...")
-    unusual_patterns = detect_unusual_patterns(df)
+    with timed('anomaly_unusual_patterns'):
+        unusual_patterns = detect_unusual_patterns(df)
     
     logger.info(f"Anomaly detection complete. Found {len(error_bursts)} error bursts, "
                 f"{len(high_traffic_ips)} high traffic IPs, and {len(unusual_patterns)} unusual patterns.")
@@ -1,30 +1,42 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g
 from flask_cors import CORS, cross_origin
 from flask import Response
 import re
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime
 import json
+import importlib
 import logging
-from chat_routes import chat_bp
+import time
 from dotenv import load_dotenv
 import os
 
 # Load environment variables
 load_dotenv()
-import pandas as pd
-import base64
-from collections import Counter
-import logging 
-from user_agents import parse
-from anomaly_detection import analyze_anomalies
-import os
-import psycopg2
+from geo_data import get_geo_table, lookup_geolocation
+from dataset_store import put_dataset, get_dataset, get_dataset_encoded, get_dataset_ips
+from geo_aggregate import get_dataset_geo_aggregate
+from geo_refresh import start_background_refresher
+from local_ingest import IngestPathError, ingest_file
+from log_store import append_entries, list_partitions, read_range_frame
+from log_tail import read_live_entries, read_live_summary, start_live_tail
+from metrics import inc, observe, render_metrics, timed
+from parse_cache import parse_upload
+from profiling import init_profiling
+from response_encoding import entries_response
+from sessions import SESSION_COLUMNS, SESSION_GAP_MINUTES, get_dataset_sessions, summarize_sessions
+from timeseries import TIMESERIES_POINTS, build_series, check_options, get_dataset_buckets, get_store_buckets, parse_bound
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+# Optional feature modules, registered as blueprints when enabled. Their heavy
+# dependencies (Gemini, speech recognition, plotly) are only imported on first use.
+FEATURE_MODULES = {
+    'chat': ('chat_routes', 'chat_bp'),
+    'export': ('export_routes', 'export_bp'),
+}
+FEATURES = [name.strip() for name in os.getenv('FEATURES', 'chat,export').split(',') if name.strip()]
+
 app = Flask(__name__)
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 
 # Configure CORS to allow all origins in development
 CORS(app, resources={
@@ -33,12 +45,57 @@ CORS(app, resources={
         "methods": ["GET", "POST", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization", "Accept"],
         "supports_credentials": False,
-        "expose_headers": ["Content-Range", "X-Content-Range"]
+        "expose_headers": ["Content-Range", "X-Content-Range", "X-Profile-Id"]
     }
 })
 
-# Register the chat blueprint
-app.register_blueprint(chat_bp)
+def register_features(app, features=FEATURES):
+    """Register the blueprints of the enabled feature modules, skipping any that cannot be imported"""
+    for name in features:
+        if name not in FEATURE_MODULES:
+            app.logger.warning(f"Unknown feature '{name}' ignored")
+            continue
+        module_name, blueprint_name = FEATURE_MODULES[name]
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            app.logger.warning(f"Feature '{name}' disabled: {e}")
+            continue
+        app.register_blueprint(getattr(module, blueprint_name))
+
+register_features(app)
+
+# Per-request profiling for admins (only active when PROFILE_TOKEN is set)
+init_profiling(app)
+
+# Keep the geolocation cache up to date for uploaded logs (enabled by GEO_REFRESH_INTERVAL).
+# With PRELOAD_APP the app is imported in the gunicorn master, which must not start
+# threads before forking; gunicorn.conf.py starts the refresher in each worker instead.
+PRELOAD_APP = os.getenv('PRELOAD_APP', '0') == '1'
+# Under `python app.py`, the local ingest pool's spawned processes import this file
+# again as __mp_main__; they only parse, so they must not start background threads.
+START_BACKGROUND = not PRELOAD_APP and __name__ != '__mp_main__'
+if START_BACKGROUND:
+    start_background_refresher()
+
+
+def create_app(preload=None):
+    """
+    Return the configured Flask app, for gunicorn's 'app:create_app()' entry point.
+
+    Args:
+        preload: Build the shared read-only lookup tables now, before workers are
+            forked. Defaults to the PRELOAD_APP environment variable.
+
+    Returns:
+        The Flask application
+    """
+    if preload is None:
+        preload = PRELOAD_APP
+    if preload:
+        from prefork import warm_shared_state
+        warm_shared_state()
+    return app
 
 # @app.route('/api/parse-log', methods=['POST', 'OPTIONS'])
 # def parse_log():
@@ -96,9 +153,27 @@ def basic_authentication():
     if request.method.lower() == 'options':
         return Response()
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    started = g.get('request_started')
+    if started is not None:
+        observe('vns_http_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+    inc('vns_http_requests_total', endpoint=endpoint, status=response.status_code)
+    if request.content_length:
+        inc('vns_bytes_in_total', request.content_length, endpoint=endpoint)
+    if not response.is_streamed and response.content_length:
+        inc('vns_bytes_out_total', response.content_length, endpoint=endpoint)
+    return response
+
 @app.after_request
 def add_cors_headers(response):
-    r = request.referrer[:-1]
+    # Browsers send Origin on cross-origin requests; scrapers and curl may send neither header
+    r = request.headers.get('Origin') or (request.referrer or '')[:-1]
     if r in white:
         response.headers.add('Access-Control-Allow-Origin', r)
         response.headers.add('Access-Control-Allow-Credentials', 'true')
@@ -136,66 +211,129 @@ def parse_log():
             return jsonify({"error": "No selected file"}), 400
             
         app.logger.info(f"Processing file: {file.filename}")
-        content = file.read().decode('utf-8')
-        lines = content.split('\n')
-        lines = [line for line in lines if line.strip()]
-        
-        parsed_entries = parse_nginx_log(lines)
+        # Re-uploads of the same bytes come from the parse cache; grown logs only parse the new tail
+        parsed_entries, cache_info = parse_upload(file.stream, parse_nginx_log)
+        app.logger.info(f"Parse cache {cache_info['cache']}: parsed {cache_info['parsedLines']} lines")
         
         # Calculate summary statistics
-        result = {
+        summary = {
             "fileName": file.filename,
-            "entries": parsed_entries,
+            "datasetId": put_dataset(parsed_entries, file.filename),
             "totalRequests": len(parsed_entries),
             "uniqueVisitors": len(set(entry["ipAddress"] for entry in parsed_entries)),
             "totalBandwidth": sum(entry["bytes"] for entry in parsed_entries),
+            "parseCache": cache_info["cache"],
         }
         
         app.logger.info("Successfully processed file")
-        return jsonify(result)
+        # Entries are streamed (or left out with ?summary=1) in the format the client asked for
+        return entries_response(summary, parsed_entries)
     except Exception as e:
         app.logger.error(f"Error processing request: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/export-summary', methods=['POST'])
-def export_summary():
-    data = request.json
-    if not data or 'entries' not in data:
-        return jsonify({"error": "No data provided"}), 400
-    
-    entries = data.get('entries', [])
-    stats = data.get('stats', {})
-    filters = data.get('filters', {})
-    
-    # Convert entries to DataFrame for easier chart generation
-    df = pd.DataFrame(entries)
-    if not df.empty and 'dateTime' in df.columns:
-        df['dateTime'] = pd.to_datetime(df['dateTime'])
-    
-    # Generate HTML content for the summary report
-    html_content = generate_html_summary(df, stats, filters)
-    
-    # Return HTML content
-    response = jsonify({
-        "content": html_content,
-        "filename": f"nginx_summary_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
-    })
-    
-    return response
+@app.route('/api/datasets/<dataset_id>/entries', methods=['GET'])
+def get_dataset_entries(dataset_id):
+    """Return the entries of a stored upload, e.g. after a ?summary=1 parse, in any response format"""
+    try:
+        dataset = get_dataset_encoded(dataset_id)
+        if dataset is None:
+            return jsonify({"error": "Unknown or expired dataset"}), 404
+        file_name, rows, columns = dataset
+        summary = {"fileName": file_name, "datasetId": dataset_id, "totalRequests": rows}
+        return entries_response(summary, encoded=(rows, columns))
+    except Exception as e:
+        app.logger.error(f"Error serving dataset {dataset_id}: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/ingest-local', methods=['POST'])
+def ingest_local_file():
+    """Parse a log file on this host (under INGEST_ALLOWED_DIRS) through a memory mapping, instead of uploading it"""
+    try:
+        data = request.get_json(silent=True) or {}
+        if not data.get('path'):
+            return jsonify({"error": "No path provided"}), 400
+        workers = data.get('workers')
+        if workers is not None and (not isinstance(workers, int) or isinstance(workers, bool) or workers < 1):
+            return jsonify({"error": "workers must be a positive integer"}), 400
+        try:
+            entries, stats = ingest_file(data['path'], workers)
+        except IngestPathError as e:
+            return jsonify({"error": str(e)}), 403
+        except FileNotFoundError as e:
+            return jsonify({"error": str(e)}), 404
+
+        file_name = os.path.basename(stats["path"])
+        summary = {
+            "fileName": file_name,
+            "datasetId": put_dataset(entries, file_name),
+            "totalRequests": len(entries),
+            "uniqueVisitors": len(set(entry["ipAddress"] for entry in entries)),
+            "totalBandwidth": sum(entry["bytes"] for entry in entries),
+            "ingest": stats,
+        }
+        if data.get('store'):
+            summary["store"] = append_entries(entries, file_name)
+        app.logger.info(f"Ingested {stats['parsed']} entries from {stats['path']} in {stats['seconds']}s")
+        return entries_response(summary, entries)
+    except Exception as e:
+        app.logger.error(f"Error ingesting local file: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/log-store/append', methods=['POST'])
+def append_to_log_store():
+    """Append an uploaded log file, or an earlier upload by its datasetId, to the persistent log store"""
+    try:
+        if 'file' in request.files:
+            file = request.files['file']
+            with timed('decode'):
+                lines = [line for line in file.read().decode('utf-8').split('\n') if line.strip()]
+            with timed('parse'):
+                entries = parse_nginx_log(lines)
+            source = file.filename
+        else:
+            data = request.get_json(silent=True) or {}
+            dataset = get_dataset(data.get('datasetId'))
+            if dataset is None:
+                return jsonify({"error": "Provide a file or the datasetId of an earlier upload"}), 400
+            entries, source = dataset["entries"], dataset["fileName"]
+
+        result = append_entries(entries, source)
+        app.logger.info(f"Stored {result['rows']} entries from {source} across {len(result['days'])} days")
+        return jsonify(result)
+    except Exception as e:
+        app.logger.error(f"Error appending to the log store: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/log-store/partitions', methods=['GET'])
+def get_log_store_partitions():
+    try:
+        return jsonify({"partitions": list_partitions(request.args.get('date_from'), request.args.get('date_to'))})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 @app.route('/api/analyze-anomalies', methods=['POST'])
 def analyze_log_anomalies():
     try:
         data = request.json
-        if not data or 'entries' not in data:
+        if not data or ('entries' not in data and 'date_from' not in data and 'date_to' not in data):
             return jsonify({"error": "No data provided"}), 400
         
-        entries = data.get('entries', [])
-        
-        # Convert entries to DataFrame for anomaly detection
-        df = pd.DataFrame(entries)
-        if not df.empty and 'dateTime' in df.columns:
-            df['dateTime'] = pd.to_datetime(df['dateTime'])
+        import pandas as pd
+        from anomaly_detection import ANOMALY_COLUMNS, analyze_anomalies
+
+        if 'entries' in data:
+            # Convert entries to DataFrame for anomaly detection
+            with timed('dataframe'):
+                df = pd.DataFrame(data.get('entries', []))
+                if not df.empty and 'dateTime' in df.columns:
+                    df['dateTime'] = pd.to_datetime(df['dateTime'])
+        else:
+            # Analyse a date range of the log store, reading only the columns the detectors use
+            try:
+                df = read_range_frame(data.get('date_from'), data.get('date_to'), ANOMALY_COLUMNS)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
         
         # Run anomaly detection
         result = analyze_anomalies(df)
@@ -205,285 +343,6 @@ def analyze_log_anomalies():
         app.logger.error(f"Error detecting anomalies: {str(e)}", exc_info=True)
         return jsonify({"error": str(e), "status": "error"}), 500
 
-# Chart generation functions
-def create_empty_figure(message="No data"):
-    fig = go.Figure()
-    fig.add_annotation(
-        text=message,
-        xref="paper", yref="paper",
-        x=0.5, y=0.5, showarrow=False,
-        font=dict(size=20)
-    )
-    fig.update_layout(height=300)
-    return fig
-
-def generate_requests_over_time_chart(df):
-    if df.empty or 'dateTime' not in df.columns:
-        return create_empty_figure()
-    
-    # Group by hour
-    df['hour'] = df['dateTime'].dt.floor('H')
-    hourly_counts = df.groupby('hour').size().reset_index(name='count')
-    
-    fig = px.line(hourly_counts, x='hour', y='count', 
-                  title='Requests Over Time',
-                  labels={'hour': 'Time', 'count': 'Requests'})
-    fig.update_layout(height=400)
-    return fig
-
-def generate_status_code_dist_chart(df):
-    if df.empty or 'statusCode' not in df.columns:
-        return create_empty_figure()
-    
-    status_counts = df['statusCode'].value_counts().reset_index()
-    status_counts.columns = ['statusCode', 'count']
-    
-    fig = px.bar(status_counts, x='statusCode', y='count',
-                 title='Status Code Distribution',
-                 labels={'statusCode': 'HTTP Status Code', 'count': 'Count'})
-    fig.update_layout(height=400)
-    return fig
-
-def generate_top_ips_chart(df, top_n=10):
-    if df.empty or 'ipAddress' not in df.columns:
-        return create_empty_figure()
-    
-    ip_counts = df['ipAddress'].value_counts().nlargest(top_n).reset_index()
-    ip_counts.columns = ['ipAddress', 'count']
-    
-    fig = px.bar(ip_counts, x='count', y='ipAddress', orientation='h',
-                 title=f'Top {top_n} IP Addresses',
-                 labels={'ipAddress': 'IP Address', 'count': 'Requests'})
-    fig.update_layout(height=400)
-    return fig
-
-def generate_top_paths_chart(df, top_n=10):
-    if df.empty or 'path' not in df.columns:
-        return create_empty_figure()
-    
-    path_counts = df['path'].value_counts().nlargest(top_n).reset_index()
-    path_counts.columns = ['path', 'count']
-    
-    fig = px.bar(path_counts, x='count', y='path', orientation='h',
-                 title=f'Top {top_n} Requested Paths',
-                 labels={'path': 'Path', 'count': 'Requests'})
-    fig.update_layout(height=400)
-    return fig
-
-def generate_http_methods_chart(df):
-    if df.empty or 'method' not in df.columns:
-        return create_empty_figure()
-    
-    method_counts = df['method'].value_counts().reset_index()
-    method_counts.columns = ['method', 'count']
-    
-    fig = px.pie(method_counts, values='count', names='method',
-                 title='HTTP Methods Distribution')
-    fig.update_layout(height=400)
-    return fig
-
-def generate_browser_dist_chart(df, top_n=10):
-    if df.empty or 'userAgent' not in df.columns:
-        return create_empty_figure()
-    
-    # Parse user agents to get browser info
-    browsers = {}
-    for ua_string in df['userAgent']:
-        try:
-            user_agent = parse(ua_string)
-            browser = user_agent.browser.family
-            browsers[browser] = browsers.get(browser, 0) + 1
-        except:
-            browsers['Unknown'] = browsers.get('Unknown', 0) + 1
-    
-    browser_counts = pd.DataFrame(list(browsers.items()), columns=['browser', 'count'])
-    browser_counts = browser_counts.nlargest(top_n, 'count')
-    
-    fig = px.pie(browser_counts, values='count', names='browser',
-                 title=f'Top {top_n} Browsers')
-    fig.update_layout(height=400)
-    return fig
-
-def generate_os_dist_chart(df, top_n=10):
-    if df.empty or 'userAgent' not in df.columns:
-        return create_empty_figure()
-    
-    # Parse user agents to get OS info
-    os_dict = {}
-    for ua_string in df['userAgent']:
-        try:
-            user_agent = parse(ua_string)
-            os_family = user_agent.os.family
-            os_dict[os_family] = os_dict.get(os_family, 0) + 1
-        except:
-            os_dict['Unknown'] = os_dict.get('Unknown', 0) + 1
-    
-    os_counts = pd.DataFrame(list(os_dict.items()), columns=['os', 'count'])
-    os_counts = os_counts.nlargest(top_n, 'count')
-    
-    fig = px.pie(os_counts, values='count', names='os',
-                 title=f'Top {top_n} Operating Systems')
-    fig.update_layout(height=400)
-    return fig
-
-def generate_human_vs_bot_chart(df):
-    if df.empty or 'userAgent' not in df.columns:
-        return create_empty_figure()
-    
-    # Parse user agents to detect bots
-    bot_counts = {'Human': 0, 'Bot': 0}
-    for ua_string in df['userAgent']:
-        try:
-            user_agent = parse(ua_string)
-            if user_agent.is_bot:
-                bot_counts['Bot'] += 1
-            else:
-                bot_counts['Human'] += 1
-        except:
-            bot_counts['Human'] += 1  # Default to human if parsing fails
-    
-    bot_df = pd.DataFrame(list(bot_counts.items()), columns=['type', 'count'])
-    
-    fig = px.pie(bot_df, values='count', names='type',
-                 title='Human vs Bot Traffic')
-    fig.update_layout(height=400)
-    return fig
-
-def generate_top_referrers_chart(df, top_n=10):
-    if df.empty or 'referer' not in df.columns:
-        return create_empty_figure()
-    
-    # Filter out None/null values
-    df_filtered = df[df['referer'].notna()]
-    if df_filtered.empty:
-        return create_empty_figure("No referrer data")
-    
-    # Extract domain from referrer
-    def extract_domain(referer):
-        try:
-            # Simple domain extraction - could be improved
-            domain = referer.split('//')[1].split('/')[0] if '//' in referer else referer
-            return domain
-        except:
-            return "Unknown"
-    
-    df_filtered['domain'] = df_filtered['referer'].apply(extract_domain)
-    referrer_counts = df_filtered['domain'].value_counts().nlargest(top_n).reset_index()
-    referrer_counts.columns = ['domain', 'count']
-    
-    fig = px.bar(referrer_counts, x='count', y='domain', orientation='h',
-                 title=f'Top {top_n} Referrers',
-                 labels={'domain': 'Domain', 'count': 'Requests'})
-    fig.update_layout(height=400)
-    return fig
-
-def generate_response_size_dist_chart(df):
-    if df.empty or 'bytes' not in df.columns:
-        return create_empty_figure()
-    
-    # Create size categories
-    def categorize_size(size):
-        if size == 0:
-            return '0 B'
-        elif size < 1024:
-            return '<1 KB'
-        elif size < 10 * 1024:
-            return '1-10 KB'
-        elif size < 100 * 1024:
-            return '10-100 KB'
-        elif size < 1024 * 1024:
-            return '100 KB-1 MB'
-        else:
-            return '>1 MB'
-    
-    df['size_category'] = df['bytes'].apply(categorize_size)
-    size_counts = df['size_category'].value_counts().reset_index()
-    size_counts.columns = ['category', 'count']
-    
-    # Define order for categories
-    size_order = ['0 B', '<1 KB', '1-10 KB', '10-100 KB', '100 KB-1 MB', '>1 MB']
-    size_counts['order'] = size_counts['category'].apply(lambda x: size_order.index(x) if x in size_order else 999)
-    size_counts = size_counts.sort_values('order')
-    
-    fig = px.bar(size_counts, x='category', y='count',
-                 title='Response Size Distribution',
-                 labels={'category': 'Size Category', 'count': 'Count'})
-    fig.update_layout(height=400)
-    return fig
-
-def generate_html_summary(df, stats, filters):
-    """Generate HTML summary report similar to the one in report.py"""
-    html_content = "<html><head><title>NGINX Log Summary Report</title>"
-    html_content += "<style>body{font-family: sans-serif; margin: 20px;} table{border-collapse: collapse; width: 80%; margin-bottom:20px; margin-left:auto; margin-right:auto;} th,td{border:1px solid #ddd; padding:8px; text-align:left;} th{background-color:#f2f2f2;} .chart-container{text-align:center; margin-bottom:30px;}</style>"
-    html_content += "</head><body>"
-    html_content += f"<h1 style='text-align:center;'>NGINX Log Summary Report - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</h1>"
-    
-    # Add filter information
-    html_content += "<h2>Current Filter Settings:</h2><ul>"
-    html_content += f"<li>Date Range: {filters.get('startDate', 'N/A')} to {filters.get('endDate', 'N/A')}</li>"
-    html_content += f"<li>Method: {filters.get('methodFilter', 'All')}</li>"
-    html_content += f"<li>IP Address Filter: {filters.get('ipAddressFilter', 'None')}</li>"
-    html_content += f"<li>Status Code: {filters.get('statusCodeFilter', 'All')}</li>"
-    html_content += f"<li>Country: {filters.get('countryFilter', 'All')}</li></ul>"
-
-    # Add summary statistics
-    html_content += "<h2>Summary Statistics:</h2><ul>"
-    html_content += f"<li>Total Requests: {stats.get('requests', 0)}</li>"
-    html_content += f"<li>Unique Visitors: {stats.get('sessions', 0)}</li>"
-    html_content += f"<li>Total Bandwidth: {stats.get('bandwidth', 0)} bytes</li></ul>"
-
-    # Add charts to the report
-    html_content += "<h2>Traffic Analysis Charts:</h2>"
-    
-    chart_functions = {
-        "Requests Over Time": generate_requests_over_time_chart,
-        "Status Code Distribution": generate_status_code_dist_chart,
-        "Top IP Addresses": generate_top_ips_chart,
-        "Top Requested Paths": generate_top_paths_chart,
-        "HTTP Methods": generate_http_methods_chart,
-        "Browser Distribution": generate_browser_dist_chart,
-        "OS Distribution": generate_os_dist_chart,
-        "Human vs. Bot": generate_human_vs_bot_chart,
-        "Top Referrers": generate_top_referrers_chart,
-        "Response Size Distribution": generate_response_size_dist_chart
-    }
-    
-    for chart_name, chart_func in chart_functions.items():
-        html_content += f"<div class='chart-container'><h3>{chart_name}</h3>"
-        
-        try:
-            fig = chart_func(df)
-            img_bytes = fig.to_image(format="png", engine="kaleido", width=800, height=400)
-            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-            html_content += f"<img src='data:image/png;base64,{img_base64}' alt='{chart_name}' style='max-width:100%;'>"
-        except Exception as e:
-            html_content += f"<p>Error generating chart: {str(e)}</p>"
-            
-        html_content += "</div>"
-    
-    # Top IPs
-    html_content += "<h2>Top IP Addresses:</h2>"
-    ip_counts = Counter(df['ipAddress'].tolist())
-    top_ips = ip_counts.most_common(10)
-    
-    html_content += "<table><tr><th>IP Address</th><th>Requests</th></tr>"
-    for ip, count in top_ips:
-        html_content += f"<tr><td>{ip}</td><td>{count}</td></tr>"
-    html_content += "</table>"
-
-    # Status Code Distribution
-    html_content += "<h2>Status Code Distribution:</h2>"
-    status_counts = Counter(df['statusCode'].tolist())
-    
-    html_content += "<table><tr><th>Status Code</th><th>Count</th></tr>"
-    for status, count in status_counts.most_common():
-        html_content += f"<tr><td>{status}</td><td>{count}</td></tr>"
-    html_content += "</table>"
-    
-    html_content += "</body></html>"
-    
-    return html_content
-
 def parse_nginx_log(lines):
     # Standard log format regex
     standard_log_regex = r'^(\S+) - (\S+) \[(.*?)\] "(\S+) (.*?) (\S+)" (\d+) (\d+) "([^"]*)" "([^"]*)"'
@@ -491,6 +350,9 @@ def parse_nginx_log(lines):
     empty_request_log_regex = r'^(\S+) - (\S+) \[(.*?)\] "" (\d+) (\d+) "([^"]*)" "([^"]*)"'
     
     parsed_entries = []
+    skipped = 0
+    # Checked once: per-line debug messages are only formatted when they will be logged
+    debug = app.logger.isEnabledFor(logging.DEBUG)
     
     for line in lines:
         match = re.match(standard_log_regex, line)
@@ -507,7 +369,9 @@ def parse_nginx_log(lines):
                 method, path, http_version = '', '', ''
             else:
                 # If neither regex matches, skip this line
-                print(f"Skipping unmatched line: {line}")
+                if debug:
+                    app.logger.debug(f"Skipping unmatched line: {line}")
+                skipped += 1
                 continue
         else:
             # Extract values from standard log format
@@ -532,21 +396,13 @@ def parse_nginx_log(lines):
                 parsed_date = datetime(int(year), month_num, int(day), 
                                       int(hour), int(minute), int(second))
                 date_time_iso = parsed_date.isoformat()
-                print(f"Date parsing details:", {
-                    'original': date_time,
-                    'day': day,
-                    'month': month,
-                    'year': year,
-                    'hour': hour,
-                    'minute': minute,
-                    'second': second,
-                    'parsed_iso': date_time_iso
-                })
+                if debug:
+                    app.logger.debug(f"Date parsing details: {date_time} -> {date_time_iso}")
             else:
-                print(f"Failed to match date pattern in: {date_time}")
+                app.logger.warning(f"Failed to match date pattern in: {date_time}")
                 date_time_iso = None
         except Exception as e:
-            print(f"Error parsing date {date_time}: {str(e)}")
+            app.logger.warning(f"Error parsing date {date_time}: {str(e)}")
             date_time_iso = None
         
         entry = {
@@ -559,41 +415,179 @@ def parse_nginx_log(lines):
             "referer": referer if referer != '-' else None,
             "userAgent": user_agent
         }
-        print(f"Parsed entry:", entry)
+        if debug:
+            app.logger.debug(f"Parsed entry: {entry}")
         parsed_entries.append(entry)
     
-    print(f"Total entries parsed: {len(parsed_entries)}")
+    inc('vns_log_lines_total', len(parsed_entries), result='parsed')
+    inc('vns_log_lines_total', skipped, result='skipped')
+    app.logger.debug(f"Total entries parsed: {len(parsed_entries)}")
     return parsed_entries
 
-# Add new endpoint to serve the geolocation CSV data
+# Add new endpoint to serve the geolocation data
 @app.route('/api/geolocation-data', methods=['GET'])
 def get_geolocation_data():
     try:
-        csv_path = '../csv_output/geo_cache.csv'
-        
-        if os.path.exists(csv_path):
-            # Read CSV file and convert to JSON
-            geo_df = pd.read_csv(csv_path)
-            
-            # Use ip_address as the key in the dictionary
-            geo_data = {}
-            for _, row in geo_df.iterrows():
-                ip = row['ip_address']
-                geo_data[ip] = {
-                    'lat': row['latitude'],
-                    'lng': row['longitude'],
-                    'city': row['city'],
-                    'country': row['country']
-                }
-            
-            return jsonify(geo_data)
-        else:
-            app.logger.error(f"Geolocation CSV file not found at {csv_path}")
+        try:
+            geo_table = get_geo_table()
+        except FileNotFoundError as e:
+            app.logger.error(str(e))
             return jsonify({"error": "Geolocation data file not found"}), 404
+
+        # The body is serialised once per load; repeat requests revalidate with 304
+        response = Response(geo_table.body, mimetype='application/json')
+        response.set_etag(geo_table.etag)
+        response.headers['Last-Modified'] = geo_table.last_modified
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         app.logger.error(f"Error serving geolocation data: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/geolocation-lookup', methods=['POST'])
+def lookup_geolocation_data():
+    try:
+        data = request.json
+        if not data or ('ips' not in data and 'datasetId' not in data):
+            return jsonify({"error": "Provide 'ips' or 'datasetId'"}), 400
+
+        if 'datasetId' in data:
+            ips = get_dataset_ips(data['datasetId'])
+            if ips is None:
+                return jsonify({"error": "Unknown dataset"}), 404
+        else:
+            ips = data['ips']
+            if not isinstance(ips, list):
+                return jsonify({"error": "'ips' must be a list"}), 400
+
+        try:
+            return jsonify(lookup_geolocation(ips))
+        except FileNotFoundError as e:
+            app.logger.error(str(e))
+            return jsonify({"error": "Geolocation data file not found"}), 404
+    except Exception as e:
+        app.logger.error(f"Error looking up geolocation data: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/geo-aggregate', methods=['GET'])
+def get_geo_aggregate():
+    try:
+        dataset_id = request.args.get('datasetId')
+        if not dataset_id:
+            return jsonify({"error": "No datasetId provided"}), 400
+        try:
+            zoom = int(request.args.get('zoom', 2))
+        except ValueError:
+            return jsonify({"error": "zoom must be an integer"}), 400
+
+        try:
+            result = get_dataset_geo_aggregate(dataset_id, zoom)
+        except FileNotFoundError as e:
+            app.logger.error(str(e))
+            return jsonify({"error": "Geolocation data file not found"}), 404
+        if result is None:
+            return jsonify({"error": "Unknown dataset"}), 404
+
+        return jsonify(result)
+    except Exception as e:
+        app.logger.error(f"Error aggregating geolocation data: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/sessions', methods=['GET'])
+def get_sessions():
+    """Session metrics of an uploaded dataset (?datasetId=) or a log store date range (?date_from=&date_to=)"""
+    try:
+        try:
+            gap_minutes = float(request.args.get('gapMinutes', SESSION_GAP_MINUTES))
+        except ValueError:
+            return jsonify({"error": "gapMinutes must be a number"}), 400
+        if gap_minutes <= 0:
+            return jsonify({"error": "gapMinutes must be positive"}), 400
+
+        dataset_id = request.args.get('datasetId')
+        if dataset_id:
+            result = get_dataset_sessions(dataset_id, gap_minutes)
+            if result is None:
+                return jsonify({"error": "Unknown dataset"}), 404
+        elif request.args.get('date_from') or request.args.get('date_to'):
+            try:
+                df = read_range_frame(request.args.get('date_from'), request.args.get('date_to'), SESSION_COLUMNS)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            result = summarize_sessions(df, gap_minutes)
+        else:
+            return jsonify({"error": "No datasetId or date range provided"}), 400
+
+        return jsonify(result)
+    except Exception as e:
+        app.logger.error(f"Error computing sessions: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/timeseries', methods=['GET'])
+def get_timeseries():
+    """Downsampled request, error and byte counts over time of a dataset (?datasetId=) or a log store range (?date_from=&date_to=)"""
+    try:
+        try:
+            points = int(request.args.get('points', TIMESERIES_POINTS))
+        except ValueError:
+            return jsonify({"error": "points must be an integer"}), 400
+        interval = request.args.get('interval', '1m')
+        method = request.args.get('method', 'lttb')
+        try:
+            check_options(interval, points, method)
+            start = parse_bound(request.args.get('from'), 'from')
+            end = parse_bound(request.args.get('to'), 'to')
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        dataset_id = request.args.get('datasetId')
+        if dataset_id:
+            buckets = get_dataset_buckets(dataset_id)
+            if buckets is None:
+                return jsonify({"error": "Unknown dataset"}), 404
+        elif request.args.get('date_from') or request.args.get('date_to'):
+            try:
+                buckets = get_store_buckets(request.args.get('date_from'), request.args.get('date_to'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        else:
+            return jsonify({"error": "No datasetId or date range provided"}), 400
+
+        with timed('timeseries'):
+            result = build_series(buckets, start, end, interval, points, method)
+        return jsonify(result)
+    except Exception as e:
+        app.logger.error(f"Error building time series: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/live/entries', methods=['GET'])
+def get_live_entries():
+    """Entries tailed from server-side logs since the cursor of the previous call (?after=)"""
+    try:
+        after = int(request.args.get('after', 0))
+        limit = int(request.args.get('limit', 0)) or None
+    except ValueError:
+        return jsonify({"error": "after and limit must be integers"}), 400
+    entries, cursor = read_live_entries(after, limit)
+    return entries_response({"cursor": cursor, "totalRequests": len(entries)}, entries)
+
+@app.route('/api/live/summary', methods=['GET'])
+def get_live_summary():
+    summary = read_live_summary()
+    if summary is None:
+        return jsonify({"error": "No live log data; set TAIL_FILES to follow server logs"}), 404
+    return jsonify(summary)
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    # Summed across gunicorn workers when METRICS_DIR is set (gunicorn.conf.py does this)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Follow server-side logs when TAIL_FILES is set; one process at a time holds the lock and tails.
+# As with the geo refresher, gunicorn.conf.py starts it in each worker when preloading.
+if START_BACKGROUND:
+    start_live_tail(parse_nginx_log)
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5001))
     host = os.getenv('HOST', '0.0.0.0')
@@ -0,0 +1,103 @@
+import io
+import re
+import subprocess
+import wave
+
+import numpy as np
+
+# Speech recognition works on 16 kHz mono 16-bit PCM, the same format the frontend records at
+TARGET_SAMPLE_RATE = 16000
+TARGET_SAMPLE_WIDTH = 2
+FFMPEG_TIMEOUT = 10
+
+
+def _wav_pcm(data):
+    """
+    Return (pcm, sample_rate, sample_width) for a WAV upload that needs no transcoding.
+
+    Only uncompressed mono 16-bit WAV is passed through; anything else (including
+    8-bit WAV, whose samples are unsigned) returns None and goes through ffmpeg.
+    """
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return None
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            if wav.getnchannels() != 1 or wav.getcomptype() != 'NONE' or wav.getsampwidth() != TARGET_SAMPLE_WIDTH:
+                return None
+            return wav.readframes(wav.getnframes()), wav.getframerate(), wav.getsampwidth()
+    except (wave.Error, EOFError):
+        return None
+
+
+def _raw_pcm_format(content_type):
+    """
+    Return (sample rate, big-endian) for a raw 16-bit PCM upload, or None.
+
+    audio/L16 samples are big-endian (RFC 2586); audio/pcm is taken as
+    little-endian, the byte order the frontend and speech recognition use.
+    """
+    if not content_type:
+        return None
+    mime, _, params = content_type.partition(';')
+    mime = mime.strip().lower()
+    if mime not in ('audio/l16', 'audio/pcm'):
+        return None
+    match = re.search(r'rate\s*=\s*(\d+)', params)
+    channels = re.search(r'channels\s*=\s*(\d+)', params)
+    if channels and channels.group(1) != '1':
+        return None
+    return (int(match.group(1)) if match else TARGET_SAMPLE_RATE), mime == 'audio/l16'
+
+
+def transcode_to_pcm(data, timeout=FFMPEG_TIMEOUT):
+    """
+    Transcode an audio upload to 16 kHz mono 16-bit PCM by piping it through ffmpeg.
+
+    The upload is written to ffmpeg's stdin and raw samples are read back from its
+    stdout, so nothing touches the disk.
+
+    Raises:
+        subprocess.TimeoutExpired: ffmpeg took longer than timeout seconds
+        subprocess.CalledProcessError: ffmpeg could not decode the upload
+    """
+    result = subprocess.run([
+        'ffmpeg',
+        '-hide_banner', '-loglevel', 'error',
+        '-fflags', '+nobuffer',
+        '-i', 'pipe:0',
+        '-acodec', 'pcm_s16le',
+        '-ar', str(TARGET_SAMPLE_RATE),
+        '-ac', '1',            # Mono audio
+        '-af', 'volume=1.5',   # Boost volume slightly
+        '-flags', '+low_delay',
+        '-f', 's16le',
+        'pipe:1'
+    ], input=data, check=True, capture_output=True, timeout=timeout)
+    return result.stdout
+
+
+def decode_audio(data, content_type=None):
+    """
+    Turn an uploaded recording into raw PCM for speech recognition.
+
+    Mono 16-bit WAV and raw 16-bit PCM uploads are used as they are, with
+    big-endian audio/L16 samples byte-swapped; any other format (the browser's WebM/Opus recordings) is transcoded with ffmpeg.
+
+    Args:
+        data: The uploaded file's bytes
+        content_type: The upload's MIME type, used to recognise raw PCM
+
+    Returns:
+        Tuple (pcm bytes, sample rate, sample width in bytes, whether ffmpeg ran)
+    """
+    wav = _wav_pcm(data)
+    if wav is not None:
+        return wav + (False,)
+    raw = _raw_pcm_format(content_type)
+    if raw is not None:
+        rate, big_endian = raw
+        pcm = data[:len(data) - len(data) % TARGET_SAMPLE_WIDTH]
+        if big_endian:
+            pcm = np.frombuffer(pcm, '>i2').astype('<i2').tobytes()
+        return pcm, rate, TARGET_SAMPLE_WIDTH, False
+    return transcode_to_pcm(data), TARGET_SAMPLE_RATE, TARGET_SAMPLE_WIDTH, True
@@ -0,0 +1,222 @@
+"""
+Benchmark the parse, anomaly detection and export paths on synthetic logs.
+
+Every stage is timed in-process on the same generated input. Each result
+records wall time, throughput, and the peak RSS reached during the stage.
+With --allocations, a second tracemalloc pass also records the peak bytes
+allocated. Results are written as JSON. Pass --baseline to compare against an
+earlier run and flag slowdowns.
+
+    python bench/bench_pipeline.py --lines 100K 1M --output bench-results.json
+    python bench/bench_pipeline.py --lines 100K --baseline bench-results.json
+    python bench/bench_pipeline.py --input ../access.log --stages parse analyze
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(BACKEND_DIR)
+
+from generate_logs import generate, parse_count  # noqa: E402
+
+STAGES = ['parse', 'dataframe', 'sessions', 'timeseries', 'detect_error_bursts',
+          'detect_high_traffic_ips', 'detect_unusual_patterns', 'analyze', 'export']
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS counter (VmHWM); returns False where that isn't supported"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(func, allocations=False):
+    """Run func once and return (result, seconds, peak RSS in MB, peak traced MB or None)"""
+    gc.collect()
+    _reset_peak_rss()
+    started = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - started
+    peak_rss = _peak_rss_mb()
+
+    traced = None
+    if allocations:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        result = func()
+        traced = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result, seconds, peak_rss, traced
+
+
+def load_lines(args, count):
+    if args.input:
+        with open(args.input, encoding='utf-8', errors='replace') as f:
+            return [line for line in f.read().split('\n') if line.strip()]
+    lines = []
+    for chunk in generate(count, seed=args.seed):
+        lines.extend(chunk)
+    return lines
+
+
+def run_size(args, count):
+    import pandas as pd
+    import anomaly_detection
+    from app import parse_nginx_log
+    from export_routes import generate_html_summary
+    from dataset_store import encode_entries
+    from sessions import summarize_sessions
+    from timeseries import build_series, minute_buckets
+
+    lines = load_lines(args, count)
+    results = []
+
+    def record(stage, func):
+        result, seconds, peak_rss, traced = measure(func, args.allocations)
+        row = {
+            "stage": stage,
+            "lines": len(lines),
+            "seconds": round(seconds, 4),
+            "linesPerSecond": round(len(lines) / seconds) if seconds else None,
+            "peakRssMb": round(peak_rss, 1),
+        }
+        if traced is not None:
+            row["peakAllocatedMb"] = round(traced, 1)
+        results.append(row)
+        print(f"{stage:28} {len(lines):>10} lines {seconds:9.3f}s {row['linesPerSecond'] or 0:>12,} lines/s "
+              f"{peak_rss:8.1f} MB peak RSS" + (f" {traced:8.1f} MB allocated" if traced is not None else ''),
+              flush=True)
+        return result
+
+    entries = record('parse', lambda: parse_nginx_log(lines))
+    if args.stages and set(args.stages) <= {'parse'}:
+        return results
+
+    def build_frame():
+        df = pd.DataFrame(entries)
+        df['dateTime'] = pd.to_datetime(df['dateTime'])
+        return df
+
+    df = record('dataframe', build_frame) if _wanted(args, 'dataframe') else build_frame()
+    if _wanted(args, 'sessions'):
+        record('sessions', lambda: summarize_sessions(df))
+    if _wanted(args, 'timeseries'):
+        # Columns as a stored dataset holds them; the stage times the buckets and one downsampled query
+        columns = encode_entries(entries)
+        record('timeseries', lambda: build_series(minute_buckets(columns)))
+    for detector in ('detect_error_bursts', 'detect_high_traffic_ips', 'detect_unusual_patterns'):
+        if _wanted(args, detector):
+            record(detector, lambda: getattr(anomaly_detection, detector)(df.copy()))
+    if _wanted(args, 'analyze'):
+        record('analyze', lambda: anomaly_detection.analyze_anomalies(df.copy()))
+    if _wanted(args, 'export'):
+        stats = {"requests": len(entries), "sessions": df['ipAddress'].nunique(),
+                 "bandwidth": int(df['bytes'].sum())}
+        record('export', lambda: generate_html_summary(df.copy(), stats, {}))
+    return results
+
+
+def _wanted(args, stage):
+    return not args.stages or stage in args.stages
+
+
+def _meta(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=BACKEND_DIR).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import kaleido  # noqa: F401
+        kaleido_available = True
+    except ImportError:
+        kaleido_available = False
+    return {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "seed": args.seed,
+        "input": args.input,
+        "allocations": args.allocations,
+        # Without kaleido the export stage builds the figures but can't render the PNGs
+        "kaleido": kaleido_available,
+    }
+
+
+def compare(results, baseline_path, threshold):
+    """Print the change against a baseline run; returns the stages that got slower than threshold"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(row['stage'], row['lines']): row for row in json.load(f)['results']}
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    for row in results:
+        before = baseline.get((row['stage'], row['lines']))
+        if not before or not before['seconds']:
+            continue
+        change = row['seconds'] / before['seconds'] - 1
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"{row['stage']:28} {row['lines']:>10} {before['seconds']:9.3f}s -> {row['seconds']:9.3f}s "
+              f"({change:+.1%}){flag}")
+        if flag:
+            regressions.append(row['stage'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark log parsing, anomaly detection and report export")
+    parser.add_argument('--lines', nargs='+', default=['100K'], help="Generated log sizes, e.g. 100K 1M 10M")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--input', help="Benchmark an existing log file instead of generated ones")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, help="Only run these stages (parse always runs)")
+    parser.add_argument('--allocations', action='store_true', help="Also measure peak allocations with tracemalloc")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare with an earlier results file")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Slowdown that counts as a regression (default 0.10 = 10%%)")
+    args = parser.parse_args()
+
+    results = []
+    sizes = [None] if args.input else [parse_count(size) for size in args.lines]
+    for count in sizes:
+        results.extend(run_size(args, count))
+
+    report = {"meta": _meta(args), "results": results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {len(results)} results to {args.output}")
+
+    if args.baseline and compare(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Measure how long a worker takes to import the app and how much memory it holds afterwards.
+
+Each run starts a fresh interpreter, so the numbers match what a new gunicorn
+worker pays. Run from the backend directory:
+
+    python bench/bench_startup.py --runs 5
+    python bench/bench_startup.py --features ""      # log parsing only
+    python bench/bench_startup.py --first-request     # also time the first export and chat imports
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['pandas', 'plotly', 'user_agents', 'google.generativeai', 'speech_recognition',
+                 'soundfile', 'psycopg2']
+
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+import app
+import_s = time.perf_counter() - started
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+result = {"import_s": import_s, "rss_mb": rss_mb(),
+          "loaded": [m for m in HEAVY_MODULES if m in sys.modules]}
+if FIRST_REQUEST:
+    started = time.perf_counter()
+    import export_routes
+    export_routes.create_empty_figure()
+    result["first_export_import_s"] = time.perf_counter() - started
+    result["rss_after_export_mb"] = rss_mb()
+print(json.dumps(result))
+'''
+
+
+def run_once(features, first_request):
+    env = dict(os.environ)
+    if features is not None:
+        env['FEATURES'] = features
+    env.pop('GEO_REFRESH_INTERVAL', None)
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\nFIRST_REQUEST = {first_request!r}\n" + PROBE
+    output = subprocess.run([sys.executable, '-c', code], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app import time and baseline RSS per worker")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--features', default=None, help="Override FEATURES, e.g. '' or 'chat'")
+    parser.add_argument('--first-request', action='store_true',
+                        help="Also load the export stack, as the first report request would")
+    parser.add_argument('--json', action='store_true', help="Print the raw results as JSON")
+    args = parser.parse_args()
+
+    results = [run_once(args.features, args.first_request) for _ in range(args.runs)]
+    summary = {
+        "runs": args.runs,
+        "import_s_median": statistics.median(r["import_s"] for r in results),
+        "import_s_min": min(r["import_s"] for r in results),
+        "rss_mb_median": statistics.median(r["rss_mb"] for r in results),
+        "heavy_modules_loaded": results[0]["loaded"],
+    }
+    if args.first_request:
+        summary["first_export_import_s_median"] = statistics.median(r["first_export_import_s"] for r in results)
+        summary["rss_after_export_mb_median"] = statistics.median(r["rss_after_export_mb"] for r in results)
+
+    if args.json:
+        print(json.dumps({"summary": summary, "runs": results}, indent=2))
+        return
+    for key, value in summary.items():
+        print(f"{key:32} {value:.3f}" if isinstance(value, float) else f"{key:32} {value}")
+
+
+if __name__ == '__main__':
+    main()
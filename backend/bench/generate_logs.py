@@ -0,0 +1,180 @@
+"""
+Seeded generator of realistic nginx combined-format access logs.
+
+The traffic mix mirrors what we see in production: mostly human browsers with a
+long tail of IPs, search and AI crawlers, a few aggressive scrapers walking the
+site, empty "" requests from scanners, long query-string paths and short bursts
+of 5xx errors. The same seed always produces the same file.
+
+    python bench/generate_logs.py --lines 1M --output /tmp/access_1m.log
+    python bench/generate_logs.py --lines 100K --seed 7 --output /tmp/access_100k.log.gz
+"""
+import argparse
+import gzip
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+HUMAN_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.3 Safari/605.1.15',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:137.0) Gecko/20100101 Firefox/137.0',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 18_3 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.3 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36 Edg/135.0.0.0',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36',
+]
+HUMAN_WEIGHTS = [0.38, 0.14, 0.08, 0.17, 0.13, 0.07, 0.03]
+
+BOT_AGENTS = [
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)',
+    'Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; GPTBot/1.2; +https://openai.com/gptbot)',
+    'Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)',
+    'Mozilla/5.0 (compatible; SemrushBot/7~bl; +http://www.semrush.com/bot.html)',
+    'WordPress/6.8; https://website.local.lan',
+]
+SCRAPER_AGENTS = ['python-requests/2.32.3', 'curl/8.5.0', 'Go-http-client/1.1', 'Scrapy/2.11.2 (+https://scrapy.org)']
+
+PAGES = ['/', '/music/', '/blog/', '/about/', '/contact/', '/events/', '/shop/', '/news/', '/gallery/',
+         '/feed/', '/sitemap.xml', '/robots.txt', '/wp-login.php', '/wp-admin/admin-ajax.php', '/xmlrpc.php']
+ASSETS = ['/wp-content/themes/simple-grid/style.css', '/wp-content/themes/simple-grid/assets/js/theia-sticky-sidebar.min.js',
+          '/wp-includes/js/jquery/jquery.min.js', '/wp-content/uploads/2025/04/banner.jpg', '/favicon.ico']
+REFERERS = ['-', 'https://www.google.com/', 'https://www.bing.com/', 'https://duckduckgo.com/',
+            'https://website.local.lan/', 'https://t.co/abc123', 'https://www.facebook.com/']
+
+
+def parse_count(value):
+    """Parse a line count such as 100000, 100K, 1M or 10M"""
+    value = value.strip().upper()
+    multiplier = {'K': 1_000, 'M': 1_000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip('KM')) * multiplier)
+
+
+def _ips(rng, count):
+    octets = rng.integers(1, 255, size=(count, 4))
+    return ['.'.join(map(str, row)) for row in octets]
+
+
+def _long_query_path(rng):
+    params = '&'.join(f"utm_{k}={rng.integers(10**6, 10**9)}" for k in ('source', 'medium', 'campaign', 'term'))
+    return f"/shop/?s=product-{rng.integers(1, 5000)}&{params}&fbclid={rng.bytes(24).hex()}"
+
+
+def generate(lines, seed=42, start=datetime(2025, 4, 17, 5, 0, 0), days=15, chunk_size=100_000):
+    """
+    Yield chunks of log lines.
+
+    Args:
+        lines: Total number of lines to generate
+        seed: Random seed; the same seed gives the same output
+        start: Timestamp of the first request
+        days: Span of the log; timestamps are spread over it in order
+        chunk_size: Lines per yielded chunk
+
+    Yields:
+        Lists of formatted log lines (without newlines)
+    """
+    rng = np.random.default_rng(seed)
+
+    # A Zipf-like population of visitors; a handful of scrapers hit much harder
+    human_ips = _ips(rng, max(100, lines // 40))
+    bot_ips = _ips(rng, 60)
+    scraper_ips = _ips(rng, 5)
+    human_rank = 1.0 / np.arange(1, len(human_ips) + 1) ** 0.9
+    human_p = human_rank / human_rank.sum()
+
+    span = days * 86400
+    # Short windows where most requests fail, like a bad deploy or an overloaded upstream
+    burst_starts = np.sort(rng.uniform(0, span, size=max(3, days)))
+    burst_length = 300
+
+    produced = 0
+    while produced < lines:
+        n = min(chunk_size, lines - produced)
+        offsets = np.sort(rng.uniform(produced / lines * span, (produced + n) / lines * span, size=n))
+        kind = rng.choice(4, size=n, p=[0.72, 0.17, 0.09, 0.02])  # human, bot, scraper, empty request
+        human_choice = rng.choice(len(human_ips), size=n, p=human_p)
+        bot_choice = rng.integers(0, len(bot_ips), size=n)
+        scraper_choice = rng.integers(0, len(scraper_ips), size=n)
+        ua_human = rng.choice(len(HUMAN_AGENTS), size=n, p=HUMAN_WEIGHTS)
+        ua_bot = rng.integers(0, len(BOT_AGENTS), size=n)
+        ua_scraper = rng.integers(0, len(SCRAPER_AGENTS), size=n)
+        page = rng.integers(0, len(PAGES), size=n)
+        asset = rng.random(n) < 0.35
+        long_query = rng.random(n) < 0.03
+        method_post = rng.random(n) < 0.06
+        status_roll = rng.random(n)
+        sizes = rng.lognormal(9, 1.3, size=n).astype(np.int64)
+        referer = rng.integers(0, len(REFERERS), size=n)
+
+        idx = np.searchsorted(burst_starts, offsets, side='right') - 1
+        in_burst = (idx >= 0) & (offsets - burst_starts[np.maximum(idx, 0)] < burst_length)
+
+        chunk = []
+        for i in range(n):
+            when = start + timedelta(seconds=float(offsets[i]))
+            stamp = f"{when.day:02d}/{MONTHS[when.month - 1]}/{when.year}:{when.hour:02d}:{when.minute:02d}:{when.second:02d} +0100"
+            k = kind[i]
+            if k == 3:
+                chunk.append(f'{scraper_ips[scraper_choice[i]]} - - [{stamp}] "" 400 0 "-" "-"')
+                continue
+
+            if k == 0:
+                ip, agent = human_ips[human_choice[i]], HUMAN_AGENTS[ua_human[i]]
+            elif k == 1:
+                ip, agent = bot_ips[bot_choice[i]], BOT_AGENTS[ua_bot[i]]
+            else:
+                ip, agent = scraper_ips[scraper_choice[i]], SCRAPER_AGENTS[ua_scraper[i]]
+
+            if long_query[i]:
+                path = _long_query_path(rng)
+            elif k == 2:
+                path = f"/news/{int(offsets[i]) % 50000}/?page={i % 97}"
+            elif asset[i]:
+                path = ASSETS[page[i] % len(ASSETS)]
+            else:
+                path = PAGES[page[i]]
+
+            roll = status_roll[i]
+            if in_burst[i]:
+                status = 500 if roll < 0.5 else 502 if roll < 0.75 else 200
+            else:
+                status = 200 if roll < 0.86 else 304 if roll < 0.91 else 301 if roll < 0.94 else 404 if roll < 0.985 else 403
+            size = 0 if status in (301, 304) else int(sizes[i])
+            method = 'POST' if method_post[i] else 'GET'
+            chunk.append(f'{ip} - - [{stamp}] "{method} {path} HTTP/1.1" {status} {size} '
+                         f'"{REFERERS[referer[i]] if k == 0 else "-"}" "{agent}"')
+        produced += n
+        yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic nginx access log")
+    parser.add_argument('--lines', default='100K', help="Number of lines, e.g. 100K, 1M or 10M")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--days', type=int, default=15)
+    parser.add_argument('--output', default='-', help="Output file; .gz is compressed; - for stdout")
+    args = parser.parse_args()
+
+    lines = parse_count(args.lines)
+    if args.output == '-':
+        out = sys.stdout
+    elif args.output.endswith('.gz'):
+        out = gzip.open(args.output, 'wt', encoding='utf-8', compresslevel=3)
+    else:
+        out = open(args.output, 'w', encoding='utf-8')
+    try:
+        for chunk in generate(lines, seed=args.seed, days=args.days):
+            out.write('\n'.join(chunk))
+            out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+Load-test the API endpoints at a fixed concurrency, to size gunicorn workers.
+
+By default the script starts the stub model server and the app under gunicorn
+with the given worker and thread counts. Chat traffic then reaches the stub
+rather than Gemini. Each endpoint is driven in turn for --duration seconds by
+--concurrency client threads. With --mode mixed, all endpoints are driven at
+the same time, which shows contention between them.
+
+For each endpoint the script reports:
+- throughput and status codes
+- p50, p95 and p99 client latency
+- the mean time the server spent in the handler, from /api/metrics. The
+  difference from the client latency is time spent queued for a worker.
+- worker saturation: handler time divided by the worker slots available
+  (workers x threads) over the run. Near 100% means adding clients only
+  adds queueing.
+
+    python bench/load_test.py --workers 4 --threads 1 --concurrency 8 --duration 20
+    python bench/load_test.py --workers 2 --threads 4 --mode mixed --stub-latency 1.0
+    python bench/load_test.py --url http://127.0.0.1:5001 --slots 1 --endpoints geolocation-data chat
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_logs import generate  # noqa: E402
+
+ENDPOINTS = ['parse-log', 'analyze-anomalies', 'export-summary', 'geolocation-data', 'chat']
+
+# Phrases the local intent parser can't answer, so each unique one goes to the model
+CHAT_QUESTIONS = [
+    "which visitors behaved oddly around {n}",
+    "summarise what the crawlers were doing near request {n}",
+    "anything unusual about traffic pattern {n}",
+]
+_METRIC_RE = re.compile(r'^vns_http_request_seconds_(sum|count)\{endpoint="([^"]+)"\} (\S+)$')
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            _request(base_url, 'GET', '/api/metrics')
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not come up within {timeout}s")
+
+
+def _request(base_url, method, path, body=None, headers=None, connection=None):
+    """Send one request; returns (status, body bytes). Reuses connection when given."""
+    parts = urlsplit(base_url)
+    conn = connection or http.client.HTTPConnection(parts.hostname, parts.port, timeout=120)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        if connection is None:
+            conn.close()
+
+
+def _multipart(field, filename, content):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: text/plain\r\n\r\n').encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+def build_requests(base_url, log_lines, seed, chat_repeat):
+    """
+    Prepare a request factory for each endpoint.
+
+    The generated log is uploaded once, so the analysis and export requests
+    can send the parsed entries the way the frontend does.
+
+    Returns:
+        Dict mapping endpoint name to a function returning (method, path, body, headers)
+    """
+    log = '\n'.join(itertools.chain.from_iterable(generate(log_lines, seed=seed))).encode('utf-8')
+    upload, upload_headers = _multipart('file', 'access.log', log)
+    status, body = _request(base_url, 'POST', '/api/parse-log', upload, upload_headers)
+    if status != 200:
+        raise RuntimeError(f"Preparing the dataset failed: /api/parse-log returned {status}: {body[:200]!r}")
+    parsed = json.loads(body)
+    stats = {"requests": parsed["totalRequests"], "sessions": parsed["uniqueVisitors"],
+             "bandwidth": parsed["totalBandwidth"]}
+    entries_body = json.dumps({"entries": parsed["entries"]}).encode('utf-8')
+    export_body = json.dumps({"entries": parsed["entries"], "stats": stats, "filters": {}}).encode('utf-8')
+    json_headers = {'Content-Type': 'application/json'}
+    counter = itertools.count()
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def chat():
+        with lock:
+            # A share of questions repeat, as real users ask the same things
+            n = rng.randrange(10) if rng.random() < chat_repeat else next(counter) + 10
+        message = CHAT_QUESTIONS[n % len(CHAT_QUESTIONS)].format(n=n)
+        return 'POST', '/api/chat', json.dumps({"message": message}).encode('utf-8'), json_headers
+
+    return {
+        'parse-log': lambda: ('POST', '/api/parse-log', upload, upload_headers),
+        'analyze-anomalies': lambda: ('POST', '/api/analyze-anomalies', entries_body, json_headers),
+        'export-summary': lambda: ('POST', '/api/export-summary', export_body, json_headers),
+        'geolocation-data': lambda: ('GET', '/api/geolocation-data', None, None),
+        'chat': chat,
+    }
+
+
+def server_times(base_url):
+    """Return {endpoint path: (handler seconds, requests)} from /api/metrics"""
+    _, body = _request(base_url, 'GET', '/api/metrics')
+    totals = {}
+    for line in body.decode('utf-8').splitlines():
+        match = _METRIC_RE.match(line)
+        if match:
+            kind, endpoint, value = match.groups()
+            seconds, count = totals.get(endpoint, (0.0, 0))
+            totals[endpoint] = (seconds + float(value), count) if kind == 'sum' else (seconds, count + int(value))
+    return totals
+
+
+def drive(base_url, factories, concurrency, duration):
+    """Run concurrency client threads for duration seconds; returns {endpoint: [(seconds, status)]}"""
+    samples = {name: [] for name in factories}
+    names = itertools.cycle(list(factories))
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        parts = urlsplit(base_url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=120)
+        while time.monotonic() < deadline:
+            with lock:
+                name = next(names)
+            method, path, body, headers = factories[name]()
+            started = time.perf_counter()
+            try:
+                status, _ = _request(base_url, method, path, body, headers, connection=conn)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=120)
+                status = 'error'
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples[name].append((elapsed, status))
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarise(name, samples, elapsed, before, after, slots):
+    latencies = sorted(seconds for seconds, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    path = f'/api/{name}'
+    handler_seconds = after.get(path, (0.0, 0))[0] - before.get(path, (0.0, 0))[0]
+    handled = after.get(path, (0.0, 0))[1] - before.get(path, (0.0, 0))[1]
+    return {
+        "endpoint": name,
+        "requests": len(samples),
+        "statuses": statuses,
+        "throughput": round(len(samples) / elapsed, 2),
+        "p50Ms": _ms(percentile(latencies, 0.50)),
+        "p95Ms": _ms(percentile(latencies, 0.95)),
+        "p99Ms": _ms(percentile(latencies, 0.99)),
+        "serverMeanMs": _ms(handler_seconds / handled) if handled else None,
+        "saturation": round(handler_seconds / (elapsed * slots), 3) if slots else None,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def print_table(rows):
+    print(f"{'endpoint':20} {'reqs':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'server ms':>10} {'saturation':>10}  statuses")
+    for row in rows:
+        saturation = f"{row['saturation']:.0%}" if row['saturation'] is not None else '-'
+        server = row['serverMeanMs'] if row['serverMeanMs'] is not None else '-'
+        print(f"{row['endpoint']:20} {row['requests']:>6} {row['throughput']:>8} {row['p50Ms'] or '-':>9} "
+              f"{row['p95Ms'] or '-':>9} {row['p99Ms'] or '-':>9} {server:>10} {saturation:>10}  "
+              f"{json.dumps(row['statuses'])}")
+
+
+def start_servers(args, workdir):
+    """Start the stub model server and gunicorn; returns (base URL, processes)"""
+    processes = []
+    env = dict(os.environ)
+    if not args.no_stub:
+        stub_port = _free_port()
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(BACKEND_DIR, 'bench', 'stub_model_server.py'), '--port', str(stub_port),
+             '--latency', str(args.stub_latency), '--jitter', str(args.stub_jitter)],
+            stdout=subprocess.DEVNULL))
+        stub_url = f'http://127.0.0.1:{stub_port}'
+        env.update(CHAT_MODEL_STUB_URL=stub_url, SPEECH_STUB_URL=stub_url)
+
+    port = _free_port()
+    env.update(
+        BIND=f'127.0.0.1:{port}',
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        GUNICORN_TIMEOUT='300',
+        # A fresh chat cache per run, and every request visible in /api/metrics straight away
+        CHAT_CACHE_DB=os.path.join(workdir, 'chat_cache.db'),
+        METRICS_DIR=os.path.join(workdir, 'metrics'),
+        METRICS_FLUSH_INTERVAL='0',
+        LOG_LEVEL=env.get('LOG_LEVEL', 'WARNING'),
+    )
+    if args.preload:
+        env['PRELOAD_APP'] = '1'
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    processes.append(subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+                                      cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT))
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        _wait_until_up(base_url, processes[-1])
+    except RuntimeError:
+        stop_servers(processes)
+        raise
+    return base_url, processes
+
+
+def stop_servers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the log analysis API")
+    parser.add_argument('--url', help="Test a running server instead of starting one")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers to start")
+    parser.add_argument('--threads', type=int, default=1, help="Threads per gunicorn worker")
+    parser.add_argument('--slots', type=int,
+                        help="Worker slots of the server under test, for saturation (default workers x threads)")
+    parser.add_argument('--preload', action='store_true', help="Start gunicorn with PRELOAD_APP=1")
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument('--concurrency', type=int, default=4, help="Client threads")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds per endpoint (or in total when mixed)")
+    parser.add_argument('--mode', choices=['phased', 'mixed'], default='phased',
+                        help="Drive endpoints one after another, or all at once")
+    parser.add_argument('--log-lines', type=int, default=5000, help="Size of the uploaded log")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chat-repeat', type=float, default=0.2,
+                        help="Fraction of chat questions that repeat earlier ones and can hit the cache")
+    parser.add_argument('--no-stub', action='store_true', help="Don't start the stub model server")
+    parser.add_argument('--stub-latency', type=float, default=0.5, help="Seconds the stub waits per call")
+    parser.add_argument('--stub-jitter', type=float, default=0.1)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    slots = args.slots or (None if args.url else args.workers * args.threads)
+    processes = []
+    with tempfile.TemporaryDirectory(prefix='vns-load-') as workdir:
+        try:
+            if args.url:
+                base_url = args.url.rstrip('/')
+                _wait_until_up(base_url, None, timeout=5)
+            else:
+                base_url, processes = start_servers(args, workdir)
+            factories = build_requests(base_url, args.log_lines, args.seed, args.chat_repeat)
+
+            rows = []
+            groups = [args.endpoints] if args.mode == 'mixed' else [[name] for name in args.endpoints]
+            for group in groups:
+                print(f"Driving {', '.join(group)} with {args.concurrency} clients for {args.duration:g}s...",
+                      flush=True)
+                before = server_times(base_url)
+                started = time.perf_counter()
+                samples = drive(base_url, {name: factories[name] for name in group}, args.concurrency, args.duration)
+                elapsed = time.perf_counter() - started
+                after = server_times(base_url)
+                rows.extend(summarise(name, samples[name], elapsed, before, after, slots) for name in group)
+        finally:
+            stop_servers(processes)
+
+    print()
+    print_table(rows)
+    if args.output:
+        report = {"config": {"url": args.url, "workers": None if args.url else args.workers,
+                             "threads": None if args.url else args.threads, "slots": slots,
+                             "preload": args.preload, "concurrency": args.concurrency, "duration": args.duration,
+                             "mode": args.mode, "logLines": args.log_lines,
+                             "stubLatency": None if args.no_stub else args.stub_latency},
+                  "results": rows}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Local stand-in for Gemini and Google speech recognition.
+
+Run it and point the backend at it:
+
+    python bench/stub_model_server.py --port 8090 --latency 0.5
+    CHAT_MODEL_STUB_URL=http://127.0.0.1:8090 SPEECH_STUB_URL=http://127.0.0.1:8090 python app.py
+
+POST /generate   {"prompt": ...}  ->  {"text": "<filter JSON>"}
+POST /transcribe <wav body>       ->  {"text": "<transcript>"}
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILTER_RESPONSE = {
+    "type": "filter",
+    "data": {
+        "date_from": "2025-04-17",
+        "date_to": "2025-05-02",
+        "method": "GET",
+        "path": "",
+        "status_code": 404,
+        "browser": ""
+    }
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        config = self.server.config
+
+        with self.server.lock:
+            self.server.calls[self.path] = self.server.calls.get(self.path, 0) + 1
+        time.sleep(config.latency + random.uniform(0, config.jitter))
+        if random.random() < config.error_rate:
+            self._send(503, {"error": "stub failure"})
+        elif self.path == '/generate':
+            self._send(200, {"text": "```json\n" + json.dumps(FILTER_RESPONSE) + "\n```"})
+        elif self.path == '/transcribe':
+            self._send(200, {"text": config.transcript})
+        else:
+            self._send(404, {"error": "unknown endpoint"})
+
+    def do_GET(self):
+        # Call counts, so load tests can check how many requests were coalesced or cached
+        if self.path == '/stats':
+            with self.server.lock:
+                self._send(200, dict(self.server.calls))
+        else:
+            self._send(404, {"error": "unknown endpoint"})
+
+    def log_message(self, format, *args):
+        if self.server.config.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub LLM and speech recognition server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.5, help="Seconds to wait before answering")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random delay of up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of calls answered with a 503")
+    parser.add_argument('--transcript', default="show me suspicious traffic from bots",
+                        help="Text returned by /transcribe")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.config = args
+    server.lock = threading.Lock()
+    server.calls = {}
+    print(f"Stub model server listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
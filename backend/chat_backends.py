@@ -0,0 +1,107 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import requests
+
+from external_calls import LLM_TIMEOUT, SPEECH_TIMEOUT
+
+# Point the chat endpoints at a local stub server instead of Gemini and Google
+# speech recognition, e.g. for load tests (see bench/stub_model_server.py)
+CHAT_MODEL_STUB_URL = os.getenv('CHAT_MODEL_STUB_URL')
+SPEECH_STUB_URL = os.getenv('SPEECH_STUB_URL')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')
+
+
+class StubModel:
+    """
+    Stand-in for genai.GenerativeModel that forwards prompts to an HTTP stub.
+
+    The stub receives {"prompt": ...} and answers {"text": ...}; the result has
+    the same .text attribute as a Gemini response.
+    """
+
+    def __init__(self, url, timeout=LLM_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def generate_content(self, prompt):
+        response = self.session.post(f"{self.url}/generate", json={"prompt": prompt}, timeout=self.timeout)
+        response.raise_for_status()
+        return SimpleNamespace(text=response.json()["text"])
+
+
+_model_lock = threading.Lock()
+_model = None
+
+
+def create_chat_model(api_key):
+    """
+    Return the model used by the chat endpoints.
+
+    Args:
+        api_key: Gemini API key; not needed when CHAT_MODEL_STUB_URL is set
+
+    Returns:
+        An object with a generate_content(prompt) method, or None if neither a
+        stub URL nor an API key is configured
+    """
+    if CHAT_MODEL_STUB_URL:
+        return StubModel(CHAT_MODEL_STUB_URL)
+    if not api_key:
+        return None
+    from google import generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+
+def get_chat_model():
+    """
+    Return the shared chat model, creating it on first use.
+
+    google.generativeai is only imported and configured here, so importing the
+    app does not need GEMINI_API_KEY and workers that never chat don't load it.
+    Returns None while no API key or stub URL is configured.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = create_chat_model(os.getenv('GEMINI_API_KEY'))
+    return _model
+
+
+def upstream_errors(service):
+    """
+    Return the exception types that mean a chat service failed, for call_external.
+
+    Anything else the service raises is about the request, like audio with no
+    recognisable speech, and must not open the service's circuit breaker.
+    """
+    errors = [OSError]  # Connection failures, socket timeouts, HTTP errors from requests (and the stubs)
+    if service == 'speech':
+        import speech_recognition as sr
+        errors.append(sr.RequestError)
+    elif service == 'llm' and not CHAT_MODEL_STUB_URL:
+        from google.api_core import exceptions
+        errors += [exceptions.ServerError, exceptions.TooManyRequests]
+    return tuple(errors)
+
+
+def transcribe(recognizer, audio_data):
+    """
+    Transcribe recorded audio with Google speech recognition, or the stub if configured.
+
+    The stub receives the audio as a WAV body on /transcribe and answers {"text": ...}.
+    """
+    if SPEECH_STUB_URL:
+        import speech_recognition as sr
+        response = requests.post(f"{SPEECH_STUB_URL.rstrip('/')}/transcribe", data=audio_data.get_wav_data(),
+                                 headers={"Content-Type": "audio/wav"}, timeout=SPEECH_TIMEOUT)
+        response.raise_for_status()
+        text = response.json().get("text")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+    return recognizer.recognize_google(audio_data, language='en-US')
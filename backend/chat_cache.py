@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from chat_intent import DATE_RE, iso_date
+from metrics import inc
+
+# Persistent cache of validated chat filter responses, shared by /api/chat and /api/voice-chat
+CHAT_CACHE_DB = os.getenv('CHAT_CACHE_DB', 'chat_cache.db')
+CHAT_CACHE_TTL = int(os.getenv('CHAT_CACHE_TTL', 7 * 24 * 3600))
+CHAT_CACHE_SIZE = int(os.getenv('CHAT_CACHE_SIZE', 5000))
+
+_local = threading.local()
+
+
+def _connection():
+    """One connection per thread (and per process after a fork)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(CHAT_CACHE_DB, timeout=5, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS chat_cache (
+                   key TEXT PRIMARY KEY,
+                   response TEXT NOT NULL,
+                   created INTEGER NOT NULL,
+                   last_used INTEGER NOT NULL
+               )"""
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_cache_last_used ON chat_cache (last_used)')
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def normalise_message(message):
+    """
+    Build the cache key for a chat message.
+
+    Case and whitespace are folded, trailing punctuation is dropped and dates are
+    rewritten as YYYY-MM-DD, so "Errors on 2/5/2025" and "errors on 2025-05-02"
+    share an entry.
+    """
+    text = DATE_RE.sub(lambda m: iso_date(m) or m.group(0), message)
+    text = re.sub(r'\s+', ' ', text.lower()).strip()
+    return text.rstrip('.?! ')
+
+
+def get_cached_response(message):
+    """Return the cached response for a message, or None on a miss or if it has expired"""
+    key = normalise_message(message)
+    now = int(time.time())
+    try:
+        conn = _connection()
+        row = conn.execute('SELECT response, created FROM chat_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            inc('vns_cache_requests_total', cache='chat', result='miss')
+            return None
+        if now - row[1] > CHAT_CACHE_TTL:
+            with conn:
+                conn.execute('DELETE FROM chat_cache WHERE key = ?', (key,))
+            inc('vns_cache_requests_total', cache='chat', result='miss')
+            return None
+        inc('vns_cache_requests_total', cache='chat', result='hit')
+        with conn:
+            conn.execute('UPDATE chat_cache SET last_used = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+    except sqlite3.Error:
+        return None
+
+
+def put_cached_response(message, response):
+    """Store a validated response, evicting the least recently used entries beyond CHAT_CACHE_SIZE"""
+    key = normalise_message(message)
+    now = int(time.time())
+    try:
+        conn = _connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO chat_cache (key, response, created, last_used) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(response), now, now)
+            )
+            conn.execute(
+                """DELETE FROM chat_cache WHERE key IN (
+                       SELECT key FROM chat_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                   )""",
+                (CHAT_CACHE_SIZE,)
+            )
+    except sqlite3.Error:
+        pass
@@ -0,0 +1,146 @@
+import re
+
+# Filter values that match everything, as used in the Gemini prompts
+DEFAULT_FILTER = {
+    "date_from": "2025-04-17",
+    "date_to": "2025-05-02",
+    "method": "",
+    "path": "",
+    "status_code": -1,
+    "browser": ""
+}
+
+HTTP_METHODS = {'GET', 'POST', 'PUT', 'DELETE', 'PATCH', 'HEAD', 'OPTIONS'}
+
+BROWSERS = {
+    'chrome': 'Chrome',
+    'firefox': 'Firefox',
+    'safari': 'Safari',
+    'edge': 'Edge',
+    'opera': 'Opera'
+}
+
+# Words that mention a status class; the filter schema only holds a single code,
+# so like the LLM we leave status_code at -1 for these
+STATUS_CLASS_WORDS = {'error', 'errors', 'failed', 'failures', 'failing', '4xx', '5xx', '2xx', '3xx',
+                      'client', 'server', 'success', 'successful', 'redirect', 'redirects'}
+
+# Words that carry no filter information in a log query
+FILLER_WORDS = {
+    'a', 'all', 'analyse', 'analyze', 'and', 'any', 'are', 'by', 'call', 'calls', 'can', 'code', 'codes',
+    'display', 'entries', 'entry', 'filter', 'find', 'for', 'from', 'get', 'give', 'hits', 'i', 'in', 'is',
+    'list', 'log', 'logs', 'me', 'method', 'methods', 'of', 'on', 'only', 'path', 'paths', 'please',
+    'request', 'requests', 'response', 'responses', 'see', 'show', 'status', 'the', 'through', 'till',
+    'to', 'traffic', 'until', 'using', 'via', 'want', 'what', 'which', 'with', 'browser', 'browsers',
+    'between', 'date', 'dates', 'made', 'sent', 'urls', 'url', 'view'
+}
+
+DATE_RE = re.compile(r'(?<![\d/-])(\d{1,2})/(\d{1,2})/(\d{4})(?![\d/-])|(?<![\d/-])(\d{4})-(\d{1,2})-(\d{1,2})(?![\d/-])')
+PATH_RE = re.compile(r'(?<!\S)/[^\s,;?!]*')
+WORD_RE = re.compile(r"[A-Za-z0-9']+")
+
+
+def convert_date_format(date_str):
+    """Convert date from DD/MM/YYYY to YYYY-MM-DD format"""
+    if not date_str:
+        return date_str
+
+    # If already in YYYY-MM-DD format, return as is
+    if len(date_str) == 10 and date_str.count('-') == 2:
+        try:
+            year, month, day = map(int, date_str.split('-'))
+            if 1900 <= year <= 2099 and 1 <= month <= 12 and 1 <= day <= 31:
+                return date_str
+        except ValueError:
+            pass
+
+    # Convert from DD/MM/YYYY format
+    if len(date_str) == 10 and date_str.count('/') == 2:
+        try:
+            day, month, year = map(int, date_str.split('/'))
+            if 1900 <= year <= 2099 and 1 <= month <= 12 and 1 <= day <= 31:
+                return f"{year:04d}-{month:02d}-{day:02d}"
+        except ValueError:
+            pass
+
+    return date_str
+
+
+def iso_date(match):
+    """Convert a DATE_RE match to YYYY-MM-DD, or None if it is not a valid date"""
+    if match.group(1):
+        day, month, year = match.group(1, 2, 3)
+        raw = f"{int(day):02d}/{int(month):02d}/{year}"
+    else:
+        year, month, day = match.group(4, 5, 6)
+        raw = f"{year}-{int(month):02d}-{int(day):02d}"
+    iso = convert_date_format(raw)
+    return iso if re.fullmatch(r'\d{4}-\d{2}-\d{2}', iso) else None
+
+
+def _iso_dates(message):
+    """Find the dates in a message and return them as YYYY-MM-DD strings, or None if any is invalid"""
+    dates = [iso_date(match) for match in DATE_RE.finditer(message)]
+    return None if None in dates else dates
+
+
+def parse_local_filter(message):
+    """
+    Parse common log queries into a filter without calling the LLM.
+
+    Handles HTTP methods, status codes and classes, dates and date ranges, path
+    fragments and browser names. Every word of the message has to be understood;
+    anything left over means the query is not a simple one and should go to the LLM.
+
+    Args:
+        message: The user's chat message
+
+    Returns:
+        A {"type": "filter", "data": {...}} response, or None when local parsing
+        is not confident
+    """
+    if not message or not message.strip():
+        return None
+
+    data = dict(DEFAULT_FILTER)
+
+    dates = _iso_dates(message)
+    if dates is None or len(dates) > 2:
+        return None
+    if dates:
+        data['date_from'], data['date_to'] = min(dates), max(dates)
+    rest = DATE_RE.sub(' ', message)
+
+    paths = PATH_RE.findall(rest)
+    if len(paths) > 1:
+        return None
+    if paths:
+        data['path'] = paths[0]
+    rest = PATH_RE.sub(' ', rest)
+
+    words = WORD_RE.findall(rest)
+    methods, status_codes, browsers = set(), set(), set()
+    for i, word in enumerate(words):
+        lower = word.lower()
+        following = words[i + 1].lower() if i + 1 < len(words) else ''
+        if word.upper() in HTTP_METHODS and (word.isupper() or following in ('request', 'requests', 'method', 'calls')):
+            methods.add(word.upper())
+        elif re.fullmatch(r'[1-5]\d\d', word):
+            status_codes.add(int(word))
+        elif lower in BROWSERS:
+            browsers.add(BROWSERS[lower])
+        elif lower in STATUS_CLASS_WORDS or lower in FILLER_WORDS:
+            continue
+        else:
+            return None
+
+    if len(methods) > 1 or len(status_codes) > 1 or len(browsers) > 1:
+        return None
+    if methods:
+        data['method'] = methods.pop()
+    if status_codes:
+        data['status_code'] = status_codes.pop()
+    if browsers:
+        data['browser'] = browsers.pop()
+
+    return {"type": "filter", "data": data}
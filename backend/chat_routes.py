@@ -1,64 +1,37 @@
 from flask import Blueprint, request, jsonify, current_app
-import speech_recognition as sr
-import os
-import tempfile
-import soundfile as sf
-import numpy as np
 from dotenv import load_dotenv
-from google import generativeai as genai
 import json
-import logging
 import subprocess
-from pathlib import Path
-from datetime import datetime
+import time
+from chat_intent import convert_date_format, parse_local_filter
+from audio_pipeline import decode_audio
+from chat_cache import get_cached_response, put_cached_response
+from chat_backends import get_chat_model, transcribe, upstream_errors
+from metrics import inc, observe
+from external_calls import (LLM_TIMEOUT, SPEECH_TIMEOUT, CallTimeout, CircuitOpenError, ExecutorBusyError,
+                            call_external)
 
 # Load environment variables
 load_dotenv()
 
 chat_bp = Blueprint('chat', __name__)
 
-# Initialize Gemini AI client
-api_key = os.getenv('GEMINI_API_KEY')
-if not api_key:
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
 
-genai.configure(api_key=api_key)
-model = genai.GenerativeModel('gemini-2.0-flash')
-
-def convert_date_format(date_str):
-    """Convert date from DD/MM/YYYY to YYYY-MM-DD format"""
-    if not date_str:
-        return date_str
-        
-    # If already in YYYY-MM-DD format, return as is
-    if len(date_str) == 10 and date_str.count('-') == 2:
-        try:
-            year, month, day = map(int, date_str.split('-'))
-            if 1900 <= year <= 2099 and 1 <= month <= 12 and 1 <= day <= 31:
-                return date_str
-        except ValueError:
-            pass
-            
-    # Convert from DD/MM/YYYY format
-    if len(date_str) == 10 and date_str.count('/') == 2:
-        try:
-            day, month, year = map(int, date_str.split('/'))
-            if 1900 <= year <= 2099 and 1 <= month <= 12 and 1 <= day <= 31:
-                return f"{year:04d}-{month:02d}-{day:02d}"
-        except ValueError:
-            pass
-            
-    return date_str
+def _unavailable_response(error, **extra):
+    """Response for an external call that timed out, was short-circuited or could not be queued"""
+    current_app.logger.warning(f"External call failed: {error}")
+    status = 504 if isinstance(error, CallTimeout) else 503
+    return jsonify({
+        **extra,
+        "type": "message",
+        "data": "The assistant is taking too long to respond right now. Please try again in a moment."
+    }), status
 
 @chat_bp.route('/api/chat', methods=['POST'])
 def handle_chat():
     try:
         current_app.logger.info("Received chat request")
         
-        if not api_key:
-            current_app.logger.error("Gemini API key not configured")
-            return jsonify({"error": "Gemini API key not configured"}), 500
-
         data = request.get_json()
         current_app.logger.info(f"Received data: {data}")
         
@@ -69,6 +42,26 @@ def handle_chat():
         user_message = data['message']
         current_app.logger.info(f"Processing user message: {user_message}")
 
+        # Answer simple filter queries locally, without a round trip to Gemini
+        local_response = parse_local_filter(user_message)
+        if local_response:
+            current_app.logger.info(f"Answered locally: {local_response}")
+            inc('vns_chat_responses_total', source='local')
+            return jsonify({**local_response, "source": "local"})
+
+        # Reuse the validated answer to an equivalent earlier question
+        cached_response = get_cached_response(user_message)
+        if cached_response:
+            current_app.logger.info(f"Answered from cache: {cached_response}")
+            inc('vns_chat_responses_total', source='cache')
+            return jsonify({**cached_response, "source": "cache"})
+
+        # Only questions neither answered locally nor cached need the model, and its import
+        model = get_chat_model()
+        if model is None:
+            current_app.logger.error("Gemini API key not configured")
+            return jsonify({"error": "Gemini API key not configured"}), 500
+
         # Call Gemini AI for chat completion
         prompt = """You are a log analysis assistant. Your task is to ALWAYS return a filter response for ANY log-related query.
 
@@ -122,7 +115,7 @@ def handle_chat():
             "type": "filter",
             "data": {
                 "date_from": "2025-04-17",
-                "date_to": "2025-05-02'",
+                "date_to": "2025-05-02",
                 "method": "GET",
                 "path": "",
                 "status_code": -1,
@@ -137,7 +130,9 @@ def handle_chat():
         - Default dates should be in YYYY-MM-DD format"""
 
         current_app.logger.info("Sending request to Gemini AI")
-        response = model.generate_content(prompt + f"\n\nUser request: {user_message}")
+        full_prompt = prompt + f"\n\nUser request: {user_message}"
+        response = call_external('llm', full_prompt, model.generate_content, full_prompt, timeout=LLM_TIMEOUT,
+                                 upstream_errors=upstream_errors('llm'))
         current_app.logger.info(f"Received response from Gemini AI: {response.text}")
         
         # Clean up the response text - remove markdown code blocks
@@ -188,9 +183,12 @@ def handle_chat():
                     data['status_code'] = -1
                 if not data.get('browser'):
                     data['browser'] = ''
+
+                put_cached_response(user_message, json_response)
             
             current_app.logger.info(f"Sending validated response: {json_response}")
-            return jsonify(json_response)
+            inc('vns_chat_responses_total', source='llm')
+            return jsonify({**json_response, "source": "llm"})
 
         except json.JSONDecodeError as e:
             current_app.logger.error(f"JSON decode error: {str(e)}")
@@ -200,6 +198,8 @@ def handle_chat():
                 "data": "I apologize, but I couldn't process that request properly. Please try rephrasing your question about log analysis."
             })
 
+    except (CallTimeout, CircuitOpenError, ExecutorBusyError) as e:
+        return _unavailable_response(e)
     except Exception as e:
         current_app.logger.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
         return jsonify({
@@ -210,12 +210,11 @@ def handle_chat():
 @chat_bp.route('/api/voice-chat', methods=['POST'])
 def handle_voice_chat():
     try:
+        # Imported on first use so workers that never see a voice request don't load it
+        import speech_recognition as sr
+
         current_app.logger.info("Received voice chat request")
         
-        if not api_key:
-            current_app.logger.error("Gemini API key not configured")
-            return jsonify({"error": "Gemini API key not configured"}), 500
-
         if 'audio' not in request.files:
             current_app.logger.error("No audio file in request")
             return jsonify({"error": "No audio file provided"}), 400
@@ -225,60 +224,56 @@ def handle_voice_chat():
                               f"Content type: {audio_file.content_type}, "
                               f"Size: {audio_file.content_length} bytes")
 
-        # Create temporary files for WebM and WAV
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_webm, \
-             tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_wav:
-            
-            # Save the uploaded WebM file
-            audio_file.save(temp_webm.name)
-            current_app.logger.info(f"Saved WebM file to: {temp_webm.name}")
-            
-            try:
-                # Optimize FFmpeg conversion with faster settings
-                current_app.logger.info("Converting WebM to WAV using ffmpeg")
-                result = subprocess.run([
-                    'ffmpeg', 
-                    '-i', temp_webm.name,
-                    '-acodec', 'pcm_s16le',
-                    '-ar', '16000',  # Match frontend sample rate
-                    '-ac', '1',      # Mono audio
-                    '-af', 'volume=1.5',  # Boost volume slightly
-                    '-fflags', '+fastseek',
-                    '-flags', '+low_delay',
-                    '-y',  # Overwrite output file
-                    temp_wav.name
-                ], check=True, capture_output=True, timeout=10)  # Add timeout
-                current_app.logger.info("Successfully converted to WAV")
-
-                # Initialize speech recognizer with optimized settings
-                current_app.logger.info("Initializing speech recognition")
-                recognizer = sr.Recognizer()
-                recognizer.energy_threshold = 300  # Lower energy threshold
-                recognizer.dynamic_energy_threshold = True
-                recognizer.pause_threshold = 0.5  # Shorter pause threshold
-
-                # Load the converted WAV file and convert to text
-                with sr.AudioFile(temp_wav.name) as source:
-                    current_app.logger.info("Reading audio file")
-                    audio_data = recognizer.record(source)
-                    current_app.logger.info("Performing speech recognition")
-                    text = recognizer.recognize_google(audio_data, language='en-US')
-                    current_app.logger.info(f"Transcribed text: {text}")
-
-            except subprocess.TimeoutExpired:
-                current_app.logger.error("FFmpeg conversion timed out")
-                return jsonify({"error": "Audio processing timed out"}), 500
-            except subprocess.CalledProcessError as e:
-                current_app.logger.error(f"FFmpeg error: {e.stderr.decode()}")
-                return jsonify({"error": "Failed to process audio file"}), 500
-            finally:
-                # Clean up temporary files
-                current_app.logger.info("Cleaning up temporary files")
-                try:
-                    os.unlink(temp_webm.name)
-                    os.unlink(temp_wav.name)
-                except Exception as e:
-                    current_app.logger.error(f"Error cleaning up files: {e}")
+        timings = {}
+        try:
+            # Decode in memory: WAV/PCM is used as is, anything else is piped through ffmpeg
+            started = time.perf_counter()
+            pcm, sample_rate, sample_width, transcoded = decode_audio(audio_file.read(), audio_file.content_type)
+            if transcoded:
+                observe('vns_stage_seconds', time.perf_counter() - started, stage='transcode')
+                timings['transcode_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            current_app.logger.info(f"Decoded {len(pcm)} bytes of PCM at {sample_rate} Hz "
+                                    f"({'transcoded' if transcoded else 'no transcoding needed'})")
+        except subprocess.TimeoutExpired:
+            current_app.logger.error("FFmpeg conversion timed out")
+            return jsonify({"error": "Audio processing timed out"}), 500
+        except subprocess.CalledProcessError as e:
+            current_app.logger.error(f"FFmpeg error: {e.stderr.decode()}")
+            return jsonify({"error": "Failed to process audio file"}), 500
+
+        # Initialize speech recognizer with optimized settings
+        current_app.logger.info("Performing speech recognition")
+        recognizer = sr.Recognizer()
+        recognizer.energy_threshold = 300  # Lower energy threshold
+        recognizer.dynamic_energy_threshold = True
+        recognizer.pause_threshold = 0.5  # Shorter pause threshold
+
+        audio_data = sr.AudioData(pcm, sample_rate, sample_width)
+        started = time.perf_counter()
+        text = call_external('speech', pcm, transcribe, recognizer, audio_data, timeout=SPEECH_TIMEOUT,
+                             upstream_errors=upstream_errors('speech'))
+        timings['recognise_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        current_app.logger.info(f"Transcribed text: {text}")
+
+        # Answer simple filter queries locally, without a round trip to Gemini
+        local_response = parse_local_filter(text)
+        if local_response:
+            current_app.logger.info(f"Answered locally: {local_response}")
+            inc('vns_chat_responses_total', source='local')
+            return jsonify({"transcribed_text": text, **local_response, "source": "local", "timings": timings})
+
+        # Reuse the validated answer to an equivalent earlier question
+        cached_response = get_cached_response(text)
+        if cached_response:
+            current_app.logger.info(f"Answered from cache: {cached_response}")
+            inc('vns_chat_responses_total', source='cache')
+            return jsonify({"transcribed_text": text, **cached_response, "source": "cache", "timings": timings})
+
+        # Only questions neither answered locally nor cached need the model, and its import
+        model = get_chat_model()
+        if model is None:
+            current_app.logger.error("Gemini API key not configured")
+            return jsonify({"error": "Gemini API key not configured"}), 500
 
         # Process the transcribed text with Gemini
         current_app.logger.info("Sending transcribed text to Gemini AI")
@@ -286,7 +281,7 @@ def handle_voice_chat():
 
         DEFAULT VALUES (use these when not specified in the query):
         - date_from: "2025-04-17" (matches all logs from the beginning)
-        - date_to: "2025-05-02'" (matches all logs up to the future)
+        - date_to: "2025-05-02" (matches all logs up to the future)
         - method: "" (matches any HTTP method)
         - path: "" (matches any path)
         - status_code: -1 (matches any status code)
@@ -312,7 +307,7 @@ def handle_voice_chat():
            - Use "" for unspecified HTTP method to match any method
            - Use "" for unspecified paths and browsers to match anything
            - Use -1 for unspecified status code to match any status
-           - Use "2025-04-17" to "2025-05-02'" for unspecified date ranges
+           - Use "2025-04-17" to "2025-05-02" for unspecified date ranges
         3. Convert any date format to YYYY-MM-DD:
            - DD/MM/YYYY → YYYY-MM-DD (e.g., "28/04/2025" → "2025-04-28")
            - MM/DD/YYYY → YYYY-MM-DD
@@ -339,7 +334,7 @@ def handle_voice_chat():
             "type": "filter",
             "data": {
                 "date_from": "2025-04-17",
-                "date_to": "2025-05-02'",
+                "date_to": "2025-05-02",
                 "method": "GET",
                 "path": "",
                 "status_code": -1,
@@ -352,7 +347,7 @@ def handle_voice_chat():
             "type": "filter",
             "data": {
                 "date_from": "2025-04-17",
-                "date_to": "2025-05-02'",
+                "date_to": "2025-05-02",
                 "method": "",
                 "path": "/api/users",
                 "status_code": -1,
@@ -368,7 +363,11 @@ def handle_voice_chat():
         - ALWAYS use YYYY-MM-DD format for dates
         - Convert any DD/MM/YYYY dates to YYYY-MM-DD format"""
 
-        response = model.generate_content(prompt + f"\n\nTranscribed text: {text}")
+        full_prompt = prompt + f"\n\nTranscribed text: {text}"
+        started = time.perf_counter()
+        response = call_external('llm', full_prompt, model.generate_content, full_prompt, timeout=LLM_TIMEOUT,
+                                 upstream_errors=upstream_errors('llm'))
+        timings['llm_ms'] = round((time.perf_counter() - started) * 1000, 1)
         current_app.logger.info(f"Received response from Gemini: {response.text}")
         
         try:
@@ -406,7 +405,7 @@ def handle_voice_chat():
                 data['status_code'] = data.get('status_code') or -1
                 data['browser'] = data.get('browser') or ""
                 data['date_from'] = data.get('date_from') or "2025-04-17"
-                data['date_to'] = data.get('date_to') or "2025-05-02'"
+                data['date_to'] = data.get('date_to') or "2025-05-02"
 
                 # Convert dates from DD/MM/YYYY to YYYY-MM-DD if needed
                 if data['date_from'] and len(data['date_from']) == 10 and data['date_from'].count('/') == 2:
@@ -416,11 +415,16 @@ def handle_voice_chat():
                 if data['date_to'] and len(data['date_to']) == 10 and data['date_to'].count('/') == 2:
                     day, month, year = data['date_to'].split('/')
                     data['date_to'] = f"{year}-{month}-{day}"
+
+                put_cached_response(text, json_response)
             
             result = {
                 "transcribed_text": text,
-                **json_response  # Include type and data from the response
+                **json_response,  # Include type and data from the response
+                "source": "llm",
+                "timings": timings
             }
+            inc('vns_chat_responses_total', source='llm')
             current_app.logger.info(f"Sending final response: {result}")
             return jsonify(result)
 
@@ -434,6 +438,10 @@ def handle_voice_chat():
                 "data": "I apologize, but I couldn't process that request properly. Please try rephrasing your question about log analysis."
             })
 
+    except ImportError as e:
+        # Listed first: the clauses below need sr, which is unbound if its import failed
+        current_app.logger.error(f"Voice chat is unavailable: {str(e)}")
+        return jsonify({"error": "Voice chat is not available on this server"}), 503
     except sr.UnknownValueError:
         current_app.logger.error("Speech recognition could not understand audio")
         return jsonify({
@@ -446,6 +454,8 @@ def handle_voice_chat():
             "type": "message",
             "data": "There was an error with the speech recognition service. Please try again later."
         }), 500
+    except (CallTimeout, CircuitOpenError, ExecutorBusyError) as e:
+        return _unavailable_response(e)
     except Exception as e:
         current_app.logger.error(f"Unexpected error in voice chat endpoint: {str(e)}", exc_info=True)
         return jsonify({
@@ -0,0 +1,276 @@
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+# Maximum number of parsed uploads kept (per worker, or in total when shared)
+DATASET_STORE_SIZE = int(os.getenv('DATASET_STORE_SIZE', 8))
+# When set, datasets are written here as memory-mapped columns that every worker can read
+DATASET_STORE_DIR = os.getenv('DATASET_STORE_DIR', '')
+
+# Column types of a parsed log entry; strings are dictionary-encoded on disk
+DATASET_COLUMNS = {
+    'ipAddress': 'str',
+    'dateTime': 'str',
+    'method': 'str',
+    'path': 'str',
+    'statusCode': 'int',
+    'bytes': 'int',
+    'referer': 'str',
+    'userAgent': 'str',
+}
+
+_DATASET_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+_lock = threading.Lock()
+_datasets = OrderedDict()
+
+
+class SharedDataset:
+    """
+    A dataset stored as a directory of .npy columns, opened with mmap.
+
+    Integer columns are stored as int64. String columns are stored as int32
+    codes into a per-column dictionary of distinct values, kept in meta.json in
+    order of first appearance. The column pages live in the page cache and are
+    shared by every worker that maps them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        self.meta = meta
+        self.file_name = meta['fileName']
+        self.rows = meta['rows']
+        self.dictionaries = meta['dictionaries']
+
+    def codes(self, name):
+        """Return the raw mmap-backed array of a column (codes for string columns)"""
+        return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+
+    def column(self, name):
+        """Return a column decoded to a numpy array (object dtype for strings)"""
+        codes = self.codes(name)
+        if name not in self.dictionaries:
+            return np.asarray(codes)
+        values = np.empty(len(self.dictionaries[name]), dtype=object)
+        values[:] = self.dictionaries[name]
+        return values[codes]
+
+    @property
+    def entries(self):
+        """Materialise the dataset as a list of entry dictionaries"""
+        columns = {name: self.column(name).tolist() for name in DATASET_COLUMNS}
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def encode_strings(values):
+    """Dictionary-encode a sequence of strings, returning (int32 codes, distinct values)"""
+    index = {}
+    codes = np.fromiter((index.setdefault(value, len(index)) for value in values),
+                        dtype=np.int32, count=len(values))
+    return codes, list(index)
+
+
+def encode_entries(entries):
+    """
+    Convert parsed entries to columns.
+
+    Returns:
+        Dictionary of column name to (array, dictionary). String columns are
+        int32 codes with their list of distinct values; integer columns are
+        int64 with a dictionary of None.
+    """
+    columns = {}
+    for name, kind in DATASET_COLUMNS.items():
+        values = [entry.get(name) for entry in entries]
+        if kind == 'str':
+            columns[name] = encode_strings(values)
+        else:
+            columns[name] = (np.fromiter((value or 0 for value in values), dtype=np.int64, count=len(values)), None)
+    return columns
+
+
+def write_columns(path, entries, file_name=None, **meta):
+    """
+    Write entries as a directory of .npy columns readable by SharedDataset.
+
+    The directory is written next to path under a name of its own and renamed
+    into place, so readers never see a partial one and concurrent writers of
+    the same path don't share files. Extra keyword arguments are stored in
+    meta.json.
+
+    Raises:
+        OSError: The columns could not be written, or path already exists;
+            the temporary directory has been removed
+    """
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp_path)
+    try:
+        dictionaries = {}
+        for name, (array, dictionary) in encode_entries(entries).items():
+            if dictionary is not None:
+                dictionaries[name] = dictionary
+            np.save(os.path.join(tmp_path, f'{name}.npy'), array)
+
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({"fileName": file_name, "rows": len(entries), "dictionaries": dictionaries, **meta}, f)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def _write_shared(dataset_id, entries, file_name):
+    write_columns(os.path.join(DATASET_STORE_DIR, dataset_id), entries, file_name)
+
+
+def _shared_ids():
+    """IDs of the shared datasets, least recently used first"""
+    try:
+        names = [name for name in os.listdir(DATASET_STORE_DIR) if _DATASET_ID_RE.fullmatch(name)]
+    except FileNotFoundError:
+        return []
+    paths = {name: os.path.join(DATASET_STORE_DIR, name) for name in names}
+    mtimes = {}
+    for name, path in paths.items():
+        try:
+            mtimes[name] = os.stat(path).st_mtime
+        except FileNotFoundError:
+            continue
+    return sorted(mtimes, key=mtimes.get)
+
+
+def _open_shared(dataset_id):
+    if not _DATASET_ID_RE.fullmatch(dataset_id or ''):
+        return None
+    path = os.path.join(DATASET_STORE_DIR, dataset_id)
+    try:
+        dataset = SharedDataset(path)
+        os.utime(path)  # Mark as recently used for eviction
+    except FileNotFoundError:
+        return None
+    return dataset
+
+
+def put_dataset(entries, file_name=None):
+    """
+    Keep a parsed upload so later requests can refer to it by ID.
+
+    The store is a small LRU: once DATASET_STORE_SIZE datasets are held, the
+    least recently used one is dropped. With DATASET_STORE_DIR set, datasets are
+    written there as columns shared by all workers; otherwise each worker keeps
+    its own in memory.
+
+    Args:
+        entries: List of parsed log entries as returned by parse_nginx_log
+        file_name: Name of the uploaded file
+
+    Returns:
+        The generated dataset ID
+    """
+    dataset_id = uuid.uuid4().hex
+    if DATASET_STORE_DIR:
+        os.makedirs(DATASET_STORE_DIR, exist_ok=True)
+        _write_shared(dataset_id, entries, file_name)
+        for stale_id in _shared_ids()[:-DATASET_STORE_SIZE or None]:
+            shutil.rmtree(os.path.join(DATASET_STORE_DIR, stale_id), ignore_errors=True)
+        return dataset_id
+
+    with _lock:
+        _datasets[dataset_id] = {"fileName": file_name, "entries": entries}
+        while len(_datasets) > DATASET_STORE_SIZE:
+            _datasets.popitem(last=False)
+    return dataset_id
+
+
+def get_dataset(dataset_id):
+    """Return the stored dataset for an ID, or None if it is unknown or evicted"""
+    if DATASET_STORE_DIR:
+        dataset = _open_shared(dataset_id)
+        if dataset is None:
+            return None
+        return {"fileName": dataset.file_name, "entries": dataset.entries}
+
+    with _lock:
+        dataset = _datasets.get(dataset_id)
+        if dataset is not None:
+            _datasets.move_to_end(dataset_id)
+        return dataset
+
+
+def get_dataset_columns(dataset_id, names):
+    """
+    Return selected columns of a stored dataset as numpy arrays.
+
+    Unlike get_dataset this does not build per-entry dictionaries, so it is the
+    cheap way to read a shared dataset.
+
+    Returns:
+        Dictionary of column name to array, or None if the dataset is unknown
+    """
+    if DATASET_STORE_DIR:
+        dataset = _open_shared(dataset_id)
+        if dataset is None:
+            return None
+        return {name: dataset.column(name) for name in names}
+
+    dataset = get_dataset(dataset_id)
+    if dataset is None:
+        return None
+    entries = dataset["entries"]
+    return {name: np.array([entry.get(name) for entry in entries],
+                           dtype=object if DATASET_COLUMNS.get(name) == 'str' else None)
+            for name in names}
+
+
+def get_dataset_encoded(dataset_id):
+    """
+    Return a stored dataset in the column form of encode_entries.
+
+    Shared datasets are returned straight from their mmap-backed files,
+    without decoding the string columns.
+
+    Returns:
+        Tuple of (file name, row count, columns), or None if the dataset is unknown
+    """
+    if DATASET_STORE_DIR:
+        dataset = _open_shared(dataset_id)
+        if dataset is None:
+            return None
+        return dataset.file_name, dataset.rows, {name: (dataset.codes(name), dataset.dictionaries.get(name))
+                                                 for name in DATASET_COLUMNS}
+
+    dataset = get_dataset(dataset_id)
+    if dataset is None:
+        return None
+    return dataset["fileName"], len(dataset["entries"]), encode_entries(dataset["entries"])
+
+
+def list_dataset_ids():
+    """Return the IDs of the datasets currently held, least recently used first"""
+    if DATASET_STORE_DIR:
+        return _shared_ids()
+    with _lock:
+        return list(_datasets)
+
+
+def get_dataset_ips(dataset_id):
+    """Return the distinct IP addresses of a stored dataset, or None if it is unknown"""
+    if DATASET_STORE_DIR:
+        dataset = _open_shared(dataset_id)
+        if dataset is None:
+            return None
+        # The dictionary already holds each address once, in order of first appearance
+        return list(dataset.dictionaries['ipAddress'])
+
+    dataset = get_dataset(dataset_id)
+    if dataset is None:
+        return None
+    return list(dict.fromkeys(entry["ipAddress"] for entry in dataset["entries"]))
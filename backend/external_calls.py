@@ -0,0 +1,194 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from metrics import inc, timed
+
+# Calls to Gemini and the speech service run on a small shared pool so a slow
+# upstream can only hold EXTERNAL_CALL_WORKERS threads, never every request worker
+EXTERNAL_CALL_WORKERS = int(os.getenv('EXTERNAL_CALL_WORKERS', 4))
+EXTERNAL_CALL_QUEUE = int(os.getenv('EXTERNAL_CALL_QUEUE', 16))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 20))
+SPEECH_TIMEOUT = float(os.getenv('SPEECH_TIMEOUT', 15))
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 5))
+BREAKER_RESET = float(os.getenv('BREAKER_RESET', 30))
+
+
+class ExternalCallError(Exception):
+    """Base class for failures of the external call wrapper itself"""
+
+
+class CallTimeout(ExternalCallError):
+    """The call did not finish within its timeout"""
+
+
+class CircuitOpenError(ExternalCallError):
+    """The service failed repeatedly and calls are short-circuited for a while"""
+
+
+class ExecutorBusyError(ExternalCallError):
+    """Too many external calls are already running or queued"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After failure_threshold failures in a row the circuit opens and calls fail
+    fast. Once reset_after seconds have passed a single trial call is let
+    through; its outcome closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, reset_after=BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_after:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        """Return True if a call may go ahead"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_after or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+_executor = ThreadPoolExecutor(max_workers=EXTERNAL_CALL_WORKERS, thread_name_prefix='external-call')
+_slots = threading.BoundedSemaphore(EXTERNAL_CALL_WORKERS + EXTERNAL_CALL_QUEUE)
+_inflight_lock = threading.Lock()
+_inflight = {}
+_breakers = {}
+
+
+def get_breaker(service):
+    """Return the circuit breaker for a service, creating it on first use"""
+    with _inflight_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(service)
+        return _breakers[service]
+
+
+def _run(service, key, breaker, fn, args, call, upstream_errors):
+    try:
+        result = fn(*args)
+    except upstream_errors:
+        with _inflight_lock:
+            counted = call['failed']
+            call['failed'] = True
+        if not counted:  # A timeout already counted this call as a failure
+            breaker.record_failure()
+        raise
+    except Exception:
+        # The service answered but rejected the input (e.g. unintelligible audio): it is healthy
+        breaker.record_success()
+        raise
+    else:
+        breaker.record_success()
+        return result
+    finally:
+        with _inflight_lock:
+            _inflight.pop((service, key), None)
+        _slots.release()
+
+
+def call_external(service, key, fn, *args, timeout, upstream_errors=(OSError,)):
+    """
+    Run fn(*args) on the shared external-call pool and wait at most timeout seconds.
+
+    Concurrent calls with the same service and key share one outbound call: the
+    later callers wait on the future of the first. A call that times out keeps
+    running in the pool and still releases its slot when it finishes, but the
+    caller gets CallTimeout straight away. The breaker counts one failure per
+    outbound call, however many callers were waiting on it. Only timeouts and
+    upstream_errors count as failures; any other exception from fn is about
+    the request itself and is raised without counting against the service.
+
+    Args:
+        service: Name of the upstream service, e.g. 'llm' or 'speech'
+        key: Bytes or string identifying the request, used for coalescing
+        fn: The blocking callable to run
+        *args: Arguments for fn
+        timeout: Seconds to wait for the result
+        upstream_errors: Exception types that mean the service failed; the default
+            OSError covers connection failures, socket timeouts and requests' HTTP errors
+
+    Returns:
+        The return value of fn
+
+    Raises:
+        CircuitOpenError: The breaker for the service is open
+        ExecutorBusyError: The pool and its queue are full
+        CallTimeout: The call did not finish in time
+        Exception: Whatever fn raised
+    """
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    key = hashlib.sha1(key).hexdigest()
+    breaker = get_breaker(service)
+
+    call = None  # Set when this caller owns the outbound call
+    with _inflight_lock:
+        future = _inflight.get((service, key))
+        if future is None:
+            if not _slots.acquire(blocking=False):
+                inc('vns_external_call_errors_total', service=service, reason='busy')
+                raise ExecutorBusyError(f"Too many {service} calls in progress")
+            if not breaker.allow():
+                _slots.release()
+                inc('vns_external_call_errors_total', service=service, reason='circuit_open')
+                raise CircuitOpenError(f"{service} is unavailable, retrying in {breaker.reset_after:.0f}s")
+            call = {'failed': False}
+            future = _executor.submit(_run, service, key, breaker, fn, args, call, upstream_errors)
+            _inflight[(service, key)] = future
+
+    try:
+        with timed(service):
+            return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        inc('vns_external_call_errors_total', service=service, reason='timeout')
+        if call is not None:
+            with _inflight_lock:
+                counted = call['failed']
+                call['failed'] = True
+            if not counted:
+                breaker.record_failure()
+        raise CallTimeout(f"{service} call timed out after {timeout:g}s") from None
+
+
+def external_call_status():
+    """Return breaker states and the number of in-flight calls, for diagnostics"""
+    with _inflight_lock:
+        return {
+            "inflight": len(_inflight),
+            "breakers": {name: breaker.state for name, breaker in _breakers.items()}
+        }
@@ -0,0 +1,134 @@
+import os
+import threading
+
+import numpy as np
+from cachetools import TTLCache
+
+from dataset_store import get_dataset_columns
+from metrics import inc
+from geo_data import lookup_geolocation
+
+# Grid cells per 256px map tile; roughly one cluster per 64px square on screen
+CLUSTER_CELLS_PER_TILE = int(os.getenv('CLUSTER_CELLS_PER_TILE', 4))
+MAX_ZOOM = 18
+
+_cache_lock = threading.Lock()
+_cache = TTLCache(maxsize=64, ttl=int(os.getenv('GEO_AGGREGATE_TTL', 300)))
+
+
+def cluster_points(points, zoom):
+    """
+    Cluster located IPs on a regular lat/lng grid sized for a map zoom level.
+
+    Args:
+        points: DataFrame with lat, lng, requests, errors columns (one row per IP)
+        zoom: Leaflet zoom level (0 shows the whole world on one tile)
+
+    Returns:
+        List of clusters positioned at the request-weighted centre of their members
+    """
+    if points.empty:
+        return []
+
+    cell_size = 360.0 / (2 ** zoom * CLUSTER_CELLS_PER_TILE)
+    cells = points.assign(
+        cell_y=np.floor((points['lat'] + 90) / cell_size).astype(np.int64),
+        cell_x=np.floor((points['lng'] + 180) / cell_size).astype(np.int64),
+        weighted_lat=points['lat'] * points['requests'],
+        weighted_lng=points['lng'] * points['requests']
+    )
+    clusters = cells.groupby(['cell_y', 'cell_x']).agg(
+        requests=('requests', 'sum'), errors=('errors', 'sum'), ips=('requests', 'size'),
+        weighted_lat=('weighted_lat', 'sum'), weighted_lng=('weighted_lng', 'sum')
+    )
+    clusters['lat'] = clusters['weighted_lat'] / clusters['requests']
+    clusters['lng'] = clusters['weighted_lng'] / clusters['requests']
+    clusters = clusters.sort_values('requests', ascending=False)
+
+    return [
+        {
+            'lat': float(row.lat),
+            'lng': float(row.lng),
+            'requests': int(row.requests),
+            'errors': int(row.errors),
+            'ips': int(row.ips)
+        }
+        for row in clusters.itertuples()
+    ]
+
+
+def aggregate_geo(entries, zoom):
+    """
+    Join log entries to geolocation data and aggregate them for the world map.
+
+    Args:
+        entries: List of parsed log entries, or a dictionary with 'ipAddress' and
+            'statusCode' column arrays as returned by get_dataset_columns
+        zoom: Map zoom level used for clustering
+
+    Returns:
+        Dictionary with per-country and per-city request counts and clustered points
+    """
+    import pandas as pd
+
+    if isinstance(entries, dict):
+        ips, status_codes = entries['ipAddress'], np.asarray(entries['statusCode'])
+    else:
+        ips = [entry['ipAddress'] for entry in entries]
+        status_codes = np.array([entry['statusCode'] for entry in entries], dtype=np.int64)
+    df = pd.DataFrame({'ip': ips, 'error': status_codes >= 400})
+    per_ip = df.groupby('ip').agg(requests=('error', 'size'), errors=('error', 'sum'))
+
+    geo = pd.DataFrame.from_dict(lookup_geolocation(per_ip.index.tolist()), orient='index',
+                                 columns=['lat', 'lng', 'city', 'country'])
+    points = per_ip.join(geo, how='inner').dropna(subset=['lat', 'lng'])
+    points[['city', 'country']] = points[['city', 'country']].fillna('Unknown')
+
+    countries = (points.groupby('country')
+                 .agg(requests=('requests', 'sum'), errors=('errors', 'sum'), ips=('requests', 'size'))
+                 .sort_values('requests', ascending=False))
+    cities = (points.groupby(['country', 'city'])
+              .agg(requests=('requests', 'sum'), errors=('errors', 'sum'), ips=('requests', 'size'),
+                   lat=('lat', 'mean'), lng=('lng', 'mean'))
+              .sort_values('requests', ascending=False))
+
+    return {
+        'zoom': zoom,
+        'totalRequests': int(per_ip['requests'].sum()),
+        'unmappedRequests': int(per_ip['requests'].sum() - points['requests'].sum()),
+        'countries': [
+            {'country': country, 'requests': int(row.requests), 'errors': int(row.errors), 'ips': int(row.ips)}
+            for country, row in zip(countries.index, countries.itertuples())
+        ],
+        'cities': [
+            {'city': city, 'country': country, 'lat': float(row.lat), 'lng': float(row.lng),
+             'requests': int(row.requests), 'errors': int(row.errors), 'ips': int(row.ips)}
+            for (country, city), row in zip(cities.index, cities.itertuples())
+        ],
+        'clusters': cluster_points(points, zoom)
+    }
+
+
+def get_dataset_geo_aggregate(dataset_id, zoom):
+    """
+    Return the geographic aggregation for a stored dataset, cached per dataset and zoom.
+
+    Returns:
+        The aggregation dictionary, or None if the dataset is unknown
+    """
+    zoom = max(0, min(MAX_ZOOM, int(zoom)))
+    key = (dataset_id, zoom)
+    with _cache_lock:
+        result = _cache.get(key)
+    inc('vns_cache_requests_total', cache='geo_aggregate', result='miss' if result is None else 'hit')
+    if result is not None:
+        return result
+
+    columns = get_dataset_columns(dataset_id, ('ipAddress', 'statusCode'))
+    if columns is None:
+        return None
+
+    result = aggregate_geo(columns, zoom)
+    with _cache_lock:
+        _cache[key] = result
+    return result
@@ -0,0 +1,567 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+from email.utils import formatdate
+from functools import partial
+
+import numpy as np
+from cachetools import TTLCache
+
+from metrics import inc, timed
+
+logger = logging.getLogger(__name__)
+
+# Where geolocation data is served from: 'sqlite' (the cache database), or its
+# 'csv' export or columnar 'snapshot' written by convert_geodb_to_csv.py
+GEO_SOURCE = os.getenv('GEO_SOURCE', 'sqlite')
+
+# Locations of the geolocation cache and its CSV export (relative to the backend directory)
+GEO_CACHE_DB = os.getenv('GEO_CACHE_DB', '../geolocation_cache.db')
+GEO_CACHE_CSV = os.getenv('GEO_CACHE_CSV', '../csv_output/geo_cache.csv')
+GEO_SNAPSHOT_DIR = os.getenv('GEO_SNAPSHOT_DIR', '../csv_output/geo_cache_snapshot')
+
+# Size and lifetime of the in-process cache in front of the database
+GEO_LRU_SIZE = int(os.getenv('GEO_LRU_SIZE', 50000))
+GEO_LRU_TTL = int(os.getenv('GEO_LRU_TTL', 300))
+
+# SQLite limits the number of bound parameters, so IN (...) lookups are batched
+SQLITE_BATCH_SIZE = 500
+
+GEO_COLUMNS = ['ip_address', 'latitude', 'longitude', 'city', 'country']
+
+
+_inet_pton4 = partial(socket.inet_pton, socket.AF_INET)
+
+
+def _pack_one(ip):
+    """Pack a single address, returning (family, key) or None if it is not an IP"""
+    ip = ip.strip()
+    try:
+        return 4, int.from_bytes(_inet_pton4(ip), 'big')
+    except OSError:
+        try:
+            return 6, socket.inet_pton(socket.AF_INET6, ip)
+        except OSError:
+            return None
+
+
+def pack_ips(ips):
+    """
+    Pack IP address strings into fixed-width integer keys.
+
+    IPv4 addresses become uint32 values and IPv6 addresses 16-byte big-endian
+    strings, which sort the same way as the 128-bit integers they encode.
+
+    Args:
+        ips: Iterable of IP address strings
+
+    Returns:
+        Tuple (v4_keys, v4_positions, v6_keys, v6_positions) where the positions
+        are indexes into the input; unparseable addresses are left out
+    """
+    ips = list(ips)
+    strings = [i for i, ip in enumerate(ips) if isinstance(ip, str)]
+    dotted = [i for i in strings if ':' not in ips[i]]
+    try:
+        # Fast path: every dotted address is well formed, so pack them in one pass
+        v4_keys = np.frombuffer(b''.join(map(_inet_pton4, [ips[i] for i in dotted])), dtype='>u4')
+        v4_positions = dotted
+        remaining = [i for i in strings if ':' in ips[i]]
+    except OSError:
+        v4_keys, v4_positions = np.array([], dtype=np.uint32), []
+        remaining = strings
+
+    slow = {4: ([], []), 6: ([], [])}
+    for i in remaining:
+        packed = _pack_one(ips[i])
+        if packed is not None:
+            keys, positions = slow[packed[0]]
+            keys.append(packed[1])
+            positions.append(i)
+
+    v4_keys = np.concatenate([v4_keys.astype(np.uint32), np.array(slow[4][0], dtype=np.uint32)])
+    v4_positions = np.array(v4_positions + slow[4][1], dtype=np.int64)
+    return (v4_keys, v4_positions,
+            np.array(slow[6][0], dtype='S16'), np.array(slow[6][1], dtype=np.int64))
+
+
+class PackedIPIndex:
+    """Sorted packed-integer index mapping IP addresses to row numbers"""
+
+    def __init__(self, ips):
+        v4_keys, v4_rows, v6_keys, v6_rows = pack_ips(ips)
+
+        order = np.argsort(v4_keys, kind='stable')
+        self.v4_keys, self.v4_rows = v4_keys[order], v4_rows[order]
+        order = np.argsort(v6_keys, kind='stable')
+        self.v6_keys, self.v6_rows = v6_keys[order], v6_rows[order]
+
+    @classmethod
+    def from_sorted(cls, v4_keys, v4_rows, v6_keys, v6_rows):
+        """Wrap already sorted key/row arrays, e.g. memory-mapped from a snapshot"""
+        index = cls.__new__(cls)
+        index.v4_keys, index.v4_rows = v4_keys, v4_rows
+        index.v6_keys, index.v6_rows = v6_keys, v6_rows
+        return index
+
+    @staticmethod
+    def _search(keys, rows, queries):
+        if len(keys) == 0 or len(queries) == 0:
+            return np.zeros(len(queries), dtype=bool), np.zeros(len(queries), dtype=np.int64)
+        pos = np.searchsorted(keys, queries)
+        pos[pos == len(keys)] = 0
+        found = keys[pos] == queries
+        return found, rows[pos]
+
+    def lookup(self, ips):
+        """
+        Find the rows for a batch of IP addresses with a binary search per family.
+
+        Returns:
+            Tuple (positions, rows) of matching input positions and table rows
+        """
+        v4_keys, v4_positions, v6_keys, v6_positions = pack_ips(ips)
+        found4, rows4 = self._search(self.v4_keys, self.v4_rows, v4_keys)
+        found6, rows6 = self._search(self.v6_keys, self.v6_rows, v6_keys)
+
+        positions = np.concatenate([v4_positions[found4], v6_positions[found6]])
+        rows = np.concatenate([rows4[found4], rows6[found6]])
+        return positions, rows
+
+
+class GeoTable:
+    """
+    Compact, column-oriented copy of the geolocation cache.
+
+    The table is built once from the CSV export and kept for the lifetime of the
+    worker. The JSON body served by /api/geolocation-data is serialised once per
+    load, together with the validators used for conditional GET requests.
+    """
+
+    def __init__(self, ips, lat, lng, city, country, mtime, version=None):
+        self.ips = ips
+        self.lat = lat
+        self.lng = lng
+        self.city = city
+        self.country = country
+        self.mtime = mtime
+        self.version = version if version is not None else mtime
+        self.index = PackedIPIndex(ips)
+
+        self.body = json.dumps(self.as_dict(), separators=(',', ':')).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.last_modified = formatdate(mtime, usegmt=True)
+
+    def __len__(self):
+        return len(self.ips)
+
+    def record(self, i):
+        return {
+            'lat': self.lat[i],
+            'lng': self.lng[i],
+            'city': self.city[i],
+            'country': self.country[i]
+        }
+
+    def as_dict(self):
+        """Return the table keyed by IP address, as served to the frontend"""
+        return {ip: self.record(i) for i, ip in enumerate(self.ips)}
+
+    def lookup(self, ips):
+        """
+        Look up a batch of IP addresses.
+
+        Args:
+            ips: Iterable of IP address strings
+
+        Returns:
+            Dictionary keyed by IP address for the addresses present in the table
+        """
+        ips = list(ips)
+        positions, rows = self.index.lookup(ips)
+        return {ips[p]: self.record(r) for p, r in zip(positions.tolist(), rows.tolist())}
+
+
+def _column(df, name, numeric=False):
+    """Convert a DataFrame column to a plain list with NaN replaced by None"""
+    values = df[name].astype(float) if numeric else df[name].astype(object)
+    return values.where(values.notna(), None).tolist()
+
+
+def load_geo_table(csv_path, mtime, version=None):
+    """
+    Read the geolocation CSV export into a GeoTable.
+
+    Args:
+        csv_path: Path to the geo_cache.csv export
+        mtime: Modification time of the file when it was read
+        version: Value used to tell whether the table is still current, defaults to mtime
+
+    Returns:
+        GeoTable with one row per IP address
+    """
+    import pandas as pd
+
+    geo_df = pd.read_csv(csv_path, usecols=GEO_COLUMNS, dtype={'ip_address': str})
+    return _table_from_frame(geo_df, mtime, version)
+
+
+def _table_from_frame(geo_df, mtime, version=None):
+    geo_df = geo_df.drop_duplicates('ip_address', keep='last')
+
+    return GeoTable(
+        ips=geo_df['ip_address'].astype(str).tolist(),
+        lat=_column(geo_df, 'latitude', numeric=True),
+        lng=_column(geo_df, 'longitude', numeric=True),
+        city=_column(geo_df, 'city'),
+        country=_column(geo_df, 'country'),
+        mtime=mtime,
+        version=version
+    )
+
+
+# --- SQLite geolocation cache ---
+
+_local = threading.local()
+
+
+def connect_writer(db_path=None):
+    """
+    Open a read-write connection to the geolocation cache database, in WAL mode.
+
+    Only the processes that fill the cache call this, so serving requests never
+    changes the database file. Once a writer has switched the file to WAL mode,
+    readers no longer block it.
+    """
+    conn = sqlite3.connect(db_path or GEO_CACHE_DB, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def get_db_connection(db_path=None):
+    """
+    Return a read-only connection to the geolocation cache database.
+
+    Connections are opened once per worker thread (and again after a fork),
+    then reused for every request handled by that thread.
+
+    Raises:
+        FileNotFoundError: If the database does not exist
+    """
+    db_path = db_path or GEO_CACHE_DB
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+
+    conn = connections.get(db_path)
+    if conn is None:
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Geolocation database not found at {db_path}")
+        uri = f"file:{os.path.abspath(db_path)}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute('PRAGMA query_only=ON')
+        connections[db_path] = conn
+    return conn
+
+
+def _db_signature(db_path):
+    """Modification times and sizes of the database and its WAL file"""
+    db_stat = os.stat(db_path)
+    signature = (db_stat.st_mtime, db_stat.st_size)
+    try:
+        wal_stat = os.stat(db_path + '-wal')
+    except FileNotFoundError:
+        return signature
+    # Opening a connection resets an empty WAL file and bumps its mtime; only a
+    # WAL holding frames means the data may have changed
+    if wal_stat.st_size:
+        signature += (wal_stat.st_mtime, wal_stat.st_size)
+    return signature
+
+
+def load_geo_table_from_db(db_path, version):
+    """Read every resolved row of the geolocation cache database into a GeoTable"""
+    import pandas as pd
+
+    conn = get_db_connection(db_path)
+    geo_df = pd.read_sql_query(
+        f"SELECT {', '.join(GEO_COLUMNS)} FROM geo_cache "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL",
+        conn
+    )
+    mtime = max(os.stat(path).st_mtime for path in (db_path, db_path + '-wal') if os.path.exists(path))
+    return _table_from_frame(geo_df, mtime, version)
+
+
+_lru_lock = threading.Lock()
+_lru = TTLCache(maxsize=GEO_LRU_SIZE, ttl=GEO_LRU_TTL)
+
+
+def lookup_db(ips, db_path=None):
+    """
+    Look up IP addresses in the geolocation cache database.
+
+    Hot addresses are answered from a small in-process LRU; the rest are fetched
+    with batched IN (...) queries.
+
+    Args:
+        ips: Iterable of IP address strings
+        db_path: Path to the cache database, defaults to GEO_CACHE_DB
+
+    Returns:
+        Dictionary keyed by IP address for the addresses that have coordinates
+    """
+    db_path = db_path or GEO_CACHE_DB
+    result = {}
+    missing = []
+    with _lru_lock:
+        for ip in dict.fromkeys(ips):
+            record = _lru.get((db_path, ip))
+            if record is not None:
+                result[ip] = record
+            elif isinstance(ip, str):
+                missing.append(ip)
+
+    inc('vns_cache_requests_total', len(result), cache='geo_lru', result='hit')
+    inc('vns_cache_requests_total', len(missing), cache='geo_lru', result='miss')
+    if not missing:
+        return result
+
+    conn = get_db_connection(db_path)
+    found = {}
+    for start in range(0, len(missing), SQLITE_BATCH_SIZE):
+        batch = missing[start:start + SQLITE_BATCH_SIZE]
+        rows = conn.execute(
+            "SELECT ip_address, latitude, longitude, city, country FROM geo_cache "
+            f"WHERE ip_address IN ({', '.join('?' * len(batch))}) "
+            "AND latitude IS NOT NULL AND longitude IS NOT NULL",
+            batch
+        ).fetchall()
+        for ip, lat, lng, city, country in rows:
+            found[ip] = {'lat': lat, 'lng': lng, 'city': city, 'country': country}
+
+    with _lru_lock:
+        for ip, record in found.items():
+            _lru[(db_path, ip)] = record
+    result.update(found)
+    return result
+
+
+# --- Columnar snapshot ---
+
+SNAPSHOT_FORMAT = 1
+_SNAPSHOT_ARRAYS = ['ip', 'lat', 'lng', 'city', 'country', 'v4_keys', 'v4_rows', 'v6_keys', 'v6_rows']
+
+
+def write_geo_snapshot(ips, lat, lng, city, country, snapshot_dir=None):
+    """
+    Write the geolocation table as a directory of memory-mappable .npy arrays.
+
+    Cities and countries are dictionary-encoded, and the packed IP index is
+    stored pre-sorted so readers can search it straight from the mapping. The
+    snapshot is written next to the target and swapped in at the end, so
+    readers never see a half-written directory.
+
+    Args:
+        ips, lat, lng, city, country: Equal-length sequences, one entry per IP
+        snapshot_dir: Output directory, defaults to GEO_SNAPSHOT_DIR
+
+    Returns:
+        Number of rows written
+    """
+    import pandas as pd
+
+    snapshot_dir = os.path.normpath(snapshot_dir or GEO_SNAPSHOT_DIR)
+    index = PackedIPIndex(ips)
+    city_codes, cities = pd.factorize(pd.Series(city, dtype=object))
+    country_codes, countries = pd.factorize(pd.Series(country, dtype=object))
+
+    arrays = {
+        'ip': np.array([ip.encode('ascii') for ip in ips], dtype='S'),
+        'lat': np.asarray(lat, dtype=np.float64),
+        'lng': np.asarray(lng, dtype=np.float64),
+        'city': city_codes.astype(np.int32),
+        'country': country_codes.astype(np.int32),
+        'v4_keys': index.v4_keys,
+        'v4_rows': index.v4_rows,
+        'v6_keys': index.v6_keys,
+        'v6_rows': index.v6_rows
+    }
+    meta = {
+        'format': SNAPSHOT_FORMAT,
+        'rows': len(ips),
+        'cities': cities.tolist(),
+        'countries': countries.tolist()
+    }
+
+    tmp_dir = f"{snapshot_dir}.tmp-{os.getpid()}"
+    old_dir = f"{snapshot_dir}.old-{os.getpid()}"
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    if os.path.exists(snapshot_dir):
+        os.rename(snapshot_dir, old_dir)
+    os.rename(tmp_dir, snapshot_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    return len(ips)
+
+
+class GeoSnapshot:
+    """Read-only view of a snapshot directory; arrays are memory-mapped, not parsed"""
+
+    def __init__(self, snapshot_dir, version=None):
+        with open(os.path.join(snapshot_dir, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported geolocation snapshot format in {snapshot_dir}")
+
+        self.version = version
+        self.mtime = os.stat(os.path.join(snapshot_dir, 'meta.json')).st_mtime
+        self.cities = meta['cities']
+        self.countries = meta['countries']
+        self.arrays = {
+            name: np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode='r')
+            for name in _SNAPSHOT_ARRAYS
+        }
+        self.index = PackedIPIndex.from_sorted(
+            self.arrays['v4_keys'], self.arrays['v4_rows'],
+            self.arrays['v6_keys'], self.arrays['v6_rows']
+        )
+
+    def __len__(self):
+        return len(self.arrays['ip'])
+
+    def _records(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        lat = self.arrays['lat'][rows]
+        lng = self.arrays['lng'][rows]
+        city_codes = self.arrays['city'][rows].tolist()
+        country_codes = self.arrays['country'][rows].tolist()
+        return (
+            {
+                'lat': None if np.isnan(lat[i]) else float(lat[i]),
+                'lng': None if np.isnan(lng[i]) else float(lng[i]),
+                'city': self.cities[city_codes[i]] if city_codes[i] >= 0 else None,
+                'country': self.countries[country_codes[i]] if country_codes[i] >= 0 else None
+            }
+            for i in range(len(rows))
+        )
+
+    def lookup(self, ips):
+        """Look up a batch of IP addresses; same result shape as GeoTable.lookup"""
+        ips = list(ips)
+        positions, rows = self.index.lookup(ips)
+        return {ips[p]: record for p, record in zip(positions.tolist(), self._records(rows))}
+
+    def to_table(self):
+        """Materialise the snapshot as a GeoTable for the full-table endpoint"""
+        records = list(self._records(np.arange(len(self))))
+        return GeoTable(
+            ips=[ip.decode('ascii') for ip in self.arrays['ip'].tolist()],
+            lat=[r['lat'] for r in records],
+            lng=[r['lng'] for r in records],
+            city=[r['city'] for r in records],
+            country=[r['country'] for r in records],
+            mtime=self.mtime,
+            version=self.version
+        )
+
+
+_snapshot_lock = threading.Lock()
+_snapshot = None
+
+
+def get_geo_snapshot(snapshot_dir=None):
+    """
+    Return the memory-mapped snapshot, remapping it when a new one is written.
+
+    Raises:
+        FileNotFoundError: If no snapshot has been written
+    """
+    global _snapshot
+    snapshot_dir = snapshot_dir or GEO_SNAPSHOT_DIR
+    meta_path = os.path.join(snapshot_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"Geolocation snapshot not found at {snapshot_dir}")
+    version = ('snapshot', snapshot_dir, os.stat(meta_path).st_mtime_ns)
+
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = GeoSnapshot(snapshot_dir, version)
+        return _snapshot
+
+
+# --- Table cache and source selection ---
+
+_lock = threading.Lock()
+_table = None
+
+
+def get_geo_table(source=None):
+    """
+    Return the cached GeoTable, reloading it only when the underlying file has changed.
+
+    Args:
+        source: 'sqlite', 'csv' or 'snapshot', defaults to GEO_SOURCE
+
+    Raises:
+        FileNotFoundError: If the configured source does not exist
+    """
+    global _table
+    source = source or GEO_SOURCE
+    if source == 'snapshot':
+        snapshot = get_geo_snapshot()
+        version = snapshot.version
+    elif source == 'csv':
+        if not os.path.exists(GEO_CACHE_CSV):
+            raise FileNotFoundError(f"Geolocation CSV file not found at {GEO_CACHE_CSV}")
+        version = ('csv', os.stat(GEO_CACHE_CSV).st_mtime)
+    else:
+        if not os.path.exists(GEO_CACHE_DB):
+            raise FileNotFoundError(f"Geolocation database not found at {GEO_CACHE_DB}")
+        version = ('sqlite',) + _db_signature(GEO_CACHE_DB)
+
+    table = _table
+    if table is not None and table.version == version:
+        return table
+
+    with _lock:
+        if _table is None or _table.version != version:
+            logger.info(f"Loading geolocation table from {source}")
+            if source == 'snapshot':
+                _table = snapshot.to_table()
+            elif source == 'csv':
+                _table = load_geo_table(GEO_CACHE_CSV, version[1], version)
+            else:
+                _table = load_geo_table_from_db(GEO_CACHE_DB, version)
+            logger.info(f"Loaded {len(_table)} geolocation records")
+        return _table
+
+
+def lookup_geolocation(ips, source=None):
+    """
+    Look up a batch of IP addresses in the configured geolocation source.
+
+    Raises:
+        FileNotFoundError: If the configured source does not exist
+    """
+    source = source or GEO_SOURCE
+    with timed('geo_lookup', source=source):
+        if source == 'snapshot':
+            return get_geo_snapshot().lookup(dict.fromkeys(ips))
+        if source == 'csv':
+            return get_geo_table(source).lookup(dict.fromkeys(ips))
+        return lookup_db(ips)
@@ -0,0 +1,274 @@
+"""
+Offline IP geolocation engine.
+
+Resolves IP addresses against a local IP-range table (GeoLite2 City blocks CSV
+format: a `network` CIDR column and a `geoname_id` column) and maps geoname IDs
+to coordinates through city_mapping.csv. No network access is needed, so the
+geolocation cache can be filled in bulk.
+
+Usage:
+    python geo_engine.py --blocks GeoLite2-City-Blocks-IPv4.csv --blocks GeoLite2-City-Blocks-IPv6.csv ../access.log
+"""
+import argparse
+import ipaddress
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from geo_data import GEO_CACHE_DB, connect_writer, pack_ips
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated list of IP-range tables used by the offline engine
+GEO_RANGE_BLOCKS = os.getenv('GEO_RANGE_BLOCKS', '')
+CITY_MAPPING_CSV = os.getenv('CITY_MAPPING_CSV', '../city_mapping.csv')
+
+
+def _ipv4_ranges(networks):
+    """Vectorised conversion of IPv4 CIDR strings to uint32 start/end arrays"""
+    parts = networks.str.split('/', n=1, expand=True)
+    octets = parts[0].str.split('.', n=3, expand=True).astype(np.uint32).to_numpy()
+    prefix = parts[1].astype(np.int64).to_numpy()
+
+    addr = (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+    host_mask = ((np.uint64(1) << (32 - prefix).astype(np.uint64)) - np.uint64(1)).astype(np.uint32)
+    start = addr & ~host_mask
+    return start, start | host_mask
+
+
+def _ipv6_ranges(networks):
+    """Convert IPv6 CIDR strings to 16-byte big-endian start/end arrays"""
+    starts, ends = [], []
+    for network in networks:
+        net = ipaddress.ip_network(network, strict=False)
+        starts.append(net.network_address.packed)
+        ends.append(net.broadcast_address.packed)
+    return np.array(starts, dtype='S16'), np.array(ends, dtype='S16')
+
+
+def load_city_mapping(mapping_path=None):
+    """
+    Load the geoname ID to coordinates table from city_mapping.csv.
+
+    Returns:
+        DataFrame indexed by geolite_geoname_id with lat, lng, city and country columns
+    """
+    mapping = pd.read_csv(
+        mapping_path or CITY_MAPPING_CSV,
+        usecols=['geolite_geoname_id', 'world_lat', 'world_lng', 'world_city_name', 'world_country']
+    )
+    mapping = mapping.drop_duplicates('geolite_geoname_id').set_index('geolite_geoname_id')
+    return mapping.rename(columns={
+        'world_lat': 'lat', 'world_lng': 'lng',
+        'world_city_name': 'city', 'world_country': 'country'
+    })
+
+
+_city_mapping = None
+
+
+def get_city_mapping():
+    """Return the city_mapping.csv table at CITY_MAPPING_CSV, loading it on first use"""
+    global _city_mapping
+    if _city_mapping is None:
+        _city_mapping = load_city_mapping()
+    return _city_mapping
+
+
+class IPRangeEngine:
+    """
+    Sorted start/end range arrays per address family, searched with numpy.
+
+    IPv4 ranges are held as uint32 and IPv6 ranges as 16-byte big-endian
+    strings, which order the same way as the 128-bit integers they encode.
+    """
+
+    def __init__(self, block_paths, mapping_path=None):
+        v4_start, v4_end, v4_geo = [], [], []
+        v6_start, v6_end, v6_geo = [], [], []
+
+        for path in block_paths:
+            blocks = pd.read_csv(path, usecols=['network', 'geoname_id'], dtype={'network': str})
+            blocks = blocks.dropna(subset=['geoname_id'])
+            is_v6 = blocks['network'].str.contains(':', regex=False)
+
+            v4 = blocks[~is_v6]
+            if not v4.empty:
+                start, end = _ipv4_ranges(v4['network'])
+                v4_start.append(start)
+                v4_end.append(end)
+                v4_geo.append(v4['geoname_id'].astype(np.int64).to_numpy())
+
+            v6 = blocks[is_v6]
+            if not v6.empty:
+                start, end = _ipv6_ranges(v6['network'])
+                v6_start.append(start)
+                v6_end.append(end)
+                v6_geo.append(v6['geoname_id'].astype(np.int64).to_numpy())
+
+        self.v4 = self._sorted(v4_start, v4_end, v4_geo, np.uint32)
+        self.v6 = self._sorted(v6_start, v6_end, v6_geo, 'S16')
+        self.mapping = load_city_mapping(mapping_path) if mapping_path else get_city_mapping()
+        logger.info(f"Loaded {len(self.v4[0])} IPv4 and {len(self.v6[0])} IPv6 ranges")
+
+    @staticmethod
+    def _sorted(starts, ends, geo_ids, dtype):
+        if not starts:
+            return np.array([], dtype=dtype), np.array([], dtype=dtype), np.array([], dtype=np.int64)
+        start, end, geo = np.concatenate(starts), np.concatenate(ends), np.concatenate(geo_ids)
+        order = np.argsort(start, kind='stable')
+        return start[order], end[order], geo[order]
+
+    @staticmethod
+    def _search(ranges, keys):
+        """Return the geoname ID for each key, or -1 when no range contains it"""
+        starts, ends, geo_ids = ranges
+        result = np.full(len(keys), -1, dtype=np.int64)
+        if len(starts) == 0 or len(keys) == 0:
+            return result
+        pos = np.searchsorted(starts, keys, side='right') - 1
+        valid = pos >= 0
+        pos = np.where(valid, pos, 0)
+        valid &= keys <= ends[pos]
+        result[valid] = geo_ids[pos[valid]]
+        return result
+
+    def resolve_geoname_ids(self, ips):
+        """
+        Resolve IP addresses to geoname IDs.
+
+        Args:
+            ips: List of IP address strings
+
+        Returns:
+            int64 array aligned with ips, -1 where the address is not covered
+        """
+        v4_keys, v4_positions, v6_keys, v6_positions = pack_ips(ips)
+        geo_ids = np.full(len(ips), -1, dtype=np.int64)
+        geo_ids[v4_positions] = self._search(self.v4, v4_keys)
+        geo_ids[v6_positions] = self._search(self.v6, v6_keys)
+        return geo_ids
+
+    def resolve(self, ips):
+        """
+        Resolve IP addresses to coordinates.
+
+        Args:
+            ips: Iterable of IP address strings
+
+        Returns:
+            Dictionary keyed by IP address with lat, lng, city and country for
+            every address whose range maps to a known city
+        """
+        ips = list(dict.fromkeys(ips))
+        geo_ids = self.resolve_geoname_ids(ips)
+        rows = self.mapping.index.get_indexer(geo_ids)
+
+        found = np.flatnonzero(rows >= 0)
+        matched = rows[found]
+        columns = zip(
+            self.mapping['lat'].to_numpy()[matched].tolist(),
+            self.mapping['lng'].to_numpy()[matched].tolist(),
+            self.mapping['city'].to_numpy()[matched].tolist(),
+            self.mapping['country'].to_numpy()[matched].tolist()
+        )
+        return {
+            ips[i]: {'lat': lat, 'lng': lng, 'city': city, 'country': country}
+            for i, (lat, lng, city, country) in zip(found.tolist(), columns)
+        }
+
+
+def fill_cache(records, db_path=None, now=None):
+    """
+    Write resolved records into the geolocation cache database in one transaction.
+
+    Args:
+        records: Dictionary keyed by IP address as returned by IPRangeEngine.resolve
+        db_path: Path to the cache database, defaults to GEO_CACHE_DB
+        now: UNIX timestamp recorded as the lookup time, defaults to the current time
+
+    Returns:
+        Number of rows written
+    """
+    now = int(now or time.time())
+    rows = [
+        (ip, r['lat'], r['lng'], r['city'], r['country'], 'success', now, now, 0)
+        for ip, r in records.items()
+    ]
+    conn = connect_writer(db_path)
+    try:
+        with conn:
+            conn.executemany(
+                """INSERT INTO geo_cache (ip_address, latitude, longitude, city, country,
+                                          status, last_api_call, last_successful_lookup, retries)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(ip_address) DO UPDATE SET
+                       latitude = excluded.latitude,
+                       longitude = excluded.longitude,
+                       city = excluded.city,
+                       country = excluded.country,
+                       status = excluded.status,
+                       last_api_call = excluded.last_api_call,
+                       last_successful_lookup = excluded.last_successful_lookup,
+                       retries = 0""",
+                rows
+            )
+    finally:
+        conn.close()
+    return len(rows)
+
+
+_engine = None
+
+
+def get_engine():
+    """
+    Return the offline engine built from GEO_RANGE_BLOCKS, loading it on first use.
+
+    Raises:
+        FileNotFoundError: If no range table is configured
+    """
+    global _engine
+    if _engine is None:
+        block_paths = [p for p in GEO_RANGE_BLOCKS.split(',') if p]
+        if not block_paths:
+            raise FileNotFoundError("No IP-range table configured (set GEO_RANGE_BLOCKS)")
+        _engine = IPRangeEngine(block_paths)
+    return _engine
+
+
+def read_ips(path):
+    """Read IP addresses from a log file (first field of each line) or a plain list"""
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return list(dict.fromkeys(line.split(' ', 1)[0].strip() for line in f if line.strip()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve IP addresses offline and fill the geolocation cache")
+    parser.add_argument('inputs', nargs='+', help="Log files or files with one IP address per line")
+    parser.add_argument('--blocks', action='append', required=True, help="IP-range table (GeoLite2 City blocks CSV)")
+    parser.add_argument('--mapping', default=CITY_MAPPING_CSV, help="city_mapping.csv path")
+    parser.add_argument('--db', default=GEO_CACHE_DB, help="Geolocation cache database to fill")
+    parser.add_argument('--dry-run', action='store_true', help="Resolve only, don't write to the database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    engine = IPRangeEngine(args.blocks, args.mapping)
+    ips = list(dict.fromkeys(ip for path in args.inputs for ip in read_ips(path)))
+
+    start = time.perf_counter()
+    records = engine.resolve(ips)
+    elapsed = time.perf_counter() - start
+    print(f"Resolved {len(records)} of {len(ips)} IPs in {elapsed:.3f}s "
+          f"({len(ips) / elapsed if elapsed else 0:,.0f} IPs/s)")
+
+    if not args.dry_run:
+        print(f"Wrote {fill_cache(records, args.db)} rows to {args.db}")
+
+
+if __name__ == '__main__':
+    main()
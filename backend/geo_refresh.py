@@ -0,0 +1,347 @@
+"""
+Geolocation cache refresher.
+
+Collects IP addresses that are missing from geolocation_cache.db, or whose
+entry is stale or due for a retry, resolves them in rate-limited concurrent
+batches with exponential backoff, and writes the results back in bulk.
+
+Runs in-process (set GEO_REFRESH_INTERVAL to a number of seconds) or as a CLI:
+    python geo_refresh.py ../access.log
+"""
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from dataset_store import get_dataset_ips, list_dataset_ids
+from geo_data import GEO_CACHE_DB, SQLITE_BATCH_SIZE, connect_writer
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, every worker may refresh
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Resolver selection: 'http' (an ip-api.com compatible batch service) or 'offline' (geo_engine.py)
+GEO_RESOLVER = os.getenv('GEO_RESOLVER', 'http')
+GEO_RESOLVER_URL = os.getenv('GEO_RESOLVER_URL', 'http://ip-api.com')
+
+# Seconds between background refresh cycles; 0 disables the in-process refresher
+GEO_REFRESH_INTERVAL = int(os.getenv('GEO_REFRESH_INTERVAL', 0))
+
+# Successful lookups older than this are refreshed
+GEO_STALE_AFTER = int(os.getenv('GEO_STALE_AFTER', 30 * 24 * 3600))
+# Failed lookups are retried after GEO_RETRY_DELAY * 2 ** retries seconds, at most GEO_MAX_RETRIES times
+GEO_RETRY_DELAY = int(os.getenv('GEO_RETRY_DELAY', 3600))
+GEO_MAX_RETRIES = int(os.getenv('GEO_MAX_RETRIES', 5))
+
+# The free ip-api.com batch endpoint takes 100 IPs per call and 15 calls per minute
+BATCH_SIZE = int(os.getenv('GEO_REFRESH_BATCH_SIZE', 100))
+BATCHES_PER_MINUTE = float(os.getenv('GEO_REFRESH_BATCHES_PER_MINUTE', 15))
+CONCURRENCY = int(os.getenv('GEO_REFRESH_CONCURRENCY', 2))
+MAX_ATTEMPTS = 4
+
+
+class ResolverError(Exception):
+    """Transient resolver failure (rate limit, timeout, server error) worth retrying"""
+
+
+class HttpBatchResolver:
+    """
+    Resolve IPs with an ip-api.com compatible batch endpoint.
+
+    POST {base_url}/batch takes a JSON list of IPs and returns one object per IP
+    with status, message, query, lat, lon, city and country fields.
+    """
+
+    fields = 'status,message,query,lat,lon,city,country'
+
+    def __init__(self, base_url=None, timeout=10):
+        self.base_url = (base_url or GEO_RESOLVER_URL).rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def resolve(self, ips):
+        """
+        Resolve a batch of IPs.
+
+        Returns:
+            Dictionary keyed by IP with a record per IP, or None for addresses
+            the service could not locate
+
+        Raises:
+            ResolverError: If the batch should be retried later
+        """
+        try:
+            response = self.session.post(f"{self.base_url}/batch", params={'fields': self.fields},
+                                         json=list(ips), timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ResolverError(str(e)) from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise ResolverError(f"Resolver returned HTTP {response.status_code}")
+        response.raise_for_status()
+
+        results = {}
+        for item in response.json():
+            ip = item.get('query')
+            if item.get('status') == 'success':
+                results[ip] = {'lat': item.get('lat'), 'lng': item.get('lon'),
+                               'city': item.get('city'), 'country': item.get('country')}
+            elif 'private' in (item.get('message') or '') or 'reserved' in (item.get('message') or ''):
+                results[ip] = {'status': 'private'}
+            else:
+                results[ip] = None
+        return results
+
+
+class OfflineResolver:
+    """Resolve IPs with the local IP-range engine from geo_engine.py"""
+
+    def __init__(self, engine=None):
+        if engine is None:
+            from geo_engine import get_engine
+            engine = get_engine()
+        self.engine = engine
+
+    def resolve(self, ips):
+        found = self.engine.resolve(ips)
+        return {ip: found.get(ip) for ip in ips}
+
+
+def get_resolver(name=None, base_url=None):
+    """Build the resolver selected by name or GEO_RESOLVER"""
+    name = name or GEO_RESOLVER
+    if name == 'offline':
+        return OfflineResolver()
+    if name == 'http':
+        return HttpBatchResolver(base_url)
+    raise ValueError(f"Unknown geolocation resolver: {name}")
+
+
+class RateLimiter:
+    """Token bucket shared by the worker threads; blocks until a call is allowed"""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def select_refresh_candidates(ips, db_path=None, now=None):
+    """
+    Pick the IPs that need a lookup: unknown, stale, or failed and due for a retry.
+
+    Args:
+        ips: Iterable of IP addresses, duplicates allowed
+        db_path: Path to the cache database, defaults to GEO_CACHE_DB
+        now: Current UNIX time, for testing
+
+    Returns:
+        Dictionary of IP to its current retry count
+    """
+    now = int(now or time.time())
+    ips = [ip for ip in dict.fromkeys(ips) if isinstance(ip, str) and ip]
+    known = {}
+    conn = sqlite3.connect(db_path or GEO_CACHE_DB, timeout=30)
+    try:
+        for start in range(0, len(ips), SQLITE_BATCH_SIZE):
+            batch = ips[start:start + SQLITE_BATCH_SIZE]
+            rows = conn.execute(
+                "SELECT ip_address, status, last_api_call, last_successful_lookup, retries FROM geo_cache "
+                f"WHERE ip_address IN ({', '.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            for ip, status, last_api_call, last_successful_lookup, retries in rows:
+                known[ip] = (status, last_api_call or 0, last_successful_lookup or 0, retries or 0)
+    finally:
+        conn.close()
+
+    candidates = {}
+    for ip in ips:
+        if ip not in known:
+            candidates[ip] = 0
+            continue
+        status, last_api_call, last_successful_lookup, retries = known[ip]
+        if status == 'success':
+            if now - last_successful_lookup >= GEO_STALE_AFTER:
+                candidates[ip] = 0
+        elif status == 'private':
+            continue
+        elif retries < GEO_MAX_RETRIES and now - last_api_call >= GEO_RETRY_DELAY * 2 ** retries:
+            candidates[ip] = retries
+    return candidates
+
+
+def write_results(results, retries, db_path=None, now=None):
+    """
+    Write one refresh cycle back to the cache database in a single transaction.
+
+    Args:
+        results: Dictionary of IP to record, {'status': 'private'}, None (not
+            found) or an exception message (gave up after retrying)
+        retries: Dictionary of IP to its retry count before this cycle
+    """
+    now = int(now or time.time())
+    success, other = [], []
+    for ip, record in results.items():
+        if isinstance(record, dict) and 'lat' in record:
+            success.append((ip, record['lat'], record['lng'], record['city'], record['country'], now, now))
+        elif isinstance(record, dict):
+            other.append((ip, record['status'], now, 0))
+        else:
+            status = 'failed_api' if record is None else 'failed_timeout'
+            other.append((ip, status, now, retries.get(ip, 0) + 1))
+
+    conn = connect_writer(db_path)
+    try:
+        with conn:
+            conn.executemany(
+                """INSERT INTO geo_cache (ip_address, latitude, longitude, city, country,
+                                          status, last_api_call, last_successful_lookup, retries)
+                   VALUES (?, ?, ?, ?, ?, 'success', ?, ?, 0)
+                   ON CONFLICT(ip_address) DO UPDATE SET
+                       latitude = excluded.latitude,
+                       longitude = excluded.longitude,
+                       city = excluded.city,
+                       country = excluded.country,
+                       status = 'success',
+                       last_api_call = excluded.last_api_call,
+                       last_successful_lookup = excluded.last_successful_lookup,
+                       retries = 0""",
+                success
+            )
+            conn.executemany(
+                """INSERT INTO geo_cache (ip_address, status, last_api_call, retries)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT(ip_address) DO UPDATE SET
+                       status = excluded.status,
+                       last_api_call = excluded.last_api_call,
+                       retries = excluded.retries""",
+                other
+            )
+    finally:
+        conn.close()
+    return len(success), len(other)
+
+
+def _resolve_with_backoff(resolver, batch, limiter, base_delay):
+    """Resolve one batch, retrying transient failures with exponential backoff and jitter"""
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.wait()
+        try:
+            return resolver.resolve(batch)
+        except ResolverError as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                logger.warning(f"Giving up on batch of {len(batch)} IPs: {str(e)}")
+                return {ip: str(e) for ip in batch}
+            delay = base_delay * 2 ** attempt * (1 + random.random())
+            logger.info(f"Resolver error ({str(e)}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def refresh_ips(ips, resolver=None, db_path=None, batch_size=None, concurrency=None,
+                batches_per_minute=None, base_delay=1.0):
+    """
+    Resolve the IPs that need it and write the results back to the cache.
+
+    Args:
+        ips: Iterable of IP addresses, duplicates allowed
+        resolver: Object with a resolve(ips) method, defaults to get_resolver()
+
+    Returns:
+        Dictionary with counts of candidate, resolved and failed IPs
+    """
+    candidates = select_refresh_candidates(ips, db_path)
+    if not candidates:
+        return {"candidates": 0, "resolved": 0, "failed": 0}
+
+    resolver = resolver or get_resolver()
+    batch_size = batch_size or BATCH_SIZE
+    limiter = RateLimiter(batches_per_minute if batches_per_minute is not None else BATCHES_PER_MINUTE)
+    pending = list(candidates)
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency or CONCURRENCY) as executor:
+        for batch_results in executor.map(lambda b: _resolve_with_backoff(resolver, b, limiter, base_delay), batches):
+            results.update(batch_results)
+    for ip in pending:
+        results.setdefault(ip, None)
+
+    resolved, failed = write_results(results, candidates, db_path)
+    logger.info(f"Geolocation refresh: {len(candidates)} candidates, {resolved} resolved, {failed} not resolved")
+    return {"candidates": len(candidates), "resolved": resolved, "failed": failed}
+
+
+def refresh_loaded_datasets(resolver=None, db_path=None):
+    """Refresh the IPs of every dataset currently held by this worker"""
+    ips = []
+    for dataset_id in list_dataset_ids():
+        ips.extend(get_dataset_ips(dataset_id) or [])
+    return refresh_ips(ips, resolver, db_path)
+
+
+def _refresh_loop(interval, db_path):
+    lock_path = (db_path or GEO_CACHE_DB) + '.refresh.lock'
+    while True:
+        time.sleep(interval)
+        try:
+            with open(lock_path, 'w') as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # Another worker is refreshing
+                refresh_loaded_datasets(db_path=db_path)
+        except Exception as e:
+            logger.error(f"Geolocation refresh failed: {str(e)}", exc_info=True)
+
+
+_refresher = None
+
+
+def start_background_refresher(interval=None, db_path=None):
+    """Start the in-process refresher thread once per worker if an interval is configured"""
+    global _refresher
+    interval = interval if interval is not None else GEO_REFRESH_INTERVAL
+    if interval <= 0 or _refresher is not None:
+        return None
+    _refresher = threading.Thread(target=_refresh_loop, args=(interval, db_path),
+                                  name='geo-refresh', daemon=True)
+    _refresher.start()
+    return _refresher
+
+
+def main():
+    from geo_engine import read_ips
+
+    parser = argparse.ArgumentParser(description="Refresh unknown and stale entries of the geolocation cache")
+    parser.add_argument('inputs', nargs='+', help="Log files or files with one IP address per line")
+    parser.add_argument('--resolver', choices=['http', 'offline'], default=GEO_RESOLVER)
+    parser.add_argument('--url', default=GEO_RESOLVER_URL, help="Base URL of the HTTP batch resolver")
+    parser.add_argument('--db', default=GEO_CACHE_DB, help="Geolocation cache database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    ips = [ip for path in args.inputs for ip in read_ips(path)]
+    print(refresh_ips(ips, get_resolver(args.resolver, args.url), args.db))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# Gunicorn settings for the backend: gunicorn -c gunicorn.conf.py
+#
+# PRELOAD_APP=1 imports the app and builds the geo index, city mapping and user
+# agent tables once in the master; workers share them copy-on-write. Set
+# DATASET_STORE_DIR to choose where uploads are shared between workers; with
+# more than one worker it defaults to a directory under the system temp dir.
+import glob
+import multiprocessing
+import os
+import tempfile
+
+wsgi_app = 'app:create_app()'
+bind = os.getenv('BIND', '0.0.0.0:8080')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+preload_app = os.getenv('PRELOAD_APP', '0') == '1'
+
+# A per-process upload store would make a datasetId from one worker unknown to the others,
+# so with several workers uploads are stored on disk unless DATASET_STORE_DIR is set
+if workers > 1:
+    os.environ.setdefault('DATASET_STORE_DIR', os.path.join(tempfile.gettempdir(),
+                                                            f"vns-datasets-{bind.rsplit(':', 1)[-1]}"))
+
+# Each worker writes its metrics here; /api/metrics sums them. Cleared on startup.
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"vns-metrics-{bind.rsplit(':', 1)[-1]}"))
+
+
+def on_starting(server):
+    metrics_dir = os.environ['METRICS_DIR']
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import parse_nginx_log
+        from geo_refresh import start_background_refresher
+        from log_tail import start_live_tail
+        start_background_refresher()
+        start_live_tail(parse_nginx_log)
@@ -0,0 +1,245 @@
+"""
+Ingest log files that already sit on the analysis host, without uploading them.
+
+The file is memory-mapped and parsed straight from the mapped bytes: a bytes
+regex is run over the mapping with finditer, so no Python list of lines is
+built. Large files are split into shards at newline boundaries and parsed by a
+pool of processes shared by all ingests. Each process maps the same file, so
+its pages are read once into the page cache and shared by all of them.
+
+Only paths under INGEST_ALLOWED_DIRS (comma-separated) can be read. Without
+it, local ingestion is disabled.
+
+    python local_ingest.py /var/log/nginx/access.log --workers 4 --store
+"""
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from metrics import inc, timed
+
+INGEST_ALLOWED_DIRS = [os.path.realpath(path.strip())
+                       for path in os.getenv('INGEST_ALLOWED_DIRS', '').split(',') if path.strip()]
+# Size of the parse pool and the most shards a file is split into; never more than the CPUs
+INGEST_WORKERS = max(1, min(int(os.getenv('INGEST_WORKERS', 4)), os.cpu_count() or 1))
+# Files smaller than this are parsed in-process; forking isn't worth it
+INGEST_SHARD_MIN_BYTES = int(os.getenv('INGEST_SHARD_MIN_BYTES', 16 << 20))
+
+# parse_nginx_log's two formats in one bytes pattern. Fields can't cross a newline,
+# so matching the whole buffer gives the same result as matching line by line.
+LOG_LINE_RE = re.compile(
+    rb'^(\S+) - (\S+) \[(.*?)\] "(?:(\S+) (.*?) (\S+)|)" (\d+) (\d+) "([^"\n]*)" "([^"\n]*)"', re.M)
+DATE_RE = re.compile(rb'(\d+)/(\w+)/(\d+):(\d+):(\d+):(\d+)')
+MONTHS = {b'Jan': 1, b'Feb': 2, b'Mar': 3, b'Apr': 4, b'May': 5, b'Jun': 6,
+          b'Jul': 7, b'Aug': 8, b'Sep': 9, b'Oct': 10, b'Nov': 11, b'Dec': 12}
+
+# Bytes that str.strip() removes from the start of a line
+_LEADING_SPACE = np.array([9, 10, 11, 12, 13, 28, 29, 30, 31, 32], dtype=np.uint8)
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+class IngestPathError(PermissionError):
+    """The path is outside INGEST_ALLOWED_DIRS, or local ingestion is disabled"""
+
+
+def resolve_allowed_path(path):
+    """
+    Resolve a path and check that it is a file under one of INGEST_ALLOWED_DIRS.
+
+    Returns:
+        The real path of the file
+
+    Raises:
+        IngestPathError: Ingestion is disabled or the path is not allowed
+        FileNotFoundError: The file does not exist
+    """
+    if not INGEST_ALLOWED_DIRS:
+        raise IngestPathError("Local ingestion is disabled; set INGEST_ALLOWED_DIRS")
+    real_path = os.path.realpath(path)
+    if not any(os.path.commonpath([real_path, root]) == root for root in INGEST_ALLOWED_DIRS):
+        raise IngestPathError(f"{path} is not under an allowed directory")
+    if not os.path.isfile(real_path):
+        raise FileNotFoundError(f"{path} does not exist or is not a file")
+    return real_path
+
+
+def _iso_date(raw, cache):
+    value = cache.get(raw, False)
+    if value is not False:
+        return value
+    match = DATE_RE.search(raw)
+    value = None
+    if match:
+        day, month, year, hour, minute, second = match.groups()
+        try:
+            value = datetime(int(year), MONTHS.get(month, 1), int(day),
+                             int(hour), int(minute), int(second)).isoformat()
+        except ValueError:
+            pass
+    cache[raw] = value
+    return value
+
+
+def _count_lines(buffer, start, end):
+    """Count the lines in buffer[start:end] that aren't blank, as the upload path does, without copying it"""
+    data = np.frombuffer(buffer, dtype=np.uint8, count=end - start, offset=start)
+    newlines = np.flatnonzero(data == 10)
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.append(newlines, len(data))
+    used = ends > starts
+    # Only a line starting with whitespace (or a non-ASCII byte, which may be Unicode
+    # whitespace) can be blank once stripped; those few are checked one by one
+    first = data[starts[used]]
+    maybe_blank = np.isin(first, _LEADING_SPACE) | (first >= 0x80)
+    blank = sum(not bytes(data[line_start:line_end]).decode('utf-8', errors='replace').strip()
+                for line_start, line_end in zip(starts[used][maybe_blank], ends[used][maybe_blank]))
+    return int(np.count_nonzero(used)) - blank
+
+
+def parse_range(buffer, start, end):
+    """
+    Parse the log lines in buffer[start:end].
+
+    Args:
+        buffer: A bytes-like object, usually an mmap of the log file
+        start: Offset of the first line
+        end: Offset just past the last line
+
+    Returns:
+        Tuple of (list of entry tuples in DATASET_COLUMNS order, number of non-empty lines)
+    """
+    rows = []
+    dates = {}
+    # IPs, agents, referers and most paths repeat, so each distinct value is decoded once
+    # and shared by every entry that has it
+    strings = {}
+
+    def text(raw):
+        value = strings.get(raw)
+        if value is None:
+            value = strings[raw] = raw.decode('utf-8', 'replace')
+        return value
+
+    for match in LOG_LINE_RE.finditer(buffer, start, end):
+        ip, _, raw_date, method, path, _, status, size, referer, agent = match.groups()
+        rows.append((
+            text(ip),
+            _iso_date(raw_date, dates),
+            text(method) if method is not None else '',
+            text(path) if path is not None else '',
+            int(status),
+            int(size),
+            text(referer) if referer != b'-' else None,
+            text(agent),
+        ))
+    return rows, _count_lines(buffer, start, end)
+
+
+def _parse_shard(task):
+    path, start, end = task
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return parse_range(mapped, start, end)
+
+
+def _get_pool():
+    """
+    Return the pool of INGEST_WORKERS parse processes, started on first use.
+
+    The processes are spawned, not forked: the server runs threads (request
+    threads, the geo refresher, the live tail), and a fork could copy a lock
+    that one of them holds.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = multiprocessing.get_context('spawn').Pool(INGEST_WORKERS)
+        return _pool
+
+
+def shard_bounds(buffer, shards):
+    """Split buffer into about equal ranges that start and end on line boundaries"""
+    size = len(buffer)
+    bounds, start = [], 0
+    for index in range(1, shards):
+        cut = buffer.find(b'\n', max(start, size * index // shards))
+        if cut < 0:
+            break
+        bounds.append((start, cut + 1))
+        start = cut + 1
+    bounds.append((start, size))
+    return [(s, e) for s, e in bounds if e > s]
+
+
+def ingest_file(path, workers=None):
+    """
+    Parse a local log file through a read-only memory mapping.
+
+    Args:
+        path: Path of the file, checked against INGEST_ALLOWED_DIRS
+        workers: Number of shards parsed in parallel; at most, and by default, INGEST_WORKERS
+
+    Returns:
+        Tuple of (entries in the parse_nginx_log format, statistics dictionary)
+    """
+    real_path = resolve_allowed_path(path)
+    workers = max(1, min(workers or INGEST_WORKERS, INGEST_WORKERS))
+    started = time.perf_counter()
+    columns = ('ipAddress', 'dateTime', 'method', 'path', 'statusCode', 'bytes', 'referer', 'userAgent')
+
+    with open(real_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return [], {"path": real_path, "bytes": 0, "lines": 0, "parsed": 0, "skipped": 0, "shards": 0,
+                        "seconds": 0.0}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, timed('ingest_parse'):
+            shards = shard_bounds(mapped, workers if size >= INGEST_SHARD_MIN_BYTES else 1)
+            if len(shards) > 1:
+                # Only the path, the shard bounds and the rows are pickled
+                results = _get_pool().map(_parse_shard, [(real_path, start, end) for start, end in shards])
+            else:
+                results = [parse_range(mapped, start, end) for start, end in shards]
+
+    entries = [dict(zip(columns, row)) for rows, _ in results for row in rows]
+    lines = sum(count for _, count in results)
+    inc('vns_log_lines_total', len(entries), result='parsed')
+    inc('vns_log_lines_total', lines - len(entries), result='skipped')
+    return entries, {
+        "path": real_path,
+        "bytes": size,
+        "lines": lines,
+        "parsed": len(entries),
+        "skipped": lines - len(entries),
+        "shards": len(shards),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse a local log file through a memory mapping")
+    parser.add_argument('path')
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS, help="Shards parsed in parallel, at most INGEST_WORKERS")
+    parser.add_argument('--store', action='store_true', help="Append the entries to the persistent log store")
+    args = parser.parse_args()
+
+    global INGEST_ALLOWED_DIRS
+    # On the command line the caller already has access to the file
+    INGEST_ALLOWED_DIRS = INGEST_ALLOWED_DIRS or [os.path.dirname(os.path.realpath(args.path))]
+    entries, stats = ingest_file(args.path, args.workers)
+    if args.store:
+        from log_store import append_entries
+        stats["store"] = append_entries(entries, os.path.basename(args.path))
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Persistent store of parsed log entries, partitioned by day.
+
+Each day is a directory under LOG_STORE_DIR named YYYY-MM-DD. It holds parts,
+each a set of .npy columns in the dataset_store format, plus a manifest.json
+listing the live parts. An append writes new parts and then swaps in the
+manifest. Readers go by the manifest, so they never see a partial append.
+
+Once a day has more than LOG_STORE_MAX_PARTS parts, they are merged into one,
+so frequent small appends don't slow down reads. Queries list only the day
+directories inside the requested date range, and load only the columns asked
+for.
+"""
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import numpy as np
+
+from dataset_store import DATASET_COLUMNS, SharedDataset, write_columns
+from metrics import inc, timed
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends from several processes are not serialised
+    fcntl = None
+
+LOG_STORE_DIR = os.getenv('LOG_STORE_DIR', 'log_store')
+LOG_STORE_MAX_PARTS = int(os.getenv('LOG_STORE_MAX_PARTS', 16))
+# Days older than this, counted back from the newest stored day, are dropped; 0 keeps everything
+LOG_STORE_RETENTION_DAYS = int(os.getenv('LOG_STORE_RETENTION_DAYS', 0))
+
+_DAY_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+@contextmanager
+def _writer_lock():
+    """Serialise appends and compactions across workers"""
+    os.makedirs(LOG_STORE_DIR, exist_ok=True)
+    with open(os.path.join(LOG_STORE_DIR, '.lock'), 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _read_manifest(day):
+    try:
+        with open(os.path.join(LOG_STORE_DIR, day, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)['parts']
+    except FileNotFoundError:
+        return []
+
+
+def _write_manifest(day, parts):
+    path = os.path.join(LOG_STORE_DIR, day, 'manifest.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({"parts": parts}, f)
+    os.replace(path + '.tmp', path)
+
+
+def _new_part(day, entries, source):
+    name = f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+    write_columns(os.path.join(LOG_STORE_DIR, day, name), entries, source)
+    return {"name": name, "rows": len(entries)}
+
+
+def _compact(day, parts):
+    """Merge a day's parts into one; old parts are removed after the manifest no longer lists them"""
+    entries = []
+    for part in parts:
+        entries.extend(SharedDataset(os.path.join(LOG_STORE_DIR, day, part['name'])).entries)
+    merged = _new_part(day, entries, 'compacted')
+    _write_manifest(day, [merged])
+    for part in parts:
+        shutil.rmtree(os.path.join(LOG_STORE_DIR, day, part['name']), ignore_errors=True)
+    return [merged]
+
+
+def _validate_day(value, name):
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str) or not _DAY_RE.fullmatch(value):
+        raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+    return value
+
+
+def stored_days():
+    """Return the days that have stored entries, oldest first"""
+    try:
+        return sorted(name for name in os.listdir(LOG_STORE_DIR) if _DAY_RE.fullmatch(name))
+    except FileNotFoundError:
+        return []
+
+
+def _drop_expired(days):
+    if not LOG_STORE_RETENTION_DAYS or not days:
+        return []
+    cutoff = (date.fromisoformat(days[-1]) - timedelta(days=LOG_STORE_RETENTION_DAYS - 1)).isoformat()
+    expired = [day for day in days if day < cutoff]
+    for day in expired:
+        shutil.rmtree(os.path.join(LOG_STORE_DIR, day), ignore_errors=True)
+    return expired
+
+
+def append_entries(entries, source=None):
+    """
+    Append parsed entries to the store, split into their day partitions.
+
+    Args:
+        entries: List of parsed log entries as returned by parse_nginx_log
+        source: Name recorded with the new parts, e.g. the uploaded file name
+
+    Returns:
+        Dictionary with the rows appended per day, the total, and the number of
+        entries skipped for having no timestamp
+    """
+    by_day = {}
+    skipped = 0
+    for entry in entries:
+        day = (entry.get('dateTime') or '')[:10]
+        if _DAY_RE.fullmatch(day):
+            by_day.setdefault(day, []).append(entry)
+        else:
+            skipped += 1
+
+    with timed('store_append'), _writer_lock():
+        for day, day_entries in sorted(by_day.items()):
+            os.makedirs(os.path.join(LOG_STORE_DIR, day), exist_ok=True)
+            parts = _read_manifest(day) + [_new_part(day, day_entries, source)]
+            _write_manifest(day, parts)
+            if len(parts) > LOG_STORE_MAX_PARTS:
+                _compact(day, parts)
+        expired = _drop_expired(stored_days())
+
+    appended = sum(len(day_entries) for day_entries in by_day.values())
+    inc('vns_store_rows_total', appended, result='appended')
+    inc('vns_store_rows_total', skipped, result='skipped')
+    return {
+        "rows": appended,
+        "days": {day: len(day_entries) for day, day_entries in sorted(by_day.items())},
+        "skipped": skipped,
+        "expiredDays": expired,
+    }
+
+
+def list_partitions(date_from=None, date_to=None):
+    """Return [{"day", "rows", "parts"}] for the stored days in the range (inclusive)"""
+    date_from, date_to = _validate_day(date_from, 'date_from'), _validate_day(date_to, 'date_to')
+    partitions = []
+    for day in _days_in_range(date_from, date_to):
+        parts = _read_manifest(day)
+        partitions.append({"day": day, "rows": sum(part['rows'] for part in parts), "parts": len(parts)})
+    return partitions
+
+
+def _days_in_range(date_from, date_to):
+    # Day directory names sort the same way as the dates they hold, so pruning is a string comparison
+    return [day for day in stored_days()
+            if (date_from is None or day >= date_from) and (date_to is None or day <= date_to)]
+
+
+def _read_day(day, load):
+    for attempt in range(2):
+        try:
+            datasets = [SharedDataset(os.path.join(LOG_STORE_DIR, day, part['name'])) for part in _read_manifest(day)]
+            return [load(dataset) for dataset in datasets]
+        except FileNotFoundError:
+            # A compaction replaced the parts after we read the manifest; read it again
+            if attempt:
+                raise
+    return []
+
+
+def read_range(date_from=None, date_to=None, columns=None):
+    """
+    Read stored entries between two days, inclusive.
+
+    Only the day partitions inside the range are opened, and only the
+    requested columns are read from them.
+
+    Args:
+        date_from: First day as YYYY-MM-DD, or None for no lower bound
+        date_to: Last day as YYYY-MM-DD, or None for no upper bound
+        columns: Column names to read; defaults to all of them
+
+    Returns:
+        Dictionary of column name to numpy array (object arrays for strings)
+
+    Raises:
+        ValueError: A bound is not a YYYY-MM-DD date
+    """
+    date_from, date_to = _validate_day(date_from, 'date_from'), _validate_day(date_to, 'date_to')
+    names = [name for name in (columns or DATASET_COLUMNS) if name in DATASET_COLUMNS]
+    with timed('store_read'):
+        pieces = []
+        for day in _days_in_range(date_from, date_to):
+            pieces.extend(_read_day(day, lambda dataset: {name: dataset.column(name) for name in names}))
+        return {
+            name: (np.concatenate([piece[name] for piece in pieces]) if pieces else
+                   np.array([], dtype=object if DATASET_COLUMNS[name] == 'str' else np.int64))
+            for name in names
+        }
+
+
+def map_parts(load, date_from=None, date_to=None):
+    """
+    Apply a function to every stored part between two days, inclusive.
+
+    Parts are never changed once written, so results can be cached by the
+    part's path. A part replaced by a compaction is not seen half-way.
+
+    Args:
+        load: Function taking a part's SharedDataset
+        date_from: First day as YYYY-MM-DD, or None for no lower bound
+        date_to: Last day as YYYY-MM-DD, or None for no upper bound
+
+    Returns:
+        List of what load returned, one item per part
+
+    Raises:
+        ValueError: A bound is not a YYYY-MM-DD date
+    """
+    date_from, date_to = _validate_day(date_from, 'date_from'), _validate_day(date_to, 'date_to')
+    results = []
+    for day in _days_in_range(date_from, date_to):
+        results.extend(_read_day(day, load))
+    return results
+
+
+def read_range_frame(date_from=None, date_to=None, columns=None):
+    """Like read_range, but as a DataFrame with dateTime parsed, ready for the anomaly detectors or the report"""
+    import pandas as pd
+
+    df = pd.DataFrame(read_range(date_from, date_to, columns))
+    if 'dateTime' in df.columns:
+        df['dateTime'] = pd.to_datetime(df['dateTime'])
+    return df
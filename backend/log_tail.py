@@ -0,0 +1,342 @@
+"""
+Follow server-side access logs and publish new entries within a second.
+
+Set TAIL_FILES to a comma-separated list of log paths. One process tails
+them: either `python log_tail.py`, or a background thread in one app worker.
+Every worker starts the thread, and the one holding the lock file does the
+tailing. New lines are parsed with parse_nginx_log in micro-batches, one at
+least every TAIL_BATCH_INTERVAL seconds. Each batch is written to TAIL_LIVE_DIR
+as a numbered columnar part. A rolling per-minute summary is kept next to the
+parts. Every worker can serve both from /api/live/entries and /api/live/summary.
+
+Each file's inode and the offset of the last complete line handed on are saved
+to TAIL_CHECKPOINT_FILE after every batch. A restart resumes from there. When
+the inode changes (logrotate's rename and create), the rest of the old file is
+read before moving on to the new one. A file that shrinks (copytruncate) is
+read again from the start. A batch that fails to publish is kept and retried
+with backoff, and no more is read meanwhile once it is full. Delivery is
+at-least-once: a crash or failure between publishing a batch and saving the
+checkpoint replays that batch.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from dataset_store import SharedDataset, write_columns
+from metrics import inc, observe
+
+try:
+    import fcntl
+except ImportError:  # Windows: run log_tail.py on its own instead of in the workers
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TAIL_FILES = [path.strip() for path in os.getenv('TAIL_FILES', '').split(',') if path.strip()]
+TAIL_CHECKPOINT_FILE = os.getenv('TAIL_CHECKPOINT_FILE', 'tail_checkpoints.json')
+TAIL_LIVE_DIR = os.getenv('TAIL_LIVE_DIR', 'live')
+# Longest a line waits before its batch is published, and the most lines per batch
+TAIL_BATCH_INTERVAL = float(os.getenv('TAIL_BATCH_INTERVAL', 0.2))
+TAIL_BATCH_LINES = int(os.getenv('TAIL_BATCH_LINES', 20000))
+TAIL_POLL_INTERVAL = float(os.getenv('TAIL_POLL_INTERVAL', 0.05))
+# Seconds of batches and per-minute summaries kept in TAIL_LIVE_DIR
+TAIL_LIVE_WINDOW = int(os.getenv('TAIL_LIVE_WINDOW', 3600))
+# Where to start in a file with no checkpoint: 'end' skips its history, 'start' reads it all
+TAIL_START = os.getenv('TAIL_START', 'end')
+# Also append each batch to the persistent log store
+TAIL_STORE = os.getenv('TAIL_STORE', '0') == '1'
+# Longest wait between attempts to publish a batch that failed
+TAIL_RETRY_MAX = float(os.getenv('TAIL_RETRY_MAX', 30))
+
+READ_SIZE = 1 << 20
+
+
+class FileTailer:
+    """Reads complete new lines from one file, following rotation and truncation"""
+
+    def __init__(self, path, checkpoint=None, start=TAIL_START):
+        self.path = path
+        self.file = None
+        self.inode = None
+        self.offset = 0
+        self.partial = b''
+        self._open(checkpoint, start)
+
+    def _open(self, checkpoint=None, start='start'):
+        try:
+            self.file = open(self.path, 'rb')
+        except FileNotFoundError:
+            self.file = None
+            return
+        stat = os.fstat(self.file.fileno())
+        self.inode, self.partial = stat.st_ino, b''
+        if checkpoint and checkpoint.get('inode') == stat.st_ino and checkpoint.get('offset', 0) <= stat.st_size:
+            self.offset = checkpoint['offset']
+        elif start == 'end' and not checkpoint:
+            self.offset = stat.st_size
+        else:
+            self.offset = 0
+        self.file.seek(self.offset)
+
+    @property
+    def checkpoint(self):
+        """Position after the last complete line returned"""
+        return {"inode": self.inode, "offset": self.offset - len(self.partial)}
+
+    def _read_available(self):
+        lines = []
+        while True:
+            chunk = self.file.read(READ_SIZE)
+            if not chunk:
+                return lines
+            self.offset += len(chunk)
+            data = self.partial + chunk
+            complete, _, self.partial = data.rpartition(b'\n')
+            if complete:
+                lines.extend(complete.decode('utf-8', errors='replace').split('\n'))
+
+    def poll(self):
+        """Return the complete lines written since the last call"""
+        if self.file is None:
+            self._open()
+            if self.file is None:
+                return []
+
+        lines = self._read_available()
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return lines  # Rotated away and not recreated yet; keep the old file open
+        if stat.st_ino != self.inode:
+            # Rotated: what was left in the old file has just been read; switch to the new one
+            self.file.close()
+            self._open()
+            if self.file is not None:
+                lines.extend(self._read_available())
+                logger.info(f"Following rotated log {self.path}")
+        elif stat.st_size < self.offset:
+            logger.info(f"{self.path} was truncated, reading it from the start")
+            self.file.seek(0)
+            self.offset, self.partial = 0, b''
+            lines.extend(self._read_available())
+        return [line for line in lines if line.strip()]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def _read_json(path, default):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def _write_json(path, value):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(value, f)
+    os.replace(path + '.tmp', path)
+
+
+def _batch_name(cursor):
+    return f"batch-{cursor:012d}"
+
+
+def _batch_cursors():
+    try:
+        names = os.listdir(TAIL_LIVE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[6:]) for name in names if name.startswith('batch-') and name[6:].isdigit())
+
+
+class LivePublisher:
+    """Writes parsed batches to TAIL_LIVE_DIR and keeps the rolling per-minute summary there"""
+
+    def __init__(self):
+        os.makedirs(TAIL_LIVE_DIR, exist_ok=True)
+        cursors = _batch_cursors()
+        self.cursor = cursors[-1] if cursors else 0
+        self.minutes = _read_json(os.path.join(TAIL_LIVE_DIR, 'summary.json'), {}).get('perMinute', {})
+
+    def publish(self, entries, sources):
+        self.cursor += 1
+        write_columns(os.path.join(TAIL_LIVE_DIR, _batch_name(self.cursor)), entries, ','.join(sources),
+                      published=time.time())
+
+        for entry in entries:
+            minute = (entry.get('dateTime') or '')[:16]
+            if not minute:
+                continue
+            bucket = self.minutes.setdefault(minute, {"requests": 0, "errors": 0, "bytes": 0, "statusCodes": {}})
+            bucket["requests"] += 1
+            bucket["bytes"] += entry["bytes"]
+            if entry["statusCode"] >= 400:
+                bucket["errors"] += 1
+            code = str(entry["statusCode"])
+            bucket["statusCodes"][code] = bucket["statusCodes"].get(code, 0) + 1
+        keep = TAIL_LIVE_WINDOW // 60 + 1
+        for minute in sorted(self.minutes)[:-keep]:
+            del self.minutes[minute]
+
+        _write_json(os.path.join(TAIL_LIVE_DIR, 'summary.json'),
+                    {"cursor": self.cursor, "updated": time.time(), "files": sources, "perMinute": self.minutes})
+        self._prune()
+
+    def _prune(self):
+        cutoff = time.time() - TAIL_LIVE_WINDOW
+        for cursor in _batch_cursors()[:-1]:
+            path = os.path.join(TAIL_LIVE_DIR, _batch_name(cursor))
+            try:
+                if os.stat(path).st_mtime >= cutoff:
+                    break
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def read_live_entries(after=0, limit=None):
+    """
+    Return the live entries published after a cursor.
+
+    Args:
+        after: Cursor returned by an earlier call, or 0 for everything still held
+        limit: Stop after the batch that reaches this many entries
+
+    Returns:
+        Tuple of (entries, cursor of the last batch included)
+    """
+    entries, cursor = [], after
+    for batch in _batch_cursors():
+        if batch <= after:
+            continue
+        try:
+            entries.extend(SharedDataset(os.path.join(TAIL_LIVE_DIR, _batch_name(batch))).entries)
+        except FileNotFoundError:
+            continue  # Pruned while we were reading
+        cursor = batch
+        if limit and len(entries) >= limit:
+            break
+    return entries, cursor
+
+
+def read_live_summary():
+    """Return the rolling per-minute summary, with how long ago it was last updated"""
+    summary = _read_json(os.path.join(TAIL_LIVE_DIR, 'summary.json'), None)
+    if summary is None:
+        return None
+    summary["secondsSinceUpdate"] = round(time.time() - summary["updated"], 3)
+    summary["perMinute"] = [{"minute": minute, **values} for minute, values in sorted(summary["perMinute"].items())]
+    return summary
+
+
+class LiveTail:
+    """Tails TAIL_FILES, publishing micro-batches and checkpointing after each one"""
+
+    def __init__(self, parse, paths=None):
+        self.parse = parse
+        checkpoints = _read_json(TAIL_CHECKPOINT_FILE, {})
+        self.tailers = [FileTailer(path, checkpoints.get(path)) for path in (paths or TAIL_FILES)]
+        self.publisher = LivePublisher()
+        self._stop = threading.Event()
+
+    def _flush(self, pending):
+        started = time.perf_counter()
+        lines = [line for _, line in pending]
+        entries = self.parse(lines)
+        self.publisher.publish(entries, [tailer.path for tailer in self.tailers])
+        if TAIL_STORE:
+            from log_store import append_entries
+            append_entries(entries, 'tail')
+        _write_json(TAIL_CHECKPOINT_FILE, {tailer.path: tailer.checkpoint for tailer in self.tailers})
+        inc('vns_tail_lines_total', len(lines))
+        observe('vns_stage_seconds', time.perf_counter() - started, stage='tail_batch')
+        # Wait from the first line of the batch being read to its publication
+        observe('vns_stage_seconds', time.monotonic() - pending[0][0], stage='tail_lag')
+
+    def run(self):
+        pending = []
+        failures, retry_at = 0, 0.0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            # The tailers have moved past the pending lines, so they are only dropped once published
+            if len(pending) < TAIL_BATCH_LINES:
+                for tailer in self.tailers:
+                    pending.extend((now, line) for line in tailer.poll())
+            due = pending and (len(pending) >= TAIL_BATCH_LINES or now - pending[0][0] >= TAIL_BATCH_INTERVAL)
+            if due and now >= retry_at:
+                try:
+                    self._flush(pending)
+                except Exception as e:
+                    failures += 1
+                    delay = min(TAIL_RETRY_MAX, TAIL_BATCH_INTERVAL * 2 ** failures)
+                    retry_at = now + delay
+                    logger.error(f"Publishing a tail batch failed, retrying in {delay:g}s: {str(e)}", exc_info=True)
+                else:
+                    pending, failures = [], 0
+            else:
+                self._stop.wait(TAIL_POLL_INTERVAL)
+        for tailer in self.tailers:
+            tailer.close()
+
+    def stop(self):
+        self._stop.set()
+
+
+def _tail_loop(parse, paths):
+    """Wait for the tail lock, then tail until the process exits"""
+    lock_path = TAIL_CHECKPOINT_FILE + '.lock'
+    while True:
+        try:
+            with open(lock_path, 'w') as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        time.sleep(5)  # Another process is tailing; take over if it goes away
+                        continue
+                logger.info(f"Tailing {', '.join(paths)}")
+                LiveTail(parse, paths).run()
+        except Exception as e:
+            logger.error(f"Log tailing failed: {str(e)}", exc_info=True)
+            time.sleep(5)
+
+
+_tail_thread = None
+
+
+def start_live_tail(parse):
+    """Start the tailing thread once per process if TAIL_FILES is configured"""
+    global _tail_thread
+    if not TAIL_FILES or _tail_thread is not None:
+        return None
+    _tail_thread = threading.Thread(target=_tail_loop, args=(parse, TAIL_FILES), name='log-tail', daemon=True)
+    _tail_thread.start()
+    return _tail_thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tail access logs into the live dataset")
+    parser.add_argument('files', nargs='*', help="Log files to follow (default TAIL_FILES)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from app import parse_nginx_log
+
+    paths = args.files or TAIL_FILES
+    if not paths:
+        parser.error("Give the log files to follow, or set TAIL_FILES")
+    try:
+        _tail_loop(parse_nginx_log, paths)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
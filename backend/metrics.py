@@ -0,0 +1,211 @@
+"""
+Low-overhead counters and histograms, exposed in Prometheus text format.
+
+Each process keeps its own values in plain dictionaries. With METRICS_DIR set,
+every process writes its values to its own JSON file there, at most every
+METRICS_FLUSH_INTERVAL seconds, and render_metrics() sums the files of all
+workers. gunicorn.conf.py sets METRICS_DIR and clears it when the server starts.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+# Upper bounds in seconds, from sub-millisecond lookups to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# name -> (type, help)
+METRICS = {
+    'vns_http_requests_total': ('counter', 'HTTP requests by endpoint and status code'),
+    'vns_http_request_seconds': ('histogram', 'HTTP request latency by endpoint'),
+    'vns_stage_seconds': ('histogram', 'Time spent in each processing stage'),
+    'vns_log_lines_total': ('counter', 'Log lines by parse result (parsed or skipped)'),
+    'vns_bytes_in_total': ('counter', 'Request body bytes received by endpoint'),
+    'vns_bytes_out_total': ('counter', 'Response body bytes sent by endpoint'),
+    'vns_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss)'),
+    'vns_external_call_errors_total': ('counter', 'Failed external calls by service and reason'),
+    'vns_chat_responses_total': ('counter', 'Chat answers by source (local, cache or llm)'),
+    'vns_tail_lines_total': ('counter', 'Lines read from tailed log files'),
+    'vns_store_rows_total': ('counter', 'Rows appended to the log store, and rows skipped for having no timestamp'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_collectors = []
+_state = {'pid': None, 'last_flush': 0.0, 'path': None}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _maybe_flush()
+
+
+def set_total(name, value, **labels):
+    """Set a counter to an absolute value, for totals kept elsewhere (e.g. lru_cache statistics)"""
+    with _lock:
+        _counters[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    """Record a value in a histogram"""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(DEFAULT_BUCKETS) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(DEFAULT_BUCKETS, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+    _maybe_flush()
+
+
+@contextmanager
+def timed(stage, name='vns_stage_seconds', **labels):
+    """Time the enclosed block into a histogram, labelled with the stage name"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, stage=stage, **labels)
+
+
+def _snapshot():
+    with _lock:
+        return {
+            'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, labels, buckets[:], total, count]
+                           for (name, labels), (buckets, total, count) in _histograms.items()],
+        }
+
+
+def register_collector(collector):
+    """Register a function called before values are written or rendered, e.g. to copy lru_cache statistics"""
+    _collectors.append(collector)
+
+
+def _collect():
+    for collector in _collectors:
+        collector()
+
+
+def flush():
+    """Write this process's values to its file in METRICS_DIR"""
+    if not METRICS_DIR:
+        return
+    if _state['path'] is None:
+        _state['pid'] = os.getpid()
+        _state['path'] = os.path.join(METRICS_DIR, f"{_state['pid']}-{time.time_ns()}.json")
+    _collect()
+    _state['last_flush'] = time.monotonic()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    tmp_path = f"{_state['path']}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(_snapshot(), f)
+    os.replace(tmp_path, _state['path'])
+
+
+def _maybe_flush():
+    if METRICS_DIR and time.monotonic() - _state['last_flush'] >= METRICS_FLUSH_INTERVAL:
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _merged():
+    """Sum the values of every process that has written to METRICS_DIR (or just this one)"""
+    if not METRICS_DIR:
+        _collect()
+        snapshots = [_snapshot()]
+    else:
+        flush()
+        snapshots = []
+        for file_name in os.listdir(METRICS_DIR):
+            if not file_name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, file_name), encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_metrics():
+    """Return all metrics, summed across workers, in Prometheus text exposition format"""
+    counters, histograms = _merged()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        series = sorted(counters.items() if kind == 'counter' else histograms.items())
+        series = [(labels, value) for (metric, labels), value in series if metric == name]
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind == 'counter':
+                lines.append(f'{name}{_format_labels(labels)} {value if isinstance(value, int) else round(value, 6)}')
+                continue
+            buckets, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(DEFAULT_BUCKETS + ('+Inf',), buckets):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total:.6f}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def _reset_after_fork():
+    """Start a forked worker with empty values and its own file"""
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+    _state.update(pid=None, last_flush=0.0, path=None)
+
+
+def _flush_at_exit():
+    if METRICS_DIR and _state['pid'] == os.getpid():
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(_flush_at_exit)
@@ -0,0 +1,190 @@
+"""
+Content-addressed cache of parsed uploads.
+
+Uploads are hashed with SHA-256 while they are read. The parsed entries are
+kept under PARSE_CACHE_DIR as columnar datasets, named by the hash and the
+size of the upload. Uploading the same bytes again loads the columns instead
+of parsing.
+
+An upload that starts with the complete contents of a cached file (a log that
+has grown since it was last uploaded) reuses those entries and parses only the
+appended tail. To find such a file, the running hash is copied as the stream
+passes each cached file's size. Only cached files that end in a newline can be
+extended this way; otherwise the last line might have been cut in two.
+
+The total size of the cache is kept under PARSE_CACHE_MAX_BYTES by removing
+the least recently used entries; 0 disables the cache.
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+
+from dataset_store import SharedDataset, write_columns
+from metrics import inc, timed
+
+logger = logging.getLogger(__name__)
+
+PARSE_CACHE_DIR = os.getenv('PARSE_CACHE_DIR', 'parse_cache')
+PARSE_CACHE_MAX_BYTES = int(os.getenv('PARSE_CACHE_MAX_BYTES', 1 << 30))
+
+READ_SIZE = 1 << 20
+_ENTRY_RE = re.compile(r'([0-9a-f]{64})-(\d+)')
+
+
+def _cached():
+    """Return {digest: upload size} for every cache entry"""
+    try:
+        names = os.listdir(PARSE_CACHE_DIR)
+    except FileNotFoundError:
+        return {}
+    matches = (_ENTRY_RE.fullmatch(name) for name in names)
+    return {match.group(1): int(match.group(2)) for match in matches if match}
+
+
+def _entry_path(digest, size):
+    return os.path.join(PARSE_CACHE_DIR, f"{digest}-{size}")
+
+
+def read_and_hash(stream, prefix_sizes=()):
+    """
+    Read a stream to the end, hashing it as it goes.
+
+    Args:
+        stream: Binary file-like object, e.g. an uploaded file's stream
+        prefix_sizes: Byte counts at which to also record the hash of the data so far
+
+    Returns:
+        Tuple of (content bytes, SHA-256 hex digest, {prefix size: hex digest})
+    """
+    hasher = hashlib.sha256()
+    chunks, prefixes, read = [], {}, 0
+    boundaries = sorted(size for size in set(prefix_sizes) if size > 0)
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            break
+        position = 0
+        # Record the hash at every boundary that falls inside this chunk
+        while boundaries and boundaries[0] <= read + len(chunk):
+            cut = boundaries.pop(0) - read
+            hasher.update(chunk[position:cut])
+            position = cut
+            prefixes[read + cut] = hasher.copy().hexdigest()
+        hasher.update(chunk[position:])
+        chunks.append(chunk)
+        read += len(chunk)
+    return b''.join(chunks), hasher.hexdigest(), prefixes
+
+
+def _load(digest, size):
+    """Return a cache entry's entries, or None if it is missing or unreadable"""
+    path = _entry_path(digest, size)
+    if not os.path.isdir(path):
+        return None
+    try:
+        entries = SharedDataset(path).entries
+        os.utime(path)  # Mark as recently used for eviction
+    except (OSError, ValueError, KeyError) as e:
+        # Evicted while being read, or damaged (a truncated column, bad meta.json); parse again
+        logger.warning(f"Dropping unreadable parse cache entry {digest[:12]}: {e}")
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+    return entries
+
+
+def _dir_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def _store(digest, content, entries):
+    path = _entry_path(digest, len(content))
+    if os.path.exists(path):
+        return
+    try:
+        os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+        write_columns(path, entries, digest, endsWithNewline=content.endswith(b'\n'))
+    except OSError as e:
+        # Another worker cached the same upload at the same moment, or the disk is full
+        logger.warning(f"Could not cache parsed upload {digest[:12]}: {e}")
+        return
+    _evict()
+
+
+def _evict():
+    entries = []
+    for digest, size in _cached().items():
+        path = _entry_path(digest, size)
+        try:
+            entries.append((os.stat(path).st_mtime, _dir_size(path), path))
+        except FileNotFoundError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= PARSE_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _ends_with_newline(digest, size):
+    try:
+        return SharedDataset(_entry_path(digest, size)).meta.get('endsWithNewline', False)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def _parse(content, parse):
+    with timed('decode'):
+        lines = [line for line in content.decode('utf-8').split('\n') if line.strip()]
+    with timed('parse'):
+        return parse(lines), len(lines)
+
+
+def parse_upload(stream, parse):
+    """
+    Parse an uploaded log, using the cache when the same bytes, or a prefix of them, were parsed before.
+
+    Args:
+        stream: Binary stream of the upload
+        parse: Function turning a list of lines into entries (parse_nginx_log)
+
+    Returns:
+        Tuple of (entries, info) where info has the upload's digest, its size,
+        how the cache was used ('hit', 'append', 'miss' or 'disabled') and how
+        many lines were parsed
+    """
+    if PARSE_CACHE_MAX_BYTES <= 0:
+        content = stream.read()
+        entries, parsed_lines = _parse(content, parse)
+        return entries, {"cache": "disabled", "bytes": len(content), "parsedLines": parsed_lines}
+
+    cached = _cached()
+    content, digest, prefixes = read_and_hash(stream, cached.values())
+    info = {"digest": digest, "bytes": len(content)}
+
+    if cached.get(digest) == len(content):
+        entries = _load(digest, len(content))
+        if entries is not None:
+            inc('vns_cache_requests_total', cache='parse', result='hit')
+            return entries, {**info, "cache": "hit", "parsedLines": 0}
+
+    # The longest cached file this upload extends
+    for size in sorted(prefixes, reverse=True):
+        base = prefixes[size]
+        if cached.get(base) != size or not _ends_with_newline(base, size):
+            continue
+        base_entries = _load(base, size)
+        if base_entries is None:
+            continue
+        tail_entries, parsed_lines = _parse(content[size:], parse)
+        entries = base_entries + tail_entries
+        _store(digest, content, entries)
+        inc('vns_cache_requests_total', cache='parse', result='append')
+        return entries, {**info, "cache": "append", "parsedLines": parsed_lines, "reusedBytes": size}
+
+    entries, parsed_lines = _parse(content, parse)
+    _store(digest, content, entries)
+    inc('vns_cache_requests_total', cache='parse', result='miss')
+    return entries, {**info, "cache": "miss", "parsedLines": parsed_lines}
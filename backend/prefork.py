@@ -0,0 +1,43 @@
+import gc
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def warm_shared_state():
+    """
+    Build the read-only lookup structures once, before gunicorn forks its workers.
+
+    Workers inherit the geo index, the city mapping table and the user agent
+    tables copy-on-write, so memory stays flat as workers are added. The heavy
+    modules every worker would import on first use are loaded here too. Finally
+    gc.freeze() moves everything into the permanent generation so the garbage
+    collector doesn't touch (and un-share) those pages in the workers.
+    """
+    import pandas  # noqa: F401  (shared module code and data, imported by the first parse anyway)
+    import anomaly_detection  # noqa: F401
+    from geo_data import get_geo_table
+    from geo_engine import GEO_RANGE_BLOCKS, get_city_mapping, get_engine
+    from user_agent_cache import warm_user_agent_tables
+
+    try:
+        geo_table = get_geo_table()
+        logger.info(f"Preloaded geolocation index with {len(geo_table)} IPs")
+    except FileNotFoundError as e:
+        logger.warning(f"Geolocation index not preloaded: {e}")
+
+    try:
+        mapping = get_city_mapping()
+        logger.info(f"Preloaded city mapping with {len(mapping)} rows")
+    except FileNotFoundError as e:
+        logger.warning(f"City mapping not preloaded: {e}")
+
+    if GEO_RANGE_BLOCKS:
+        get_engine()
+        logger.info("Preloaded offline IP-range engine")
+
+    warm_user_agent_tables()
+
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Froze {gc.get_freeze_count()} objects before forking")
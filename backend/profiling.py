@@ -0,0 +1,156 @@
+"""
+On-demand profiling of single requests.
+
+Set PROFILE_TOKEN to enable it, then send a request with the header
+"X-Profile: <token>" (or the query parameter profile=<token>). The handler runs
+under a profiler and the profile is written to PROFILE_DIR. Its ID comes back
+in the X-Profile-Id response header.
+
+PROFILE_MODE picks the profiler:
+- 'sample' (default): a sampling profiler that writes <id>.folded. Each line is
+  one stack and its sample count, which flamegraph.pl, speedscope and inferno
+  read directly.
+- 'cprofile': the deterministic cProfile profiler, written as <id>.prof pstats.
+
+Without PROFILE_TOKEN no hooks are registered, so requests pay nothing.
+"""
+import cProfile
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import g, request
+
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sample')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.002))
+
+
+class StackSampler:
+    """Samples the stack of one thread at a fixed interval from a background thread"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return sum(self.stacks.values())
+
+
+def _requested():
+    supplied = request.headers.get('X-Profile') or request.args.get('profile')
+    return bool(supplied) and hmac.compare_digest(supplied.encode('utf-8'), PROFILE_TOKEN.encode('utf-8'))
+
+
+def _start_profile():
+    if not _requested():
+        return
+    if PROFILE_MODE == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = StackSampler(threading.get_ident())
+        profiler.start()
+    g.profile = (profiler, time.perf_counter())
+
+
+def _detach_profile():
+    """
+    Take the request's profiler off g.
+
+    Returns:
+        None if the request isn't profiled, else (profile ID, finish). Calling
+        finish() stops the profiler and writes the profile out; it needs no
+        request context, so it can run once a streamed body has been sent.
+    """
+    profile = g.pop('profile', None)
+    if profile is None:
+        return None
+    profiler, started = profile
+    profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    method, path = request.method, request.path
+
+    def finish():
+        duration = time.perf_counter() - started
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, profile_id)
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(base + '.prof')
+            meta = {"mode": "cprofile", "file": profile_id + '.prof'}
+        else:
+            profiler.stop()
+            samples = profiler.write(base + '.folded')
+            meta = {"mode": "sample", "file": profile_id + '.folded', "samples": samples,
+                    "intervalSeconds": profiler.interval}
+
+        meta.update({"id": profile_id, "method": method, "path": path, "durationSeconds": round(duration, 6)})
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    return profile_id, finish
+
+
+def init_profiling(app):
+    """Register the profiling hooks on the app when PROFILE_TOKEN is set"""
+    if not PROFILE_TOKEN:
+        return
+
+    @app.before_request
+    def start_request_profile():
+        _start_profile()
+
+    @app.after_request
+    def finish_request_profile(response):
+        detached = _detach_profile()
+        if detached:
+            profile_id, finish = detached
+            method, path = request.method, request.path
+
+            def finish_and_log():
+                finish()
+                app.logger.info(f"Wrote {PROFILE_MODE} profile {profile_id} for {method} {path}")
+
+            response.headers['X-Profile-Id'] = profile_id
+            # A streamed body is only produced after this hook; the profile covers it too
+            response.call_on_close(finish_and_log)
+        return response
+
+    @app.teardown_request
+    def discard_request_profile(exc):
+        # Unhandled errors skip after_request; still stop the profiler
+        detached = _detach_profile()
+        if detached:
+            detached[1]()
+
+    app.logger.info(f"Request profiling enabled ({PROFILE_MODE}), writing to {PROFILE_DIR}")
@@ -0,0 +1,219 @@
+"""
+Streamed, compressed and columnar responses for large sets of log entries.
+
+The format is picked with ?format= or the Accept header:
+- json (default): the usual {..., "entries": [...]} object. It is streamed in
+  batches, so the whole body is never held as one string.
+- ndjson (application/x-ndjson): the first line is the summary, and each
+  following line is one entry.
+- columnar (application/vnd.vns.columnar): a compact binary layout for the
+  dashboard; see encode_columnar.
+
+?summary=1 leaves the entries out. Streamed bodies are compressed with brotli
+or gzip when the client's Accept-Encoding allows. Brotli is only offered when
+the brotli package is installed. orjson is used for serialising when installed.
+"""
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+from flask import Response, request
+
+from dataset_store import encode_entries
+from metrics import inc
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+COLUMNAR_MIMETYPE = 'application/vnd.vns.columnar'
+COLUMNAR_MAGIC = b'VNSC'
+COLUMNAR_VERSION = 1
+
+# Entries serialised per chunk of a streamed body
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 2000))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 5))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 4))
+
+
+def dumps(obj):
+    """Serialise to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def response_format():
+    """Return the format the client asked for: 'json', 'ndjson' or 'columnar'"""
+    requested = request.args.get('format')
+    if requested in ('json', 'ndjson', 'columnar'):
+        return requested
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE, COLUMNAR_MIMETYPE],
+                                               default='application/json')
+    return {NDJSON_MIMETYPE: 'ndjson', COLUMNAR_MIMETYPE: 'columnar'}.get(best, 'json')
+
+
+def summary_only():
+    return request.args.get('summary', '').lower() in ('1', 'true', 'yes')
+
+
+def accepted_encoding():
+    """Return 'br', 'gzip' or None, by the client's Accept-Encoding preferences"""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+
+def _compress(chunks, encoding):
+    """Compress a stream of byte chunks, flushing after the first so it reaches the client early"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, sync, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, sync, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    first = True
+    for chunk in chunks:
+        out = compress(chunk)
+        if first:
+            out += sync()
+            first = False
+        if out:
+            yield out
+    yield finish()
+
+
+def _counted(chunks, endpoint):
+    for chunk in chunks:
+        inc('vns_bytes_out_total', len(chunk), endpoint=endpoint)
+        yield chunk
+
+
+def _json_chunks(summary, entries):
+    yield dumps(summary)[:-1] + b',"entries":['
+    for start in range(0, len(entries), STREAM_BATCH_SIZE):
+        batch = dumps(entries[start:start + STREAM_BATCH_SIZE])[1:-1]
+        yield (b',' + batch) if start else batch
+    yield b']}'
+
+
+def _ndjson_chunks(summary, entries):
+    yield dumps(summary) + b'\n'
+    for start in range(0, len(entries), STREAM_BATCH_SIZE):
+        yield b'\n'.join(dumps(entry) for entry in entries[start:start + STREAM_BATCH_SIZE]) + b'\n'
+
+
+def _epoch_ms(codes, dictionary):
+    """Decode dictionary-encoded ISO timestamps to float64 milliseconds, NaN where missing"""
+    stamps = np.array(dictionary, dtype='datetime64[ms]')
+    values = stamps.astype(np.int64).astype(np.float64)
+    values[np.isnat(stamps)] = np.nan
+    return values[codes] if len(values) else np.zeros(len(codes))
+
+
+def encode_columnar(summary, rows, columns):
+    """
+    Encode entries in the binary columnar format.
+
+    Layout, little-endian:
+        b'VNSC', uint32 version, uint32 header length, header JSON,
+        zero padding to a multiple of 8, then the column data.
+
+    The header is {"rows", "summary", "columns": [{"name", "dtype", "offset",
+    "byteLength", "dictionary"?}]}. Offsets are relative to the start of the
+    column data, and each is a multiple of 8, so every column can be read in
+    place as a typed array. String columns are int32 indexes into their
+    dictionary. statusCode is int32. bytes is float64. dateTime is float64
+    milliseconds since the epoch, reading the naive timestamp as UTC, with NaN
+    where it is missing.
+
+    Args:
+        summary: Dictionary of summary fields to embed in the header
+        rows: Number of entries
+        columns: Columns as returned by dataset_store.encode_entries
+
+    Returns:
+        The encoded bytes
+    """
+    blobs, described, offset = [], [], 0
+    for name, (array, dictionary) in columns.items():
+        if name == 'dateTime':
+            data, dtype, dictionary = np.asarray(_epoch_ms(array, dictionary), dtype='<f8'), 'float64', None
+        elif dictionary is not None:
+            data, dtype = np.asarray(array, dtype='<i4'), 'int32'
+        elif name == 'statusCode':
+            data, dtype = np.asarray(array, dtype='<i4'), 'int32'
+        else:
+            data, dtype = np.asarray(array, dtype='<f8'), 'float64'
+        blob = data.tobytes()
+        column = {"name": name, "dtype": dtype, "offset": offset, "byteLength": len(blob)}
+        if dictionary is not None:
+            column["dictionary"] = dictionary
+        described.append(column)
+        padding = -len(blob) % 8
+        blobs.append(blob + b'\0' * padding)
+        offset += len(blob) + padding
+
+    header = dumps({"rows": rows, "summary": summary, "columns": described})
+    preamble = COLUMNAR_MAGIC + struct.pack('<II', COLUMNAR_VERSION, len(header)) + header
+    return preamble + b'\0' * (-len(preamble) % 8) + b''.join(blobs)
+
+
+def entries_response(summary, entries=None, encoded=None):
+    """
+    Build the response for a set of entries in the format the client asked for.
+
+    Args:
+        summary: Dictionary of summary fields (file name, totals, dataset ID)
+        entries: List of entry dictionaries
+        encoded: The same entries as (rows, columns) from dataset_store, used
+            for the columnar format instead of re-encoding entries. If entries
+            is None, they are only available in this form.
+
+    Returns:
+        A Flask response
+    """
+    if summary_only():
+        return Response(dumps(summary), mimetype='application/json')
+
+    fmt = response_format()
+    if fmt == 'columnar':
+        rows, columns = encoded if encoded is not None else (len(entries), encode_entries(entries))
+        chunks, mimetype = [encode_columnar(summary, rows, columns)], COLUMNAR_MIMETYPE
+    else:
+        if entries is None:
+            entries = _decode_entries(*encoded)
+        if fmt == 'ndjson':
+            chunks, mimetype = _ndjson_chunks(summary, entries), NDJSON_MIMETYPE
+        else:
+            chunks, mimetype = _json_chunks(summary, entries), 'application/json'
+
+    encoding = accepted_encoding()
+    if encoding:
+        chunks = _compress(chunks, encoding)
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    response = Response(_counted(chunks, endpoint), mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+
+def _decode_entries(rows, columns):
+    decoded = {}
+    for name, (array, dictionary) in columns.items():
+        if dictionary is None:
+            decoded[name] = np.asarray(array).tolist()
+        else:
+            values = np.empty(len(dictionary), dtype=object)
+            values[:] = dictionary
+            decoded[name] = values[np.asarray(array)].tolist()
+    return [dict(zip(decoded, row)) for row in zip(*decoded.values())]
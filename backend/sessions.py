@@ -0,0 +1,273 @@
+"""
+Split log entries into visitor sessions.
+
+A visitor is an IP address and user agent pair. A visitor's requests belong to
+one session until they pause for longer than SESSION_GAP_MINUTES. The entries
+are sorted once by visitor and time. A new session starts wherever the visitor
+changes or the time since the previous request is over the gap, and the
+running count of those starts numbers the sessions. Everything after the sort
+is column arithmetic, so millions of entries take seconds.
+
+session_table returns one row per session. The summary is computed from it, and
+anomaly detectors can use it to look at sessions rather than single requests.
+"""
+import os
+import threading
+
+import numpy as np
+from cachetools import TTLCache
+
+from dataset_store import get_dataset_encoded
+from metrics import inc
+
+SESSION_GAP_MINUTES = float(os.getenv('SESSION_GAP_MINUTES', 30))
+# Entry columns sessionisation reads, so stored logs can load just these
+SESSION_COLUMNS = ['dateTime', 'ipAddress', 'userAgent', 'path', 'statusCode']
+
+# Upper bounds of the duration buckets in seconds, and of the depth (requests per session) buckets
+DURATION_EDGES = [0, 10, 60, 300, 900, 1800, 3600]
+DURATION_LABELS = ['0s', '1-10s', '11-60s', '1-5m', '5-15m', '15-30m', '30-60m', '>60m']
+DEPTH_EDGES = [1, 2, 4, 9, 19, 49]
+DEPTH_LABELS = ['1', '2', '3-4', '5-9', '10-19', '20-49', '50+']
+
+_cache_lock = threading.Lock()
+_cache = TTLCache(maxsize=64, ttl=int(os.getenv('SESSION_CACHE_TTL', 300)))
+
+
+def _codes(column):
+    """Return (int64 codes, distinct values) of a column; -1 marks missing values"""
+    import pandas as pd
+
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy().astype(np.int64), column.cat.categories
+    codes, values = pd.factorize(column)
+    return codes.astype(np.int64), values
+
+
+def _times_ms(column):
+    """Return a dateTime column as int64 milliseconds, with NaT where the entry has no time"""
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return np.asarray(column, dtype='datetime64[ms]')
+    # Timestamps repeat, so each distinct string is parsed once
+    codes, values = _codes(column)
+    # Parsed entries hold 'YYYY-MM-DDTHH:MM:SS'; an explicit format works on every supported pandas
+    parsed = np.asarray(pd.to_datetime(values, format='%Y-%m-%dT%H:%M:%S', errors='coerce'), dtype='datetime64[ms]')
+    return np.append(parsed, np.datetime64('NaT', 'ms'))[codes]  # Code -1 (missing) picks the NaT
+
+
+def encoded_frame(columns, names=SESSION_COLUMNS):
+    """
+    Build a DataFrame from columns in the form of encode_entries.
+
+    String columns become categoricals over their dictionaries, so repeated
+    values are neither decoded nor hashed again.
+    """
+    import pandas as pd
+
+    frame = {}
+    for name in names:
+        codes, dictionary = columns[name]
+        codes = np.asarray(codes)
+        if dictionary is None:
+            frame[name] = codes
+            continue
+        values = np.array(dictionary, dtype=object)
+        present = ~pd.isna(values)
+        if not present.all():  # Categories can't be missing, so None (or NaN) becomes code -1
+            remap = np.where(present, np.cumsum(present) - 1, -1)
+            codes, values = remap[codes], values[present]
+        frame[name] = pd.Categorical.from_codes(codes, values)
+    return pd.DataFrame(frame)
+
+
+def _sessionise(df, gap_minutes):
+    """
+    Sort the entries by visitor and time and find where sessions start.
+
+    Returns:
+        Tuple of (row positions in sorted order, visitor codes, times in ms,
+        session start flags); the last three are in sorted order. Entries
+        without a time are left out.
+    """
+    stamps = _times_ms(df['dateTime'])
+    ip_codes = _codes(df['ipAddress'])[0] + 1
+    if 'userAgent' in df.columns:
+        agent_codes = _codes(df['userAgent'])[0] + 1
+    else:
+        agent_codes = np.zeros(len(df), dtype=np.int64)
+    visitors = ip_codes * (int(agent_codes.max(initial=0)) + 1) + agent_codes
+
+    timed_rows = np.flatnonzero(~np.isnat(stamps))
+    times = stamps[timed_rows].astype(np.int64)
+    visitors = visitors[timed_rows]
+    if len(times):
+        # One int64 key of (visitor, time) sorts in a single pass; entries of a visitor
+        # in the same millisecond may come in any order
+        offsets = times - times.min()
+        span = int(offsets.max()) + 1
+        if (int(visitors.max()) + 1) * span < 2 ** 63:
+            sort = np.argsort(visitors * span + offsets)
+        else:
+            sort = np.lexsort((times, visitors))
+        times, visitors = times[sort], visitors[sort]
+        timed_rows = timed_rows[sort]
+
+    starts = np.empty(len(times), dtype=bool)
+    starts[:1] = True
+    starts[1:] = (visitors[1:] != visitors[:-1]) | (np.diff(times) > gap_minutes * 60_000)
+    return timed_rows, visitors, times, starts
+
+
+def assign_sessions(df, gap_minutes=SESSION_GAP_MINUTES):
+    """
+    Number the session each entry belongs to.
+
+    Args:
+        df: DataFrame of log entries with dateTime and ipAddress (and ideally userAgent) columns
+        gap_minutes: Inactivity that ends a session
+
+    Returns:
+        int64 Series aligned with df, numbering sessions from 0; -1 for entries without a time
+    """
+    import pandas as pd
+
+    order, _, _, starts = _sessionise(df, gap_minutes)
+    sessions = np.full(len(df), -1, dtype=np.int64)
+    sessions[order] = np.cumsum(starts) - 1
+    return pd.Series(sessions, index=df.index, name='session')
+
+
+def _pick(column, rows):
+    """Take rows of a column, keeping categoricals categorical"""
+    import pandas as pd
+
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return pd.Categorical.from_codes(column.cat.codes.to_numpy()[rows], column.cat.categories)
+    return column.to_numpy()[rows]
+
+
+def session_table(df, gap_minutes=SESSION_GAP_MINUTES):
+    """
+    Summarise each session in one row.
+
+    Args:
+        df: DataFrame of log entries with dateTime and ipAddress columns; userAgent,
+            path and statusCode are used when present
+        gap_minutes: Inactivity that ends a session
+
+    Returns:
+        DataFrame with visitor, ipAddress, userAgent, start, end, duration (seconds),
+        requests, entryPath, exitPath and errors columns, ordered by visitor and start;
+        empty when no entry has a usable time
+    """
+    import pandas as pd
+
+    order, visitors, times, starts = _sessionise(df, gap_minutes)
+    if not len(times):
+        return pd.DataFrame()  # No entry has a usable time
+    first = np.flatnonzero(starts)
+    last = np.append(first[1:], len(order)) - 1
+    new_visitor = np.ones(len(first), dtype=bool)
+    new_visitor[1:] = visitors[first[1:]] != visitors[first[:-1]]
+
+    table = {
+        'visitor': np.cumsum(new_visitor) - 1,
+        'ipAddress': _pick(df['ipAddress'], order[first]),
+    }
+    if 'userAgent' in df.columns:
+        table['userAgent'] = _pick(df['userAgent'], order[first])
+    table['start'] = times[first].astype('datetime64[ms]')
+    table['end'] = times[last].astype('datetime64[ms]')
+    table['duration'] = (times[last] - times[first]) / 1000.0
+    table['requests'] = last - first + 1
+    if 'path' in df.columns:
+        table['entryPath'] = _pick(df['path'], order[first])
+        table['exitPath'] = _pick(df['path'], order[last])
+    if 'statusCode' in df.columns:
+        errors = (np.asarray(df['statusCode'], dtype=np.int64)[order] >= 400).astype(np.int64)
+        table['errors'] = np.add.reduceat(errors, first) if len(first) else errors
+    return pd.DataFrame(table)
+
+
+def _distribution(values, edges, labels):
+    counts = np.bincount(np.searchsorted(edges, values, side='left'), minlength=len(labels))
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(p50), 2),
+        "p90": round(float(p90), 2),
+        "p99": round(float(p99), 2),
+        "max": float(values.max()),
+        "buckets": [{"label": label, "sessions": int(count)} for label, count in zip(labels, counts)],
+    }
+
+
+def _top_paths(paths, top):
+    counts = paths.value_counts()
+    counts = counts[counts > 0]  # Categoricals count every category, even unused ones
+    # Ties are ordered by path, so the result doesn't depend on the column's dtype
+    ranked = sorted(counts.nlargest(top, keep='all').items(), key=lambda item: (-item[1], item[0]))[:top]
+    return [{"path": path, "sessions": int(count)} for path, count in ranked]
+
+
+def summarize_sessions(df, gap_minutes=SESSION_GAP_MINUTES, top=10):
+    """
+    Sessionise log entries and describe the sessions.
+
+    Args:
+        df: DataFrame of log entries
+        gap_minutes: Inactivity that ends a session
+        top: Number of entry and exit paths to list
+
+    Returns:
+        Dictionary with session and visitor counts, the bounce rate (share of
+        single-request sessions), duration and depth distributions and the most
+        common entry and exit paths
+    """
+    summary = {"gapMinutes": gap_minutes, "sessions": 0, "visitors": 0, "uniqueIps": 0, "bounceRate": 0.0,
+               "duration": None, "depth": None, "entryPaths": [], "exitPaths": []}
+    if df.empty or 'dateTime' not in df.columns or 'ipAddress' not in df.columns:
+        return summary
+
+    table = session_table(df, gap_minutes)
+    if table.empty:
+        return summary
+    depth = table['requests'].to_numpy()
+    summary.update({
+        "sessions": len(table),
+        "visitors": int(table['visitor'].iloc[-1]) + 1,  # Visitor codes are numbered in table order
+        "uniqueIps": int(table['ipAddress'].nunique()),
+        "bounceRate": round(float((depth == 1).mean()), 4),
+        "duration": _distribution(table['duration'].to_numpy(), DURATION_EDGES, DURATION_LABELS),
+        "depth": _distribution(depth, DEPTH_EDGES, DEPTH_LABELS),
+    })
+    if 'entryPath' in table.columns:
+        summary["entryPaths"] = _top_paths(table['entryPath'], top)
+        summary["exitPaths"] = _top_paths(table['exitPath'], top)
+    return summary
+
+
+def get_dataset_sessions(dataset_id, gap_minutes=SESSION_GAP_MINUTES):
+    """
+    Return the session summary of a stored dataset, cached per dataset and gap.
+
+    Returns:
+        The summary dictionary, or None if the dataset is unknown
+    """
+    key = (dataset_id, gap_minutes)
+    with _cache_lock:
+        result = _cache.get(key)
+    inc('vns_cache_requests_total', cache='sessions', result='miss' if result is None else 'hit')
+    if result is not None:
+        return result
+
+    dataset = get_dataset_encoded(dataset_id)
+    if dataset is None:
+        return None
+
+    result = summarize_sessions(encoded_frame(dataset[2]), gap_minutes)
+    with _cache_lock:
+        _cache[key] = result
+    return result
@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+# The backend modules import each other by their flat names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Nothing under test may touch the committed geolocation cache
+os.environ.setdefault('GEO_CACHE_DB', os.path.join(tempfile.mkdtemp(prefix='vns-test-'), 'geolocation_cache.db'))
+
+GEO_CACHE_SCHEMA = """
+CREATE TABLE geo_cache (
+    ip_address TEXT PRIMARY KEY,
+    latitude REAL,
+    longitude REAL,
+    city TEXT,
+    country TEXT,
+    status TEXT,
+    last_api_call INTEGER,
+    last_successful_lookup INTEGER,
+    retries INTEGER DEFAULT 0
+)
+"""
+
+
+@pytest.fixture
+def geo_db(tmp_path):
+    """Path of an empty geolocation cache database"""
+    path = str(tmp_path / 'geolocation_cache.db')
+    conn = sqlite3.connect(path)
+    conn.execute(GEO_CACHE_SCHEMA)
+    conn.commit()
+    conn.close()
+    return path
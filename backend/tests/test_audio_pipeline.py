@@ -0,0 +1,56 @@
+import io
+import wave
+
+import numpy as np
+import pytest
+
+import audio_pipeline
+from audio_pipeline import decode_audio
+
+SAMPLES = np.array([0, 1, -2, 1000, -32768, 32767], dtype='<i2')
+
+
+def wav_bytes(frames, sample_width, channels=1, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(rate)
+        wav.writeframes(frames)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def transcoded(monkeypatch):
+    """Record the uploads sent to ffmpeg instead of running it"""
+    calls = []
+    monkeypatch.setattr(audio_pipeline, 'transcode_to_pcm', lambda data: calls.append(data) or b'\0\0')
+    return calls
+
+
+def test_l16_is_byte_swapped():
+    pcm, rate, width, ran = decode_audio(SAMPLES.astype('>i2').tobytes() + b'\x01', 'audio/L16; rate=8000')
+    assert np.frombuffer(pcm, '<i2').tolist() == SAMPLES.tolist()
+    assert (rate, width, ran) == (8000, 2, False)
+
+
+def test_pcm_is_little_endian():
+    pcm, rate, _, ran = decode_audio(SAMPLES.tobytes(), 'audio/pcm')
+    assert pcm == SAMPLES.tobytes() and rate == 16000 and not ran
+
+
+def test_16_bit_wav_is_passed_through(transcoded):
+    pcm, rate, width, ran = decode_audio(wav_bytes(SAMPLES.tobytes(), 2, rate=22050))
+    assert (pcm, rate, width, ran) == (SAMPLES.tobytes(), 22050, 2, False)
+    assert not transcoded
+
+
+@pytest.mark.parametrize('upload', [wav_bytes(b'\x80\x81\x7f', 1), wav_bytes(SAMPLES.tobytes(), 2, channels=2),
+                                    wav_bytes(b'\0' * 12, 4)])
+def test_other_wav_goes_through_ffmpeg(upload, transcoded):
+    assert decode_audio(upload, 'audio/wav') == (b'\0\0', 16000, 2, True)
+    assert transcoded == [upload]
+
+
+def test_stereo_pcm_goes_through_ffmpeg(transcoded):
+    assert decode_audio(b'\0' * 8, 'audio/L16;rate=16000;channels=2')[3]
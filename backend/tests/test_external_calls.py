@@ -0,0 +1,47 @@
+import pytest
+
+from external_calls import BREAKER_FAILURES, CircuitOpenError, call_external, get_breaker
+
+
+class UnintelligibleAudio(Exception):
+    """Stands in for speech_recognition.UnknownValueError"""
+
+
+def failing(error):
+    raise error
+
+
+def test_input_errors_do_not_open_the_breaker():
+    for i in range(BREAKER_FAILURES * 2):
+        with pytest.raises(UnintelligibleAudio):
+            call_external('test-input', f'clip-{i}', failing, UnintelligibleAudio(), timeout=5)
+    assert get_breaker('test-input').state == 'closed'
+
+
+def test_upstream_errors_open_the_breaker():
+    for i in range(BREAKER_FAILURES):
+        with pytest.raises(ConnectionError):
+            call_external('test-upstream', f'clip-{i}', failing, ConnectionError(), timeout=5)
+    assert get_breaker('test-upstream').state == 'open'
+    with pytest.raises(CircuitOpenError):
+        call_external('test-upstream', 'clip', failing, ConnectionError(), timeout=5)
+
+
+def test_upstream_errors_can_be_extended():
+    for i in range(BREAKER_FAILURES):
+        with pytest.raises(UnintelligibleAudio):
+            call_external('test-extended', f'clip-{i}', failing, UnintelligibleAudio(), timeout=5,
+                          upstream_errors=(OSError, UnintelligibleAudio))
+    assert get_breaker('test-extended').state == 'open'
+
+
+def test_input_error_ends_a_half_open_trial():
+    breaker = get_breaker('test-trial')
+    breaker.reset_after = 0
+    for i in range(BREAKER_FAILURES):
+        with pytest.raises(ConnectionResetError):
+            call_external('test-trial', f'clip-{i}', failing, ConnectionResetError(), timeout=5)
+    assert breaker.state == 'half-open'
+    with pytest.raises(UnintelligibleAudio):
+        call_external('test-trial', 'trial', failing, UnintelligibleAudio(), timeout=5)
+    assert breaker.state == 'closed'
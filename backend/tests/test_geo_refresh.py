@@ -0,0 +1,124 @@
+import sqlite3
+
+import geo_refresh
+from geo_refresh import (GEO_MAX_RETRIES, GEO_RETRY_DELAY, GEO_STALE_AFTER, ResolverError, refresh_ips,
+                         select_refresh_candidates, write_results)
+
+NOW = 1_750_000_000
+LOCATION = {'lat': 53.3, 'lng': -6.3, 'city': 'Dublin', 'country': 'Ireland'}
+
+
+def insert(db_path, ip, status, last_api_call=0, last_successful_lookup=None, retries=0):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("INSERT INTO geo_cache (ip_address, status, last_api_call, last_successful_lookup, retries) "
+                     "VALUES (?, ?, ?, ?, ?)", (ip, status, last_api_call, last_successful_lookup, retries))
+    conn.close()
+
+
+def rows(db_path):
+    conn = sqlite3.connect(db_path)
+    result = {row[0]: row[1:] for row in conn.execute(
+        "SELECT ip_address, status, latitude, city, last_api_call, last_successful_lookup, retries FROM geo_cache")}
+    conn.close()
+    return result
+
+
+class FakeResolver:
+    """Answers from a fixed table and records every batch it is asked for"""
+
+    def __init__(self, answers, failures=0):
+        self.answers = answers
+        self.failures = failures
+        self.batches = []
+
+    def resolve(self, ips):
+        self.batches.append(list(ips))
+        if self.failures:
+            self.failures -= 1
+            raise ResolverError('rate limited')
+        return {ip: self.answers.get(ip) for ip in ips}
+
+
+def test_candidates_unknown_and_stale(geo_db):
+    insert(geo_db, '1.1.1.1', 'success', NOW - 10, NOW - 10)
+    insert(geo_db, '2.2.2.2', 'success', NOW - GEO_STALE_AFTER, NOW - GEO_STALE_AFTER)
+
+    candidates = select_refresh_candidates(['1.1.1.1', '2.2.2.2', '3.3.3.3', '3.3.3.3', None, ''], geo_db, NOW)
+
+    assert candidates == {'2.2.2.2': 0, '3.3.3.3': 0}
+
+
+def test_candidates_retry_backoff(geo_db):
+    # Retries wait GEO_RETRY_DELAY * 2 ** retries seconds after the last call
+    insert(geo_db, '1.1.1.1', 'failed_api', NOW - GEO_RETRY_DELAY * 4, retries=2)
+    insert(geo_db, '2.2.2.2', 'failed_api', NOW - GEO_RETRY_DELAY * 4 + 1, retries=2)
+    insert(geo_db, '3.3.3.3', 'failed_timeout', 0, retries=GEO_MAX_RETRIES)
+    insert(geo_db, '4.4.4.4', 'private', 0)
+
+    candidates = select_refresh_candidates(['1.1.1.1', '2.2.2.2', '3.3.3.3', '4.4.4.4'], geo_db, NOW)
+
+    assert candidates == {'1.1.1.1': 2}
+
+
+def test_write_results_upserts(geo_db):
+    insert(geo_db, '1.1.1.1', 'failed_api', NOW - 100, retries=3)
+    insert(geo_db, '2.2.2.2', 'failed_api', NOW - 100, retries=1)
+
+    counts = write_results({
+        '1.1.1.1': LOCATION,
+        '2.2.2.2': None,
+        '3.3.3.3': 'timed out',
+        '4.4.4.4': {'status': 'private'},
+    }, {'1.1.1.1': 3, '2.2.2.2': 1}, geo_db, NOW)
+
+    assert counts == (1, 3)
+    assert rows(geo_db) == {
+        '1.1.1.1': ('success', 53.3, 'Dublin', NOW, NOW, 0),
+        '2.2.2.2': ('failed_api', None, None, NOW, None, 2),
+        '3.3.3.3': ('failed_timeout', None, None, NOW, None, 1),
+        '4.4.4.4': ('private', None, None, NOW, None, 0),
+    }
+
+
+def test_write_results_enables_wal(geo_db):
+    write_results({'1.1.1.1': LOCATION}, {}, geo_db, NOW)
+
+    conn = sqlite3.connect(geo_db)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.close()
+
+
+def test_refresh_resolves_only_candidates(geo_db, monkeypatch):
+    monkeypatch.setattr(geo_refresh.time, 'time', lambda: NOW)
+    insert(geo_db, '1.1.1.1', 'success', NOW, NOW)
+    resolver = FakeResolver({'2.2.2.2': LOCATION, '4.4.4.4': {'status': 'private'}})
+
+    result = refresh_ips(['1.1.1.1', '2.2.2.2', '3.3.3.3', '4.4.4.4'], resolver, geo_db,
+                         batch_size=2, concurrency=1, batches_per_minute=0)
+
+    assert result == {"candidates": 3, "resolved": 1, "failed": 2}
+    assert sorted(ip for batch in resolver.batches for ip in batch) == ['2.2.2.2', '3.3.3.3', '4.4.4.4']
+    assert all(len(batch) <= 2 for batch in resolver.batches)
+    assert {ip: row[0] for ip, row in rows(geo_db).items()} == {
+        '1.1.1.1': 'success', '2.2.2.2': 'success', '3.3.3.3': 'failed_api', '4.4.4.4': 'private'}
+
+
+def test_refresh_retries_transient_errors(geo_db, monkeypatch):
+    monkeypatch.setattr(geo_refresh.time, 'sleep', lambda seconds: None)
+    resolver = FakeResolver({'2.2.2.2': LOCATION}, failures=2)
+
+    result = refresh_ips(['2.2.2.2'], resolver, geo_db, concurrency=1, batches_per_minute=0, base_delay=0)
+
+    assert result["resolved"] == 1
+    assert len(resolver.batches) == 3
+
+
+def test_refresh_gives_up_after_max_attempts(geo_db, monkeypatch):
+    monkeypatch.setattr(geo_refresh.time, 'sleep', lambda seconds: None)
+    resolver = FakeResolver({}, failures=geo_refresh.MAX_ATTEMPTS)
+
+    result = refresh_ips(['2.2.2.2'], resolver, geo_db, concurrency=1, batches_per_minute=0, base_delay=0)
+
+    assert result == {"candidates": 1, "resolved": 0, "failed": 1}
+    assert rows(geo_db)['2.2.2.2'][0] == 'failed_timeout'
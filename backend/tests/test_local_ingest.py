@@ -0,0 +1,24 @@
+import pytest
+
+import local_ingest
+from local_ingest import _count_lines, ingest_file
+
+LINE = '10.0.0.1 - - [17/Apr/2025:05:10:56 +0100] "GET / HTTP/1.1" 200 10 "-" "test"'
+
+
+@pytest.mark.parametrize('text', [
+    '', '\n\n', ' \n\t\n\r\n', f'{LINE}\n \n{LINE}', f'\n{LINE}\n \n　\n', 'junk\n  x\n\xe9\n',
+    f'{LINE}\r\n\x0b\x0c\n\x1c\n',
+])
+def test_count_lines_matches_upload(text):
+    data = text.encode('utf-8')
+    assert _count_lines(data, 0, len(data)) == len([line for line in text.split('\n') if line.strip()])
+
+
+def test_ingest_skips_whitespace_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_ingest, 'INGEST_ALLOWED_DIRS', [str(tmp_path)])
+    path = tmp_path / 'access.log'
+    path.write_text(f'{LINE}\n   \n\t\nnot a log line\n{LINE}\n')
+    entries, stats = ingest_file(str(path))
+    assert len(entries) == 2
+    assert (stats['lines'], stats['parsed'], stats['skipped']) == (3, 2, 1)
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+
+import log_tail
+from log_tail import LiveTail, read_live_entries
+
+
+@pytest.fixture
+def live(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_tail, 'TAIL_LIVE_DIR', str(tmp_path / 'live'))
+    monkeypatch.setattr(log_tail, 'TAIL_CHECKPOINT_FILE', str(tmp_path / 'checkpoints.json'))
+    monkeypatch.setattr(log_tail, 'TAIL_BATCH_INTERVAL', 0.01)
+    monkeypatch.setattr(log_tail, 'TAIL_POLL_INTERVAL', 0.01)
+    return tmp_path
+
+
+def parse(lines):
+    return [{'ipAddress': line, 'dateTime': None, 'method': 'GET', 'path': '/', 'statusCode': 200, 'bytes': 1,
+             'referer': None, 'userAgent': 'test'} for line in lines]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_failed_batch_is_retried(live):
+    log = live / 'access.log'
+    log.write_text('')
+    calls = []
+
+    def flaky(lines):
+        calls.append(list(lines))
+        if len(calls) == 1:
+            raise OSError('disk full')
+        return parse(lines)
+
+    tail = LiveTail(flaky, [str(log)])
+    thread = threading.Thread(target=tail.run)
+    thread.start()
+    try:
+        with open(log, 'a') as f:
+            f.write('a\nb\n')
+        wait_for(lambda: read_live_entries()[0])
+        with open(log, 'a') as f:
+            f.write('c\n')
+        wait_for(lambda: len(read_live_entries()[0]) == 3)
+    finally:
+        tail.stop()
+        thread.join()
+
+    assert [entry['ipAddress'] for entry in read_live_entries()[0]] == ['a', 'b', 'c']
+    assert calls[0] == calls[1] == ['a', 'b']
@@ -0,0 +1,59 @@
+import io
+import os
+
+import pytest
+
+import dataset_store
+import parse_cache
+from parse_cache import parse_upload
+
+LOG = b''.join(b'10.0.0.%d - - [17/Apr/2025:05:10:%02d +0100] "GET /p%d HTTP/1.1" 200 %d "-" "test"\n'
+               % (i, i, i, 100 + i) for i in range(20))
+
+
+def parse(lines):
+    return [{'ipAddress': line.split(' ')[0], 'dateTime': None, 'method': 'GET', 'path': '/', 'statusCode': 200,
+             'bytes': len(line), 'referer': None, 'userAgent': 'test'} for line in lines]
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(parse_cache, 'PARSE_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_hit_and_append(cache_dir):
+    entries, info = parse_upload(io.BytesIO(LOG), parse)
+    assert info['cache'] == 'miss'
+    assert parse_upload(io.BytesIO(LOG), parse) == (entries, {**info, 'cache': 'hit', 'parsedLines': 0})
+
+    extra = b'10.0.0.99 - - [17/Apr/2025:05:11:00 +0100] "GET / HTTP/1.1" 200 1 "-" "test"\n'
+    grown, info = parse_upload(io.BytesIO(LOG + extra), parse)
+    assert info['cache'] == 'append' and info['parsedLines'] == 1
+    assert grown[:-1] == entries
+    assert not [name for name in os.listdir(cache_dir) if name.endswith('.tmp')]
+
+
+@pytest.mark.parametrize('damage', ['meta.json', 'ipAddress.npy'])
+def test_damaged_entry_is_a_miss(cache_dir, damage):
+    entries, info = parse_upload(io.BytesIO(LOG), parse)
+    path = parse_cache._entry_path(info['digest'], info['bytes'])
+    with open(os.path.join(path, damage), 'wb') as f:
+        f.write(b'{"trunc')
+
+    again, info = parse_upload(io.BytesIO(LOG), parse)
+    assert info['cache'] == 'miss' and again == entries
+    # The damaged entry was replaced by a fresh one
+    assert parse_upload(io.BytesIO(LOG), parse)[1]['cache'] == 'hit'
+
+
+def test_write_columns_uses_its_own_temp_dir(tmp_path):
+    path = str(tmp_path / 'columns')
+    os.makedirs(path + '.tmp')  # Left behind by an older writer
+    dataset_store.write_columns(path, parse(['10.0.0.1 a']), 'x')
+    assert dataset_store.SharedDataset(path).rows == 1
+
+    # A writer that loses the race to an existing directory cleans up after itself
+    with pytest.raises(OSError):
+        dataset_store.write_columns(path, parse(['10.0.0.2 b']), 'y')
+    assert sorted(os.listdir(tmp_path)) == ['columns', 'columns.tmp']
@@ -0,0 +1,54 @@
+import json
+import time
+
+import pytest
+from flask import Flask, Response
+
+import profiling
+
+
+@pytest.fixture(params=['sample', 'cprofile'])
+def client(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', 'secret')
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'PROFILE_MODE', request.param)
+    app = Flask(__name__)
+    profiling.init_profiling(app)
+
+    @app.route('/stream')
+    def stream():
+        def body():
+            for _ in range(5):
+                time.sleep(0.02)
+                yield 'x'
+        return Response(body())
+
+    @app.route('/plain')
+    def plain():
+        return 'ok'
+
+    return app.test_client()
+
+
+def read_meta(profile_dir, profile_id):
+    with open(profile_dir / f'{profile_id}.json', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_streamed_body_is_profiled(client, tmp_path):
+    response = client.get('/stream', headers={'X-Profile': 'secret'}, buffered=False)
+    profile_id = response.headers['X-Profile-Id']
+    assert not (tmp_path / f'{profile_id}.json').exists()  # Still profiling until the body is sent
+
+    assert response.get_data(as_text=True) == 'xxxxx'
+    response.close()
+    meta = read_meta(tmp_path, profile_id)
+    assert meta['path'] == '/stream' and meta['durationSeconds'] >= 0.1
+    assert (tmp_path / meta['file']).exists()
+
+
+def test_plain_response_and_unprofiled_request(client, tmp_path):
+    response = client.get('/plain?profile=secret')
+    response.close()  # WSGI servers close every response; the profile is written then
+    assert read_meta(tmp_path, response.headers['X-Profile-Id'])['method'] == 'GET'
+    assert 'X-Profile-Id' not in client.get('/plain', headers={'X-Profile': 'wrong'}).headers
@@ -0,0 +1,87 @@
+import pandas as pd
+import pytest
+
+import dataset_store
+from sessions import assign_sessions, get_dataset_sessions, session_table, summarize_sessions
+
+AGENT = 'Mozilla/5.0'
+BOT = 'Googlebot/2.1'
+
+
+def frame(rows):
+    """DataFrame of entries from (ip, agent, time, path, status) tuples"""
+    return pd.DataFrame([{'ipAddress': ip, 'userAgent': agent, 'dateTime': stamp, 'path': path, 'statusCode': status,
+                          'method': 'GET', 'bytes': 100, 'referer': None}
+                         for ip, agent, stamp, path, status in rows])
+
+
+ROWS = [
+    ('10.0.0.1', AGENT, '2025-04-17T05:00:00', '/', 200),
+    ('10.0.0.1', AGENT, '2025-04-17T05:10:00', '/a', 200),
+    ('10.0.0.1', AGENT, '2025-04-17T05:50:00', '/b', 404),  # 40 minutes later: a new session
+    ('10.0.0.1', BOT, '2025-04-17T05:05:00', '/robots.txt', 200),  # Same IP, other agent: another visitor
+    ('10.0.0.2', AGENT, '2025-04-17T05:01:00', '/', 500),
+    ('10.0.0.2', AGENT, None, '/', 200),
+]
+
+
+def test_assign_sessions_splits_on_gap_and_visitor():
+    sessions = assign_sessions(frame(ROWS)).tolist()
+    assert sessions[0] == sessions[1]
+    assert len({sessions[1], sessions[2], sessions[3], sessions[4]}) == 4
+    assert sessions[5] == -1  # No time, no session
+
+
+def test_gap_is_configurable():
+    sessions = assign_sessions(frame(ROWS), gap_minutes=60).tolist()
+    assert sessions[0] == sessions[1] == sessions[2]
+
+
+def test_session_table():
+    table = session_table(frame(ROWS))
+    assert len(table) == 4
+    first = table[(table['ipAddress'] == '10.0.0.1') & (table['userAgent'] == AGENT)].sort_values('start')
+    assert first['duration'].tolist() == [600.0, 0.0]
+    assert first['requests'].tolist() == [2, 1]
+    assert first['entryPath'].tolist() == ['/', '/b']
+    assert first['exitPath'].tolist() == ['/a', '/b']
+    assert first['errors'].tolist() == [0, 1]
+
+
+def test_summarize_sessions():
+    summary = summarize_sessions(frame(ROWS))
+    assert summary['sessions'] == 4
+    assert summary['visitors'] == 3
+    assert summary['uniqueIps'] == 2
+    assert summary['bounceRate'] == 0.75
+    assert summary['depth']['max'] == 2
+    assert summary['entryPaths'][0] == {'path': '/', 'sessions': 2}
+    assert [item['path'] for item in summary['exitPaths']] == ['/', '/a', '/b', '/robots.txt']  # Ties by path
+
+
+def test_summarize_accepts_datetime_column():
+    df = frame(ROWS[:5])
+    df['dateTime'] = pd.to_datetime(df['dateTime'])
+    assert summarize_sessions(df)['sessions'] == 4
+
+
+@pytest.mark.parametrize('stamps', [[None, None], ['not a date', '17/Apr/2025']])
+def test_no_usable_times_gives_empty_summary(stamps):
+    df = frame([('10.0.0.1', AGENT, stamp, '/', 200) for stamp in stamps])
+    summary = summarize_sessions(df)
+    assert summary['sessions'] == 0 and summary['duration'] is None
+    assert session_table(df).empty
+
+
+def test_empty_frame():
+    assert summarize_sessions(pd.DataFrame())['sessions'] == 0
+
+
+@pytest.mark.parametrize('store_dir', ['', 'shared'])
+def test_dataset_sessions_match_frame(monkeypatch, tmp_path, store_dir):
+    monkeypatch.setattr(dataset_store, 'DATASET_STORE_DIR', str(tmp_path / store_dir) if store_dir else '')
+    entries = [{'ipAddress': ip, 'userAgent': agent, 'dateTime': stamp, 'path': path, 'statusCode': status,
+                'method': 'GET', 'bytes': 100, 'referer': None} for ip, agent, stamp, path, status in ROWS]
+    dataset_id = dataset_store.put_dataset(entries, 'test.log')
+    assert get_dataset_sessions(dataset_id) == summarize_sessions(frame(ROWS))
+    assert get_dataset_sessions('unknown') is None
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+import timeseries
+from dataset_store import encode_entries
+from timeseries import build_series, check_options, lttb, min_max, minute_buckets
+
+
+def reference_lttb(y, budget):
+    """Straightforward largest-triangle-three-buckets over x = 0..n-1"""
+    n = len(y)
+    every = (n - 2) / (budget - 2)
+    picked, a = [0], 0
+    for i in range(budget - 2):
+        start, stop = int(i * every) + 1, int((i + 1) * every) + 1
+        next_start, next_stop = stop, min(int((i + 2) * every) + 1, n)
+        if i == budget - 3:
+            next_start, next_stop = n - 1, n
+        mean_x = sum(range(next_start, next_stop)) / (next_stop - next_start)
+        mean_y = sum(y[next_start:next_stop]) / (next_stop - next_start)
+        best, best_area = start, -1.0
+        for j in range(start, stop):
+            area = abs((a - mean_x) * (y[j] - y[a]) - (a - j) * (mean_y - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        picked.append(best)
+        a = best
+    return picked + [n - 1]
+
+
+@pytest.mark.parametrize('n, budget', [(10, 3), (100, 10), (1000, 37), (5000, 500)])
+def test_lttb_matches_reference(n, budget):
+    y = np.random.default_rng(n).poisson(20, n).astype(float)
+    assert lttb(y, budget).tolist() == reference_lttb(y.tolist(), budget)
+
+
+def test_lttb_keeps_ends_and_spike():
+    y = np.zeros(10_000)
+    y[4321] = 100
+    picked = lttb(y, 50)
+    assert len(picked) == 50
+    assert picked[0] == 0 and picked[-1] == len(y) - 1
+    assert 4321 in picked
+    assert (np.diff(picked) > 0).all()
+
+
+def test_lttb_short_series_is_unchanged():
+    assert lttb(np.arange(5), 10).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_min_max_keeps_extremes_of_each_pixel():
+    y = np.random.default_rng(1).normal(size=1000)
+    picked = min_max(y, 20)
+    assert len(picked) <= 20
+    for pixel in range(10):
+        window = np.arange(pixel * 100, (pixel + 1) * 100)
+        assert window[y[window].argmax()] in picked
+        assert window[y[window].argmin()] in picked
+
+
+def entries(times_and_statuses):
+    return [{'ipAddress': '10.0.0.1', 'dateTime': stamp, 'method': 'GET', 'path': '/', 'statusCode': status,
+             'bytes': 100, 'referer': None, 'userAgent': 'test'} for stamp, status in times_and_statuses]
+
+
+def test_minute_buckets_sum_per_minute():
+    columns = encode_entries(entries([
+        ('2025-04-17T05:00:01', 200), ('2025-04-17T05:00:59', 404), ('2025-04-17T05:03:00', 500),
+        ('2025-04-17T05:00:30', 200), (None, 200),
+    ]))
+    minutes, requests, errors, sent = minute_buckets(columns)
+    assert minutes.astype('datetime64[m]').astype(str).tolist() == ['2025-04-17T05:00', '2025-04-17T05:03']
+    assert requests.tolist() == [3, 1]
+    assert errors.tolist() == [1, 1]
+    assert sent.tolist() == [300, 100]
+
+
+def test_build_series_fills_gaps_and_rebuckets():
+    buckets = minute_buckets(encode_entries(entries([
+        ('2025-04-17T05:00:01', 200), ('2025-04-17T05:03:00', 500), ('2025-04-17T06:10:00', 200),
+    ])))
+    series = build_series(buckets)
+    assert series['buckets'] == 71 and series['method'] is None
+    assert sum(series['series']['requests']) == 3
+    assert series['series']['time'][:2] == ['2025-04-17T05:00:00', '2025-04-17T05:01:00']
+
+    hourly = build_series(buckets, interval='1h')
+    assert hourly['series'] == {'time': ['2025-04-17T05:00:00', '2025-04-17T06:00:00'],
+                                'requests': [2, 1], 'errors': [1, 0], 'bytes': [200, 100]}
+
+
+def test_build_series_stays_within_budget():
+    rng = np.random.default_rng(0)
+    minutes = np.arange(29_000_000, 29_100_000)
+    counts = rng.poisson(5, len(minutes))
+    buckets = (minutes, counts, counts // 5, counts * 100)
+
+    series = build_series(buckets, points=300, method='lttb')
+    assert series['buckets'] == len(minutes)
+    assert series['points'] == len(series['series']['time']) <= 300
+    assert series['totals'] == {'requests': int(counts.sum()), 'errors': int((counts // 5).sum()),
+                                'bytes': int(counts.sum() * 100)}
+    assert max(series['series']['requests']) == counts.max()  # The biggest spike survives
+
+    assert build_series(buckets, points=300, method='minmax')['points'] <= 300
+
+
+def test_build_series_coarsens_interval(monkeypatch):
+    monkeypatch.setattr(timeseries, 'TIMESERIES_MAX_BUCKETS', 1000)
+    minutes = np.array([0, 5000])
+    ones = np.ones(2, dtype=np.int64)
+    series = build_series((minutes, ones, ones, ones), interval='1m')
+    assert series['interval'] == '15m'
+    assert series['totals']['requests'] == 2
+
+
+def test_build_series_window_and_empty():
+    minutes = np.arange(100, 200)
+    ones = np.ones(100, dtype=np.int64)
+    assert build_series((minutes, ones, ones, ones), start=150, end=160)['totals']['requests'] == 10
+    assert build_series((minutes, ones, ones, ones), start=500)['buckets'] == 0
+    empty = tuple(np.array([], dtype=np.int64) for _ in range(4))
+    assert build_series(empty)['series']['time'] == []
+
+
+@pytest.mark.parametrize('interval, points, method', [('2m', 100, 'lttb'), ('1m', 5, 'lttb'),
+                                                      ('1m', 10 ** 6, 'lttb'), ('1m', 100, 'mean')])
+def test_check_options_rejects(interval, points, method):
+    with pytest.raises(ValueError):
+        check_options(interval, points, method)
@@ -0,0 +1,261 @@
+"""
+Request, error and byte counts over time, downsampled to a point budget.
+
+Each dataset, and each log store part, is reduced once to per-minute buckets.
+The sums are taken per distinct timestamp code, so this is a bincount over
+the rows, and only the distinct timestamps are parsed. The buckets are cached.
+Parts never change once written, so a store part is cached by its path.
+
+A query re-buckets the minutes to the requested interval over its window. If
+that gives more buckets than the point budget, each series is downsampled on
+its own, with LTTB (largest triangle three buckets) or the min and max per
+pixel, to points // 3 points. The chart gets the union of the picked buckets,
+so the three series share one time axis and the payload never exceeds the
+budget, whatever the data volume.
+"""
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+from cachetools import TTLCache
+
+from dataset_store import get_dataset_encoded
+from log_store import map_parts
+from metrics import inc
+
+TIMESERIES_POINTS = int(os.getenv('TIMESERIES_POINTS', 1000))
+TIMESERIES_MAX_POINTS = int(os.getenv('TIMESERIES_MAX_POINTS', 10000))
+# Above this many buckets in a window, the next coarser interval is used before downsampling
+TIMESERIES_MAX_BUCKETS = int(os.getenv('TIMESERIES_MAX_BUCKETS', 1_000_000))
+
+# Interval name to length in minutes, finest first
+INTERVALS = {'1m': 1, '5m': 5, '15m': 15, '1h': 60, '6h': 360, '1d': 1440}
+METHODS = ('lttb', 'minmax')
+SERIES = ('requests', 'errors', 'bytes')
+
+_cache_lock = threading.Lock()
+_cache = TTLCache(maxsize=4096, ttl=int(os.getenv('TIMESERIES_CACHE_TTL', 300)))
+
+
+def minute_buckets(columns):
+    """
+    Sum requests, errors (status 400 and up) and bytes per minute.
+
+    Args:
+        columns: Columns in the form of encode_entries; dateTime, statusCode and bytes are read
+
+    Returns:
+        Tuple of int64 arrays (minutes since the epoch, requests, errors, bytes),
+        sorted by minute. Entries without a time are left out.
+    """
+    import pandas as pd
+
+    codes, dictionary = columns['dateTime']
+    codes = np.asarray(codes)
+    status = np.asarray(columns['statusCode'][0])
+    sent = np.asarray(columns['bytes'][0])
+
+    # Rows sharing a timestamp share a code, so the sums are first taken per code
+    size = len(dictionary)
+    per_code = [np.bincount(codes, minlength=size),
+                np.bincount(codes, weights=(status >= 400).astype(np.float64), minlength=size),
+                np.bincount(codes, weights=sent.astype(np.float64), minlength=size)]
+    # Parsed entries hold 'YYYY-MM-DDTHH:MM:SS'; an explicit format works on every supported pandas
+    stamps = np.asarray(pd.to_datetime(pd.Series(dictionary, dtype=object), format='%Y-%m-%dT%H:%M:%S',
+                                       errors='coerce'), dtype='datetime64[m]')
+    used = ~np.isnat(stamps) & (per_code[0] > 0)
+
+    minutes, slots = np.unique(stamps[used].astype(np.int64), return_inverse=True)
+    sums = [np.bincount(slots, weights=values[used], minlength=len(minutes)).astype(np.int64) for values in per_code]
+    return (minutes, *sums)
+
+
+def _cached_buckets(key, compute):
+    with _cache_lock:
+        buckets = _cache.get(key)
+    inc('vns_cache_requests_total', cache='timeseries', result='miss' if buckets is None else 'hit')
+    if buckets is None:
+        buckets = compute()
+        if buckets is not None:
+            with _cache_lock:
+                _cache[key] = buckets
+    return buckets
+
+
+def get_dataset_buckets(dataset_id):
+    """Return the per-minute buckets of a stored dataset, or None if the dataset is unknown"""
+    def compute():
+        dataset = get_dataset_encoded(dataset_id)
+        return None if dataset is None else minute_buckets(dataset[2])
+
+    return _cached_buckets(('dataset', dataset_id), compute)
+
+
+def get_store_buckets(date_from=None, date_to=None):
+    """
+    Return the per-minute buckets of the log store between two days, inclusive.
+
+    Raises:
+        ValueError: A bound is not a YYYY-MM-DD date
+    """
+    def load(part):
+        return _cached_buckets(('part', part.path), lambda: minute_buckets(
+            {name: (part.codes(name), part.dictionaries.get(name)) for name in ('dateTime', 'statusCode', 'bytes')}))
+
+    parts = map_parts(load, date_from, date_to)
+    if not parts:
+        return tuple(np.array([], dtype=np.int64) for _ in range(1 + len(SERIES)))
+    # Parts of one day can share minutes; build_series adds them up
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def parse_bound(value, name):
+    """Read a from/to bound given as an ISO date or timestamp, returning epoch minutes or None"""
+    if not value:
+        return None
+    try:
+        stamp = np.datetime64(datetime.fromisoformat(value).replace(tzinfo=None), 'm')
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date or timestamp") from None
+    return int(stamp.astype(np.int64))
+
+
+def check_options(interval, points, method):
+    """
+    Check the interval, point budget and downsampling method of a query.
+
+    Raises:
+        ValueError: An option is outside what build_series accepts
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+    if not 2 * len(SERIES) <= points <= TIMESERIES_MAX_POINTS:
+        raise ValueError(f"points must be between {2 * len(SERIES)} and {TIMESERIES_MAX_POINTS}")
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {', '.join(METHODS)}")
+
+
+def lttb(values, budget):
+    """
+    Pick budget points of an evenly spaced series with largest triangle three buckets.
+
+    The first and last points are kept. The points between are split into
+    budget - 2 bins, and each bin keeps the point that makes the largest
+    triangle with the point kept before it and the mean of the next bin.
+
+    Returns:
+        Sorted int64 positions of the kept points
+    """
+    n = len(values)
+    if budget >= n:
+        return np.arange(n)
+    y = np.asarray(values, dtype=np.float64)
+    prefix = np.concatenate(([0.0], np.cumsum(y)))
+    edges = np.append(np.linspace(1, n - 1, budget - 1).astype(np.int64), n)
+    picked = np.empty(budget, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+
+    previous = 0
+    for i in range(budget - 2):
+        start, stop, next_stop = edges[i], edges[i + 1], edges[i + 2]
+        mean_x = (stop + next_stop - 1) / 2
+        mean_y = (prefix[next_stop] - prefix[stop]) / (next_stop - stop)
+        x = np.arange(start, stop)
+        area = np.abs((previous - mean_x) * (y[start:stop] - y[previous]) - (previous - x) * (mean_y - y[previous]))
+        previous = start + int(area.argmax())
+        picked[i + 1] = previous
+    return picked
+
+
+def min_max(values, budget):
+    """
+    Split a series into budget // 2 pixels and keep the lowest and highest point of each.
+
+    Returns:
+        Sorted int64 positions of the kept points
+    """
+    n = len(values)
+    pixels = budget // 2
+    if budget >= n or not pixels:
+        return np.arange(n)
+    pixel = np.arange(n) * pixels // n
+    # Sorting by (pixel, value) puts each pixel's minimum first and its maximum last
+    order = np.lexsort((values, pixel))
+    first = np.flatnonzero(np.diff(pixel, prepend=-1))
+    last = np.append(first[1:], n) - 1
+    return np.unique(np.concatenate((order[first], order[last])))
+
+
+def build_series(buckets, start=None, end=None, interval='1m', points=TIMESERIES_POINTS, method='lttb'):
+    """
+    Build the request, error and byte series of a window, downsampled to a point budget.
+
+    Args:
+        buckets: Per-minute buckets as returned by minute_buckets; minutes may repeat
+        start: First minute of the window (epoch minutes), or None for the first bucket
+        end: Minute the window ends before, or None for after the last bucket
+        interval: Bucket length, a key of INTERVALS; a coarser one is used when
+            the window would have more than TIMESERIES_MAX_BUCKETS buckets
+        points: Most points to return
+        method: 'lttb' or 'minmax'
+
+    Returns:
+        Dictionary with the interval used, the window, the number of buckets in
+        it, totals, whether the series were downsampled, and the series as
+        parallel lists of bucket start times and values
+
+    Raises:
+        ValueError: An option is invalid
+    """
+    check_options(interval, points, method)
+    minutes, *values = buckets
+    # The window is clipped to the data, so a wide range can't ask for millions of empty buckets
+    if len(minutes):
+        first, after_last = int(minutes.min()), int(minutes.max()) + 1
+        start = first if start is None else max(start, first)
+        end = after_last if end is None else min(end, after_last)
+
+    names = list(INTERVALS)
+    step = INTERVALS[interval]
+    if not len(minutes) or end <= start:
+        count = 0
+    else:
+        start -= start % step  # Buckets start on whole intervals
+        count = -(-(end - start) // step)
+        while count > TIMESERIES_MAX_BUCKETS and interval != names[-1]:
+            interval = names[names.index(interval) + 1]
+            step = INTERVALS[interval]
+            start -= start % step
+            count = -(-(end - start) // step)
+
+    series = {name: np.zeros(count, dtype=np.int64) for name in SERIES}
+    if count:
+        inside = (minutes >= start) & (minutes < end)
+        slots = (minutes[inside] - start) // step
+        for name, column in zip(SERIES, values):
+            series[name] = np.bincount(slots, weights=column[inside], minlength=count).astype(np.int64)
+
+    downsampled = count > points
+    if downsampled:
+        pick = lttb if method == 'lttb' else min_max
+        budget = points // len(SERIES)
+        kept = np.unique(np.concatenate([pick(series[name], budget) for name in SERIES]))
+    else:
+        kept = np.arange(count)
+
+    times = (start + kept * step if count else kept).astype('datetime64[m]')
+    return {
+        "interval": interval,
+        "bucketSeconds": step * 60,
+        "from": str(np.datetime64(start, 'm').astype('datetime64[s]')) if count else None,
+        "to": str(np.datetime64(start + count * step, 'm').astype('datetime64[s]')) if count else None,
+        "buckets": int(count),
+        "totals": {name: int(series[name].sum()) for name in SERIES},
+        "method": method if downsampled else None,
+        "points": len(kept),
+        "series": {
+            "time": np.datetime_as_string(times, unit='s').tolist(),
+            **{name: series[name][kept].tolist() for name in SERIES},
+        },
+    }
@@ -0,0 +1,41 @@
+import os
+from functools import lru_cache
+
+from metrics import register_collector, set_total
+
+# Distinct user agent strings remembered per process; logs repeat the same few hundred
+UA_CACHE_SIZE = int(os.getenv('UA_CACHE_SIZE', 10000))
+
+# A spread of common agents; parsing them loads and compiles ua-parser's regex tables
+WARMUP_USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'curl/8.4.0',
+    '-',
+]
+
+
+@lru_cache(maxsize=UA_CACHE_SIZE)
+def parse_user_agent(ua_string):
+    """Parse a user agent string with user_agents, memoising the result"""
+    from user_agents import parse
+    return parse(ua_string)
+
+
+def warm_user_agent_tables():
+    """Import user_agents and load its regex tables, e.g. in the gunicorn master before forking"""
+    for ua_string in WARMUP_USER_AGENTS:
+        parse_user_agent(ua_string)
+
+
+def _report_cache_stats():
+    info = parse_user_agent.cache_info()
+    set_total('vns_cache_requests_total', info.hits, cache='user_agent', result='hit')
+    set_total('vns_cache_requests_total', info.misses, cache='user_agent', result='miss')
+
+
+register_collector(_report_cache_stats)
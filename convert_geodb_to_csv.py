@@ -1,50 +1,172 @@
 import sqlite3
 import csv
 import os
+import sys
+import json
+import argparse
 
-def convert_db_to_csv():
+# The columnar snapshot format is shared with the Flask app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+FETCH_SIZE = 10000
+STATE_FILE = '.export_state.json'
+
+
+def stream_rows(cursor, query, params=()):
+    """Yield the rows of a query in fetchmany batches instead of fetchall"""
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        yield from rows
+
+
+def load_state(output_dir):
+    state_path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(output_dir, state):
+    state_path = os.path.join(output_dir, STATE_FILE)
+    with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def export_table(cursor, table_name, columns, output_file):
+    """Write a whole table to CSV, streaming rows from the database"""
+    count = 0
+    with open(output_file + '.tmp', 'w', newline='', encoding='utf-8') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(columns)  # Write header
+        for row in stream_rows(cursor, f"SELECT * FROM {table_name};"):
+            csvwriter.writerow(row)
+            count += 1
+    os.replace(output_file + '.tmp', output_file)
+    return count
+
+
+def merge_changed_rows(cursor, table_name, columns, output_file, since):
+    """
+    Merge rows changed since the previous export into an existing CSV.
+
+    Only rows whose last_api_call or last_successful_lookup is at or after the
+    previous watermark are read from the database. The existing CSV is streamed
+    through once, replacing changed rows in place and appending new ones.
+
+    Returns:
+        Tuple (changed row count, new watermark)
+    """
+    key = columns.index('ip_address')
+    changed = {}
+    watermark = since
+    query = (f"SELECT * FROM {table_name} "
+             "WHERE last_api_call >= ? OR last_successful_lookup >= ?;")
+    api_col, lookup_col = columns.index('last_api_call'), columns.index('last_successful_lookup')
+    for row in stream_rows(cursor, query, (since, since)):
+        changed[row[key]] = row
+        watermark = max(watermark, row[api_col] or 0, row[lookup_col] or 0)
+
+    if not changed:
+        return 0, watermark
+
+    pending = dict(changed)
+    with open(output_file, newline='', encoding='utf-8') as src, \
+         open(output_file + '.tmp', 'w', newline='', encoding='utf-8') as dst:
+        csvreader = csv.reader(src)
+        csvwriter = csv.writer(dst)
+        csvwriter.writerow(next(csvreader))
+        for row in csvreader:
+            csvwriter.writerow(pending.pop(row[key], row))
+        csvwriter.writerows(pending.values())
+    os.replace(output_file + '.tmp', output_file)
+    return len(changed), watermark
+
+
+def write_snapshot(cursor, snapshot_dir):
+    """Write the resolved geo_cache rows as a memory-mappable columnar snapshot"""
+    from geo_data import write_geo_snapshot
+
+    ips, lat, lng, city, country = [], [], [], [], []
+    query = ("SELECT ip_address, latitude, longitude, city, country FROM geo_cache "
+             "WHERE latitude IS NOT NULL AND longitude IS NOT NULL;")
+    for row in stream_rows(cursor, query):
+        ips.append(row[0])
+        lat.append(row[1])
+        lng.append(row[2])
+        city.append(row[3])
+        country.append(row[4])
+    return write_geo_snapshot(ips, lat, lng, city, country, snapshot_dir)
+
+
+def convert_db_to_csv(incremental=False, snapshot_dir=None, db_path='geolocation_cache.db', output_dir='csv_output'):
     # Connect to the SQLite database
-    conn = sqlite3.connect('geolocation_cache.db')
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
-    
+
     # Get all tables in the database
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
     tables = cursor.fetchall()
-    
+
     if not tables:
         print("No tables found in the database.")
         return
-    
+
     print(f"Found {len(tables)} tables in the database.")
-    
+
     # Create a directory for output CSV files if it doesn't exist
-    if not os.path.exists('csv_output'):
-        os.makedirs('csv_output')
-    
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    state = load_state(output_dir)
+
     # For each table, export to CSV
     for table in tables:
         table_name = table[0]
-        print(f"Exporting table: {table_name}")
-        
+
         # Get column names
         cursor.execute(f"PRAGMA table_info({table_name});")
         columns = [column[1] for column in cursor.fetchall()]
-        
-        # Get all data from the table
-        cursor.execute(f"SELECT * FROM {table_name};")
-        rows = cursor.fetchall()
-        
-        # Write to CSV
-        output_file = os.path.join('csv_output', f"{table_name}.csv")
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(columns)  # Write header
-            csvwriter.writerows(rows)    # Write data
-        
-        print(f"Exported {len(rows)} rows to {output_file}")
-    
+
+        output_file = os.path.join(output_dir, f"{table_name}.csv")
+        can_merge = {'ip_address', 'last_api_call', 'last_successful_lookup'} <= set(columns)
+
+        if incremental and can_merge and table_name in state and os.path.exists(output_file):
+            print(f"Merging changes into table export: {table_name}")
+            count, watermark = merge_changed_rows(cursor, table_name, columns, output_file, state[table_name])
+            print(f"Merged {count} changed rows into {output_file}")
+        else:
+            print(f"Exporting table: {table_name}")
+            watermark = None
+            if can_merge:
+                cursor.execute(f"SELECT MAX(MAX(COALESCE(last_api_call, 0), COALESCE(last_successful_lookup, 0))) "
+                               f"FROM {table_name};")
+                watermark = cursor.fetchone()[0] or 0
+            count = export_table(cursor, table_name, columns, output_file)
+            print(f"Exported {count} rows to {output_file}")
+
+        if watermark is not None:
+            state[table_name] = watermark
+
+    save_state(output_dir, state)
+
+    if snapshot_dir:
+        count = write_snapshot(cursor, snapshot_dir)
+        print(f"Wrote columnar snapshot of {count} rows to {snapshot_dir}")
+
     conn.close()
     print("Conversion completed successfully!")
 
 if __name__ == "__main__":
-    convert_db_to_csv() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Export geolocation_cache.db to CSV")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only merge rows changed since the previous export into the existing CSV")
+    parser.add_argument('--snapshot', nargs='?', const=os.path.join('csv_output', 'geo_cache_snapshot'),
+                        help="Also write a memory-mappable columnar snapshot (default: csv_output/geo_cache_snapshot)")
+    args = parser.parse_args()
+
+    convert_db_to_csv(incremental=args.incremental, snapshot_dir=args.snapshot)
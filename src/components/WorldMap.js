@@ -1,7 +1,7 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { MapContainer, TileLayer, Tooltip, CircleMarker, Popup, ZoomControl } from 'react-leaflet';
 import 'leaflet/dist/leaflet.css';
-import { loadGeolocationData } from '../utils/csvParser';
+import { lookupGeolocationData } from '../utils/csvParser';
 
 const WorldMap = ({ logData, anomalyData }) => {
   const [locationData, setLocationData] = useState([]);
@@ -26,22 +26,35 @@ const WorldMap = ({ logData, anomalyData }) => {
     }
   }, [anomalyData]);
   
-  // Load geolocation data from CSV
+  // Look up geolocation data for the IPs in the logs that we haven't seen yet
+  const requestedIPs = useRef(new Set());
   useEffect(() => {
+    if (!logData || logData.length === 0) {
+      setIsLoading(false);
+      return;
+    }
+
+    const newIPs = [...new Set(logData.map(entry => entry.ipAddress))]
+      .filter(ip => !requestedIPs.current.has(ip));
+    if (newIPs.length === 0) return;
+    newIPs.forEach(ip => requestedIPs.current.add(ip));
+
     async function fetchGeoData() {
       setIsLoading(true);
       try {
-        const data = await loadGeolocationData();
-        setGeoData(data);
+        const data = await lookupGeolocationData(newIPs);
+        setGeoData(prev => ({ ...prev, ...data }));
       } catch (error) {
         console.error('Failed to load geolocation data:', error);
+        // Forget these IPs so the next update asks for them again
+        newIPs.forEach(ip => requestedIPs.current.delete(ip));
       } finally {
         setIsLoading(false);
       }
     }
     
     fetchGeoData();
-  }, []);
+  }, [logData]);
   
   useEffect(() => {
     if (!logData || logData.length === 0 || Object.keys(geoData).length === 0) return;
@@ -20,3 +20,22 @@ export const loadGeolocationData = async () => {
     return {};
   }
 }; 
+
+// Function to look up geolocation data for a list of IP addresses
+// Throws if the lookup fails, so the caller can ask for the same IPs again later
+export const lookupGeolocationData = async (ips) => {
+  const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/geolocation-lookup`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ ips })
+  });
+
+  if (!response.ok) {
+    throw new Error(`Failed to look up geolocation data: ${response.status} ${response.statusText}`);
+  }
+
+  const geoData = await response.json();
+
+  // Return data if valid, otherwise empty object
+  return geoData && typeof geoData === 'object' ? geoData : {};
+};